@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Måler nvdbfagdata2records mot den gamle utgaven som tok deepcopy av egenskapene for hvert vegsegment
+
+Bruker en lagret side med vegobjekter fra NVDB api. Finnes ikke filen hentes én side (1000 objekter)
+av angitt objekttype og lagres, slik at senere målinger bruker nøyaktig samme data.
+
+    python benchmark/fagdata2records.py                         # Fartsgrense (105), fart_side.json
+    python benchmark/fagdata2records.py 10 rekkverk_side.json   # Rekkverk
+
+Sjekker også at begge utgavene gir samme rader.
+"""
+import gc
+import json
+import os
+import sys
+import time
+from copy import deepcopy
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+import nvdbapiv3
+from nvdbapiv3.nvdbapiv3 import egenskaper2records, merge_dicts
+
+def hentside( objekttype, filnavn ):
+    """Leser lagret side med vegobjekter, evt henter én side fra NVDB api og lagrer den"""
+    if not os.path.exists( filnavn ):
+        sok = nvdbapiv3.nvdbFagdata( objekttype )
+        sok.nestePaginering( )
+        with open( filnavn, 'w', encoding='utf-8' ) as f:
+            json.dump( sok.data['objekter'], f, ensure_ascii=False )
+
+    with open( filnavn, encoding='utf-8' ) as f:
+        return json.load( f )
+
+def deepcopy_records( feature_eller_liste, relasjoner=True, geometri=False ):
+    """nvdbfagdata2records( vegsegmenter=True ) slik den var før: deepcopy og merge_dicts per vegsegment"""
+    mydata = [ ]
+    for feat in feature_eller_liste:
+        if not 'geometri' in feat.keys():
+            continue
+
+        meta = { }
+        meta['objekttype']  = feat['metadata']['type']['id']
+        meta['nvdbId'] = feat['id']
+        meta['versjon'] = feat['metadata']['versjon']
+        meta['startdato'] = feat['metadata']['startdato']
+        if 'sluttdato' in feat['metadata'].keys():
+            meta['sluttdato'] = feat['metadata']['sluttdato']
+
+        egenskaper = egenskaper2records( feat['egenskaper'], relasjoner=False, geometri=geometri )
+        if relasjoner and 'relasjoner' in feat.keys() and len( feat['relasjoner']) > 0:
+            egenskaper['relasjoner'] = feat['relasjoner']
+
+        egenskaper = merge_dicts( meta, egenskaper)
+
+        for seg in feat['vegsegmenter']:
+            s2 = {  'veglenkesekvensid' : seg['veglenkesekvensid'],
+                    'detaljnivå'        : seg['detaljnivå'],
+                    'typeVeg'           : seg['typeVeg'],
+                    'kommune'           : seg['kommune'],
+                    'fylke'             : seg['fylke']
+                    }
+
+            if 'vegsystemreferanse' in seg.keys() and 'kortform' in seg['vegsystemreferanse'].keys():
+                s2['vref'] = seg['vegsystemreferanse']['kortform']
+
+            if 'veglenkeType' in seg:
+                s2['veglenkeType'] = seg['veglenkeType']
+
+            if 'medium' in seg:
+                s2['medium'] = seg['medium']
+
+            vr = 'vegsystemreferanse'
+            if 'vegsystem' in seg[vr].keys():
+                s2['vegkategori'] = seg[vr]['vegsystem']['vegkategori']
+                s2['fase'] = seg[vr]['vegsystem']['fase']
+                if 'nummer' in seg[vr]['vegsystem']:
+                    s2['vegnummer'] = seg[vr]['vegsystem']['nummer']
+
+            if 'startposisjon' in seg.keys() and 'sluttposisjon' in seg.keys():
+                s2['startposisjon'] = seg['startposisjon']
+                s2['sluttposisjon'] = seg['sluttposisjon']
+                s2['segmentlengde']        = seg['lengde']
+            elif 'relativPosisjon' in seg.keys():
+                s2['relativPosisjon'] = seg['relativPosisjon']
+
+            if 'strekning' in seg[vr].keys() and 'adskilte_løp' in seg[vr]['strekning']:
+                s2['adskilte_lop'] = seg[vr]['strekning']['adskilte_løp']
+
+            for hvaslag in [ 'strekning', 'kryssystem', 'sideanlegg']:
+                if  hvaslag in seg['vegsystemreferanse'].keys():
+                    s2['trafikantgruppe'] = seg['vegsystemreferanse'][hvaslag]['trafikantgruppe']
+
+            s2['geometri'] = seg['geometri']['wkt']
+            egenskaper_kopi = deepcopy( egenskaper )
+            egenskaper_kopi = merge_dicts( egenskaper_kopi, s2)
+            mydata.append( egenskaper_kopi )
+
+    return mydata
+
+def maal( funksjon, objekter, gjentak=5 ):
+    """Beste tid av gjentak forsøk, i sekunder. Uten søppeltømming underveis (som timeit)"""
+    tider = [ ]
+    for ii in range( gjentak ):
+        gc.collect( )
+        gc.disable( )
+        t0 = time.perf_counter( )
+        funksjon( objekter )
+        tider.append( time.perf_counter( ) - t0 )
+        gc.enable( )
+    return min( tider )
+
+if __name__ == '__main__':
+    objekttype = int( sys.argv[1] ) if len( sys.argv ) > 1 else 105
+    filnavn = sys.argv[2] if len( sys.argv ) > 2 else 'fart_side.json'
+
+    objekter = hentside( objekttype, filnavn )
+    gammel = deepcopy_records( objekter )
+    ny = nvdbapiv3.nvdbfagdata2records( objekter )
+    assert gammel == ny, 'Ulikt resultat fra gammel og ny nvdbfagdata2records'
+
+    tgammel = maal( deepcopy_records, objekter )
+    tny = maal( nvdbapiv3.nvdbfagdata2records, objekter )
+    print( len( objekter ), 'objekter,', len( ny ), 'rader fra', filnavn )
+    print( 'deepcopy per vegsegment  {:8.3f} s'.format( tgammel ) )
+    print( 'nvdbfagdata2records      {:8.3f} s  ({:.1f} ganger raskere)'.format( tny, tgammel / tny ) )
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Måler minnebruk for vegnett og vegobjekter som dictionaries mot kompaktvegsegment / kompaktvegobjekt
+
+Bruker en lagret side med data fra NVDB api. Finnes ikke filen hentes én side (segmentert vegnett
+eller vegobjekter av angitt objekttype) og lagres. Siden gjentas slik at vi får et stort antall
+objekter, hver kopi oversettes fra JSON-tekst på ny slik at ingen objekter deles.
+
+    python benchmark/kompakt.py                                 # Vegnett, vegnett_side.json, 100 gjentak
+    python benchmark/kompakt.py 105 fart_side.json 50           # Fartsgrense
+
+Minnet måles med tracemalloc, og er det som fortsatt er i bruk når alle objektene er laget.
+"""
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+import nvdbapiv3
+from nvdbapiv3 import kompaktvegobjekt, kompaktvegsegment
+
+def hentside( hva, filnavn ):
+    """Leser lagret side fra NVDB api, evt henter én side (vegnett eller objekttype) og lagrer den"""
+    if not os.path.exists( filnavn ):
+        sok = nvdbapiv3.nvdbVegnett( ) if hva == 'vegnett' else nvdbapiv3.nvdbFagdata( int( hva ) )
+        sok.nestePaginering( )
+        with open( filnavn, 'w', encoding='utf-8' ) as f:
+            json.dump( sok.data['objekter'], f, ensure_ascii=False )
+
+    with open( filnavn, encoding='utf-8' ) as f:
+        return json.load( f )
+
+def maalminne( lag, tekster ):
+    """Minne (bytes) i bruk for alle objektene, og objektene selv"""
+    tracemalloc.start( )
+    objekter = [ lag( json.loads( tekst ) ) for tekst in tekster ]
+    iBruk, topp = tracemalloc.get_traced_memory( )
+    tracemalloc.stop( )
+    return iBruk, objekter
+
+if __name__ == '__main__':
+    hva = sys.argv[1] if len( sys.argv ) > 1 else 'vegnett'
+    filnavn = sys.argv[2] if len( sys.argv ) > 2 else hva + '_side.json'
+    gjentak = int( sys.argv[3] ) if len( sys.argv ) > 3 else 100
+
+    side = hentside( hva, filnavn )
+    tekster = [ json.dumps( obj, ensure_ascii=False ) for obj in side ] * gjentak
+    kompakt = kompaktvegsegment if hva == 'vegnett' else kompaktvegobjekt
+
+    dictminne, dicter = maalminne( lambda obj : obj, tekster )
+    del dicter
+    kompaktminne, kompakte = maalminne( kompakt, tekster )
+    assert all( k.json( ) == obj for k, obj in zip( kompakte, side ) ), 'kompakt.json() gir ikke opprinnelig data'
+
+    print( '{} objekter ({} fra {} x {})'.format( len( tekster ), len( side ), filnavn, gjentak ) )
+    print( 'dictionaries          {:8.1f} MB'.format( dictminne / 1e6 ) )
+    print( '{:22s}{:8.1f} MB  ({:.0%} av dictionaries)'.format( kompakt.__name__, kompaktminne / 1e6,
+                                                                  kompaktminne / dictminne ) )
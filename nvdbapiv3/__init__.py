@@ -1,3 +1,7 @@
 from .nvdbapiv3 import *
 from .nvdb2geojson import *
-from .apiforbindelse import apiforbindelse
+from .apiforbindelse import apiforbindelse, retrypolicy, settratebegrensning, konfigurersesjoner
+from .nvdbasync import asyncforbindelse
+from .httpcache import setthttpcache
+from .datakatalog import settdatakatalogcache
+from .kompakt import kompaktvegobjekt, kompaktvegsegment
@@ -5,25 +5,323 @@ Kommunikasjon mot NVDB api v3 LES og SKRIV
 apiforbindelse - Klasse som håndterer alt det praktiske med 
 innlogging mot NVDB api skriv eller les. 
 
+retrypolicy - Regler for å prøve http-kall på ny (antall forsøk, eksponentiell 
+ventetid med tilfeldig spredning, Retry-After), felles for alle kall mot NVDB api. 
+
+ratebegrenser - Felles (for hele python-prosessen) begrensning på antall kall per 
+sekund og antall samtidige kall mot hvert miljø. Settes med settratebegrensning. 
+
+delt_sesjon - Felles http-sesjon (og dermed felles pool med åpne tilkoblinger) per 
+miljø, slik at vi slipper ny TLS-handshake for hvert søkeobjekt og hvert oppslag. 
+Størrelse på tilkoblingspoolen justeres med konfigurersesjoner. 
+
+httpcache - Valgfri lokal cache på disk for svar fra NVDB api LES, slås på med 
+setthttpcache (se modulen httpcache). 
+
 
 """ 
+import asyncio
 import uuid
 import getpass
 import requests
 import json
 import copy 
 import pdb
-from time import sleep
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import sleep, monotonic
+from requests.adapters import HTTPAdapter
 from requests.exceptions import SSLError, ChunkedEncodingError,  ConnectionError
 from urllib3.exceptions import ProtocolError 
 from http.client import RemoteDisconnected
+from .httpcache import httpcache
+
+# Feil fra nettverk/tilkobling som det er verdt å prøve på ny
+NETTVERKSFEIL = (SSLError, ChunkedEncodingError, ConnectionError, RemoteDisconnected, ProtocolError)
+
+class retrypolicy( ): 
+    """
+    Regler for når og hvor lenge vi venter før vi prøver et http-kall på ny. 
+
+    Ventetiden øker eksponentielt (basis * 2^(forsøk-1), maks maks_ventetid) og trekkes tilfeldig 
+    mellom 0 og denne verdien ("full jitter"), slik at mange parallelle jobber ikke prøver på ny 
+    i takt. Hvis NVDB api svarer med http-headeren Retry-After så venter vi minst så lenge. 
+
+    Eksempel
+        regel = retrypolicy( maks_forsok=8, statuskoder={ 503 : 3, 504 : None } )
+        forb = apiforbindelse( retry=regel )
+    """
+
+    def __init__( self, maks_forsok=5, basis=1.0, maks_ventetid=60, statuskoder=None, 
+                        retry_after=True, jitter=True ): 
+        """
+        Keywords: 
+            maks_forsok=5 : Maks antall forsøk totalt (første forsøk inkludert) 
+
+            basis=1.0 : Ventetid (sekunder) før andre forsøk, dobles for hvert nye forsøk 
+
+            maks_ventetid=60 : Øvre grense for ventetid (sekunder) mellom to forsøk
+
+            statuskoder=None : Dictionary { http statuskode : maks antall forsøk } for de 
+                               statuskodene vi skal prøve på ny. Maks antall forsøk lik None 
+                               betyr maks_forsok. Default { 429, 502, 503, 504 }. 
+
+            retry_after=True : Respekter http-headeren Retry-After 
+
+            jitter=True : Trekk tilfeldig ventetid mellom 0 og beregnet ventetid
+        """
+        if statuskoder is None: 
+            statuskoder = { 429 : None, 502 : None, 503 : None, 504 : None } 
+        elif not isinstance( statuskoder, dict ): 
+            statuskoder = { kode : None for kode in statuskoder }
+
+        self.maks_forsok    = maks_forsok
+        self.basis          = basis
+        self.maks_ventetid  = maks_ventetid
+        self.statuskoder    = statuskoder
+        self.retry_after    = retry_after
+        self.jitter         = jitter
+
+    def uten( self, *statuskoder ): 
+        """Returnerer kopi av regelsettet der vi ikke prøver på ny for angitte statuskoder"""
+        kopi = copy.copy( self )
+        kopi.statuskoder = { k : v for k, v in self.statuskoder.items() if k not in statuskoder }
+        return kopi 
+
+    def skalprove( self, forsok, statuskode=None ): 
+        """
+        Avgjør om vi skal prøve på ny etter at forsok antall forsøk har feilet. 
+        Uten statuskode gjelder det nettverksfeil, ugyldig JSON o.l.
+        """
+        if statuskode is None: 
+            return forsok < self.maks_forsok 
+
+        if statuskode not in self.statuskoder: 
+            return False
+
+        maks = self.statuskoder[statuskode]
+        if maks is None: 
+            maks = self.maks_forsok
+        return forsok < maks 
+
+    def ventetid( self, forsok, respons=None ): 
+        """Hvor mange sekunder vi skal vente etter at forsok antall forsøk har feilet"""
+        tid = min( self.maks_ventetid, self.basis * 2 ** ( forsok - 1 ) )
+        if self.jitter: 
+            tid = random.uniform( 0, tid )
+
+        if self.retry_after and respons is not None: 
+            tid = max( tid, _retry_after( respons ) )
+
+        return tid 
+
+    def vent( self, forsok, respons=None, melding=None ): 
+        """Venter før neste forsøk, skriver evt melding til konsoll"""
+        tid = self.ventetid( forsok, respons=respons )
+        if melding: 
+            print( melding, '- forsøk', forsok, 'av', self.maks_forsok, ', prøver på ny om', round( tid, 1), 'sekunder' )
+        sleep( tid )
+
+def _retry_after( respons ): 
+    """Leser http-headeren Retry-After (sekunder eller dato). Returnerer 0 hvis den ikke finnes eller er ugyldig"""
+    verdi = respons.headers.get( 'Retry-After' ) if respons.headers else None 
+    if not verdi: 
+        return 0 
+
+    try: 
+        return max( 0, float( verdi ) )
+    except ValueError: 
+        pass 
+
+    try: 
+        tidspunkt = parsedate_to_datetime( verdi )
+        return max( 0, ( tidspunkt - datetime.now( timezone.utc ) ).total_seconds() )
+    except ( TypeError, ValueError ): 
+        return 0 
+
+# Felles regelsett for alle forbindelser som ikke har fått sitt eget
+standard_retrypolicy = retrypolicy()
+
+class ratebegrenser( ): 
+    """
+    Begrenser antall kall per sekund (token bucket) og antall samtidige kall (semafor). 
+
+    Brukes som context manager rundt hvert enkelt http-kall: 
+        with begrenser: 
+            r = requests.get( ... ) 
+
+    eller som asynkron context manager (asyncforbindelse), som venter uten å blokkere event-løkka: 
+        async with begrenser: 
+            ...
+
+    Én instans per miljø deles av alle apiforbindelse- og asyncforbindelse-objekter i python-prosessen, 
+    uansett hvor mange søkeobjekter og tråder du har. Se settratebegrensning. 
+    """
+
+    def __init__( self, maks_per_sekund=None, maks_samtidige=None, burst=None ): 
+        """
+        Keywords: 
+            maks_per_sekund=None : Maks antall kall per sekund i snitt. None = ubegrenset 
+
+            maks_samtidige=None : Maks antall kall som er underveis samtidig. None = ubegrenset
+
+            burst=None : Hvor mange kall vi kan sende i en kort støt før vi må vente. 
+                         Default er maks_per_sekund (minst 1)
+        """
+        self.maks_per_sekund = maks_per_sekund
+        self.maks_samtidige  = maks_samtidige 
+        if burst is None and maks_per_sekund: 
+            burst = max( 1, maks_per_sekund )
+        self.burst = burst
+
+        self._polletter = burst 
+        self._sistfylt = monotonic() 
+        self._lock = threading.Lock()
+        self._semafor = None 
+        if maks_samtidige: 
+            self._semafor = threading.BoundedSemaphore( maks_samtidige )
+
+    def _provpolett( self ): 
+        """Bruker en polett (token) hvis bøtta har en og returnerer 0, ellers hvor lenge vi må vente (sekunder)"""
+        if not self.maks_per_sekund: 
+            return 0 
+
+        with self._lock: 
+            naa = monotonic()
+            self._polletter = min( self.burst, self._polletter + ( naa - self._sistfylt ) * self.maks_per_sekund )
+            self._sistfylt = naa 
+            if self._polletter >= 1: 
+                self._polletter -= 1
+                return 0 
+            return ( 1 - self._polletter ) / self.maks_per_sekund
+
+    def _ventpolett( self ): 
+        """Venter til vi har en polett (token) i bøtta, og bruker den"""
+        ventetid = self._provpolett()
+        while ventetid: 
+            sleep( ventetid )
+            ventetid = self._provpolett()
+
+    def __enter__( self ): 
+        if self._semafor: 
+            self._semafor.acquire()
+        try: 
+            self._ventpolett()
+        except BaseException: 
+            if self._semafor: 
+                self._semafor.release()
+            raise 
+        return self 
+
+    def __exit__( self, *args ): 
+        if self._semafor: 
+            self._semafor.release()
+        return False 
+
+    async def __aenter__( self ): 
+        # Samme semafor og bøtte som __enter__, men vi venter med asyncio.sleep 
+        if self._semafor: 
+            while not self._semafor.acquire( blocking=False ): 
+                await asyncio.sleep( 0.01 )
+        try: 
+            ventetid = self._provpolett()
+            while ventetid: 
+                await asyncio.sleep( ventetid )
+                ventetid = self._provpolett()
+        except BaseException: 
+            if self._semafor: 
+                self._semafor.release()
+            raise 
+        return self 
+
+    async def __aexit__( self, *args ): 
+        return self.__exit__( *args )
+
+_ratebegrensere = { }
+_ratebegrensere_lock = threading.Lock()
+
+def ratebegrensning( miljo ): 
+    """Returnerer den felles ratebegrenseren for angitt miljø (f.eks. 'prodles'), oppretter en ubegrenset ved behov"""
+    with _ratebegrensere_lock: 
+        if miljo not in _ratebegrensere: 
+            _ratebegrensere[miljo] = ratebegrenser( )
+        return _ratebegrensere[miljo]
+
+def settratebegrensning( miljo, maks_per_sekund=None, maks_samtidige=None, burst=None ): 
+    """
+    Setter felles begrensning på trafikken mot et miljø for alle apiforbindelser i denne python-prosessen. 
+
+    Eksempel
+        settratebegrensning( 'prodles', maks_per_sekund=20, maks_samtidige=8 )
+
+    ARGUMENTS
+        miljo - tekst, en av miljøene i apiforbindelse.velgmiljo, f.eks 'prodles' eller 'prodskriv' 
+
+    KEYWORDS
+        maks_per_sekund=None, maks_samtidige=None, burst=None : Se ratebegrenser. None = ubegrenset 
+
+    RETURNS
+        ratebegrenser-objektet som nå brukes for dette miljøet 
+    """
+    with _ratebegrensere_lock: 
+        _ratebegrensere[miljo] = ratebegrenser( maks_per_sekund=maks_per_sekund, 
+                                    maks_samtidige=maks_samtidige, burst=burst )
+        return _ratebegrensere[miljo]
+
+# Innstillinger for tilkoblingspoolen til de delte http-sesjonene
+_poolinnstillinger = { 'pool_connections' : 10, 'pool_maxsize' : 32 }
+_sesjoner = { }
+_sesjoner_lock = threading.Lock()
+
+def _nysesjon( ): 
+    """Lager ny requests-sesjon med tilkoblingspool etter gjeldende innstillinger"""
+    sesjon = requests.session()
+    adapter = HTTPAdapter( **_poolinnstillinger )
+    sesjon.mount( 'https://', adapter )
+    sesjon.mount( 'http://', adapter )
+    return sesjon 
+
+def delt_sesjon( miljo ): 
+    """
+    Returnerer den felles http-sesjonen for angitt miljø (f.eks. 'prodles'), oppretter den ved behov. 
+
+    Alle apiforbindelser som ikke er logget inn deler denne sesjonen, og dermed også åpne 
+    tilkoblinger mot NVDB api. Trådsikker. 
+    """
+    with _sesjoner_lock: 
+        if miljo not in _sesjoner: 
+            _sesjoner[miljo] = _nysesjon()
+        return _sesjoner[miljo]
+
+def konfigurersesjoner( pool_connections=10, pool_maxsize=32 ): 
+    """
+    Justerer størrelsen på tilkoblingspoolen for de delte http-sesjonene. 
+
+    Gjelder nye sesjoner, og eksisterende delte sesjoner får ny pool. Øk pool_maxsize hvis 
+    du har mange tråder som henter data samtidig (f.eks. prefetch eller to_records_parallell), 
+    ellers må trådene vente på hverandre eller åpne nye tilkoblinger som kastes etter bruk. 
+
+    KEYWORDS
+        pool_connections=10 : Antall ulike verter (host) vi holder tilkoblinger til 
+
+        pool_maxsize=32 : Maks antall åpne tilkoblinger per vert 
+    """
+    with _sesjoner_lock: 
+        _poolinnstillinger['pool_connections'] = pool_connections 
+        _poolinnstillinger['pool_maxsize'] = pool_maxsize 
+        for sesjon in _sesjoner.values(): 
+            adapter = HTTPAdapter( **_poolinnstillinger )
+            sesjon.mount( 'https://', adapter )
+            sesjon.mount( 'http://', adapter )
 
 class apiforbindelse( ):
     """
     Håndterer innlogging og kommunikasjon mot NVDB api LES og SKRIV .
     """
     
-    def __init__( self, miljo='prodles' ):
+    def __init__( self, miljo='prodles', retry=None ):
         """
         Oppretter en instans av apiskrivforbindelse
         
@@ -39,15 +337,24 @@ class apiforbindelse( ):
                     prodskriv
 
                     (Kan droppes hvis den settes ved innlogging)
+
+            retry: None eller instans av retrypolicy. Default er det felles 
+                   regelsettet standard_retrypolicy
                 
         """ 
+        if retry is None: 
+            retry = standard_retrypolicy 
+        self.retry = retry 
         
         self.headers = {    
                             "X-Client" : "LtGlahn python", "User-Agent" : "LtGlahn python requests"
                               }
         self.tokenId = ''
-        self.requestsession = requests.session()
+        # Delt http-sesjon per miljø frem til vi logger inn, da får vi egen sesjon
+        self.innlogget = False 
+        self.requestsession = delt_sesjon( miljo )
         self.headers['X-Client-Session'] = str( uuid.uuid4() )
+        self.miljo = None
         if miljo:
             self.velgmiljo( miljo=miljo)
         self.proxies = None
@@ -61,6 +368,8 @@ class apiforbindelse( ):
                          NVDB api SKRIV v3: utvskriv, testskriv, prodskriv
         """ 
         self.miljo = miljo
+        if not self.innlogget: 
+            self.requestsession = delt_sesjon( miljo )
 
         self.headers['Accept'] = 'application/vnd.vegvesen.nvdb-v3-rev1+json'
               
@@ -166,7 +475,8 @@ class apiforbindelse( ):
         headers = { 'Content-Type' : 'application/json'}
 
 
-        self.requestsession = requests.session()
+        self.innlogget = True 
+        self.requestsession = _nysesjon()
         loginurl = url=self.apiurl + '/auth/login'
         self.loginrespons = self.requestsession.post( loginurl, 
                                                             headers=headers, json=body  )
@@ -207,6 +517,9 @@ class apiforbindelse( ):
                     "Accept" : "application/json", 
                     "X-Client" : klient }
         
+        # Egen sesjon for innlogget bruker, så vi ikke deler informasjonskapsler med andre 
+        self.innlogget = True 
+        self.requestsession = _nysesjon()
         self.loginrespons = self.requestsession.post( url=self.skrivloginurl, 
                                         headers=headers, 
                                         json=body )
@@ -292,20 +605,46 @@ class apiforbindelse( ):
         else: 
             url = self.apiurl + path
         
-
-        return self.requestsession.post( url=url, 
-                                            proxies=self.proxies, 
-                                            headers=self.headers, 
-                                            json = data, **kwargs)
+        # Skriveoperasjoner er ikke idempotente. Vi prøver kun på ny når NVDB api eksplisitt 
+        # sier at forespørselen ikke ble behandlet (429, 503), ikke ved nettverksfeil og timeout
+        retry = self.retry.uten( 502, 504 )
+        forsok = 0 
+        while True: 
+            forsok += 1
+            with ratebegrensning( self.miljo ): 
+                r = self.requestsession.post( url=url, 
+                                                proxies=self.proxies, 
+                                                headers=self.headers, 
+                                                json = data, **kwargs)
+
+            if r.status_code in ( 429, 503 ) and retry.skalprove( forsok, r.status_code ): 
+                retry.vent( forsok, respons=r, melding='Http ' + str( r.status_code) + ' ' + url )
+            else: 
+                return r 
         
-    def les( self, path, headers={}, **kwargs): 
+    def les( self, path, headers={}, retry=None, cache=True, **kwargs): 
         """
         Http GET requests til NVDB REST skriveapi eller leseapi 
+
+        Nettverksfeil og http statuskoder som 429, 502, 503 og 504 prøves på ny etter 
+        reglene i self.retry (se retrypolicy). Når vi har gitt opp får du den siste 
+        responsen fra NVDB api, evt feilmeldingen fra requests-biblioteket. 
+
+        Alle kall går via den felles ratebegrenseren for miljøet, se settratebegrensning. 
+        Med stream=True regnes kallet som ferdig når vi har fått http-headerne. 
+
+        Er lokal cache slått på (se setthttpcache) får du lagret svar så lenge det er ferskt, 
+        deretter spør vi NVDB api om svaret er endret (If-None-Match / If-Modified-Since). Gjelder 
+        ikke innloggede forbindelser og stream=True. 
         
         Arguments:
             path : URL, enten relativt til rot-endepunt for API, eller fullstendig 
             
         Keywords: 
+            retry : None eller instans av retrypolicy som overstyrer self.retry for dette kallet
+
+            cache : True | False. Sett False for å gå forbi lokal cache for dette kallet 
+
             Eventuelle nøkkelord-argumenter sendes til python request-modulen
         """
         
@@ -314,25 +653,54 @@ class apiforbindelse( ):
         else: 
             url = self.apiurl + path
 
+        if retry is None: 
+            retry = self.retry 
+
         # Kopierer self.headers og angitte headers over i ny dictionary. 
         myheaders = { **self.headers, **headers}
 
+        # Lokal cache, gir lagret svar hvis det er ferskt og legger ellers på headere for betinget GET 
+        if cache and not self.innlogget and not kwargs.get( 'stream' ): 
+            cache = httpcache()
+        else: 
+            cache = None 
+
+        if cache: 
+            nokkel = cache.nokkel( url, kwargs.get( 'params' ), myheaders )
+            lagret, fersk = cache.hent( nokkel )
+            if fersk: 
+                return lagret 
+            myheaders.update( cache.valideringsheadere( lagret ) )
+
         """Leser data fra NVDB api"""
-        try:
-            r = self.requestsession.get( url=url, 
-                                       proxies=self.proxies,
-                                       headers=myheaders, 
-                                       **kwargs)
-        except (SSLError, ChunkedEncodingError, ConnectionError, RemoteDisconnected, ProtocolError, RemoteDisconnected) as e:
-            venteperiode = 5
-            print( 'Feilmelding ved henting av data, prøver på ny om', venteperiode, 'sekunder', e)
-            sleep( 5 )
-            r = self.requestsession.get( url=url, 
-                                       proxies=self.proxies,
-                                       headers=myheaders, 
-                                       **kwargs)        
-        
-        return r 
+        forsok = 0 
+        while True: 
+            forsok += 1 
+            try:
+                with ratebegrensning( self.miljo ): 
+                    r = self.requestsession.get( url=url, 
+                                               proxies=self.proxies,
+                                               headers=myheaders, 
+                                               **kwargs)
+            except NETTVERKSFEIL as e:
+                if not retry.skalprove( forsok ): 
+                    raise 
+                retry.vent( forsok, melding='Feilmelding ved henting av data ' + str( e ) )
+                continue 
+
+            if retry.skalprove( forsok, r.status_code ): 
+                retry.vent( forsok, respons=r, melding='Http ' + str( r.status_code) + ' ' + url )
+                r.close()
+                continue 
+
+            if cache: 
+                if r.status_code == 304 and lagret is not None: 
+                    r.close()
+                    cache.fornyet( nokkel )
+                    return lagret 
+                cache.lagre( nokkel, r )
+
+            return r 
 
     def finnid( self, objektid, kunvegnett=False, kunfagdata=False, miljo=False): 
         """Henter NVDB objekt (enten veglenke eller fagdata) ut fra objektID.
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Felles (for hele python-prosessen) mellomlager for datakatalogen, dvs definisjonene av vegobjekttyper
+
+Hvert søkeobjekt nvdbFagdata( objTypeID ) trenger definisjonen av objekttypen. I stedet for å spørre
+NVDB api om vegobjekttyper/<id> for hvert søkeobjekt henter vi alle definisjonene i ett kall
+(vegobjekttyper?inkluder=alle), og gjenbruker dem. Datakatalogen har versjonsnummer (fra endepunktet
+status). Når versjonen endres henter vi definisjonene på nytt.
+
+Som standard holdes definisjonene kun i minnet. Angir du en katalog lagres de også som JSON-fil
+på disk, slik at neste kjøring med samme datakatalog-versjon kun trenger ett kall mot status.
+
+    from nvdbapiv3 import settdatakatalogcache
+    from nvdbapiv3.datakatalog import STANDARDKATALOG
+    settdatakatalogcache( katalog='minkatalog', sjekkintervall=600 )
+    settdatakatalogcache( katalog=STANDARDKATALOG )   # ~/.nvdbapiv3
+    settdatakatalogcache( aktiv=False ) # Hvert søkeobjekt henter sin definisjon fra NVDB api, som før
+"""
+import json
+import os
+import threading
+from time import monotonic
+from urllib.parse import urlsplit
+
+STANDARDKATALOG = os.path.join( os.path.expanduser( '~' ), '.nvdbapiv3' )
+
+class datakatalogcache( ):
+    """
+    Mellomlager for definisjonene av vegobjekttyper, én datakatalog per NVDB api-miljø (url). Trådsikker.
+
+    Definisjonene deles av alle søkeobjekter, og skal ikke endres. Kall mot NVDB api gjøres uten å
+    holde den felles låsen, slik at oppslag i en datakatalog vi allerede har aldri venter på nettverket.
+    Kun én tråd per miljø henter ny datakatalog, de andre trådene som trenger den samme venter på den.
+    """
+
+    def __init__( self, katalog=None, sjekkintervall=3600 ):
+        """
+        KEYWORDS
+            katalog=None : Katalog for lagring av datakatalogen på disk, f.eks. STANDARDKATALOG (~/.nvdbapiv3).
+                            None = kun i minnet
+
+            sjekkintervall=3600 : Hvor ofte (sekunder) vi sjekker om det er kommet ny versjon av datakatalogen
+        """
+        self.katalog = katalog
+        self.sjekkintervall = sjekkintervall
+        self._kataloger = { }   # apiurl => { 'versjon' : .., 'sjekket' : .., 'objekttyper' : { id : definisjon } }
+        self._lock = threading.Lock()
+        self._hentelaaser = { }  # apiurl => threading.Lock, kun én tråd per miljø henter fra NVDB api
+
+    def vegobjekttype( self, objTypeID, apiurl, anrope ):
+        """
+        Returnerer definisjon av vegobjekttype
+
+        ARGUMENTS
+            objTypeID - heltall, ID til vegobjekttypen
+
+            apiurl - tekst, rot-endepunkt for NVDB api (skiller miljøene fra hverandre)
+
+            anrope - funksjon( path, parametre=None ) som returnerer JSON-respons fra NVDB api,
+                     f.eks. nvdbFagdata.anrope
+
+        RETURNS
+            dictionary med definisjonen, samme struktur som fra endepunktet vegobjekttyper/<id>
+        """
+        datakatalog = self._datakatalog( apiurl, anrope )
+
+        if datakatalog and int( objTypeID ) in datakatalog['objekttyper']:
+            return datakatalog['objekttyper'][int( objTypeID )]
+
+        # Ukjent objekttype eller feil ved bulk-henting, spør NVDB api direkte
+        return anrope( 'vegobjekttyper/' + str( objTypeID ) )
+
+    def tom( self ):
+        """Glemmer alle datakataloger i minnet (filer på disk blir liggende)"""
+        with self._lock:
+            self._kataloger = { }
+
+    def _datakatalog( self, apiurl, anrope ):
+        """Returnerer gjeldende datakatalog for miljøet, henter ny hvis versjonen er endret"""
+        with self._lock:
+            datakatalog = self._gjeldende( apiurl )
+            if datakatalog:
+                return datakatalog
+            hentelaas = self._hentelaaser.setdefault( apiurl, threading.Lock() )
+
+        with hentelaas:
+            # En annen tråd kan ha hentet datakatalogen mens vi ventet
+            with self._lock:
+                datakatalog = self._gjeldende( apiurl )
+                if datakatalog:
+                    return datakatalog
+                datakatalog = self._kataloger.get( apiurl )
+
+            try:
+                versjon = _versjon( anrope( 'status' ) )
+            except ValueError:
+                versjon = None
+
+            if datakatalog and ( versjon is None or versjon == datakatalog['versjon'] ):
+                with self._lock:
+                    datakatalog['sjekket'] = monotonic()
+                return datakatalog
+
+            objekttyper = self._lesfil( apiurl, versjon )
+            if objekttyper is None:
+                try:
+                    objekttyper = anrope( 'vegobjekttyper', parametre={ 'inkluder' : 'alle' } )
+                except ValueError:
+                    return None
+                self._skrivfil( apiurl, versjon, objekttyper )
+
+            datakatalog = { 'versjon'     : versjon,
+                            'sjekket'     : monotonic(),
+                            'objekttyper' : { int( obj['id'] ) : obj for obj in objekttyper } }
+            with self._lock:
+                self._kataloger[apiurl] = datakatalog
+            return datakatalog
+
+    def _gjeldende( self, apiurl ):
+        """Datakatalog for miljøet hvis den er sjekket innenfor sjekkintervall, ellers None. Kalles med self._lock"""
+        datakatalog = self._kataloger.get( apiurl )
+        if datakatalog and monotonic() - datakatalog['sjekket'] < self.sjekkintervall:
+            return datakatalog
+        return None
+
+    def _filnavn( self, apiurl, versjon ):
+        if not self.katalog or versjon is None:
+            return None
+        vert = urlsplit( apiurl ).hostname or 'nvdbapi'
+        return os.path.join( self.katalog, 'datakatalog_' + vert + '_' + str( versjon ) + '.json' )
+
+    def _lesfil( self, apiurl, versjon ):
+        filnavn = self._filnavn( apiurl, versjon )
+        if not filnavn or not os.path.isfile( filnavn ):
+            return None
+        try:
+            with open( filnavn, encoding='utf-8' ) as f:
+                return json.load( f )['objekttyper']
+        except ( OSError, ValueError, KeyError ):
+            return None
+
+    def _skrivfil( self, apiurl, versjon, objekttyper ):
+        """Lagrer datakatalogen på disk. Skriver til midlertidig fil først, så vi aldri etterlater halvskrevne filer"""
+        filnavn = self._filnavn( apiurl, versjon )
+        if not filnavn:
+            return
+        try:
+            os.makedirs( self.katalog, exist_ok=True )
+            tmpfil = filnavn + '.' + str( os.getpid() ) + '.tmp'
+            with open( tmpfil, 'w', encoding='utf-8' ) as f:
+                json.dump( { 'apiurl' : apiurl, 'versjon' : versjon, 'objekttyper' : objekttyper }, f )
+            os.replace( tmpfil, filnavn )
+        except OSError:
+            pass
+
+def _versjon( status ):
+    """Henter versjonsnummer for datakatalogen fra svaret på endepunktet status"""
+    try:
+        return str( status['datagrunnlag']['datakatalog']['versjon'] )
+    except ( KeyError, TypeError ):
+        return None
+
+_datakatalog = datakatalogcache( )
+
+def datakatalog( ):
+    """Returnerer den felles datakatalogcache for python-prosessen, evt None hvis den er slått av"""
+    return _datakatalog
+
+def settdatakatalogcache( katalog=None, sjekkintervall=3600, aktiv=True ):
+    """
+    Justerer (eller slår av) det felles mellomlageret for definisjoner av vegobjekttyper
+
+    Eksempel
+        settdatakatalogcache( katalog=STANDARDKATALOG ) # Lagrer også på disk, i ~/.nvdbapiv3
+        settdatakatalogcache( katalog='minkatalog' )    # Lagrer også på disk, i minkatalog
+        settdatakatalogcache( aktiv=False )             # Slår av, hvert søkeobjekt henter sin egen definisjon
+
+    KEYWORDS
+        katalog=None, sjekkintervall=3600 : Se datakatalogcache
+
+        aktiv=True : False slår av mellomlageret
+
+    RETURNS
+        datakatalogcache-objektet som nå brukes, evt None
+    """
+    global _datakatalog
+    if aktiv:
+        _datakatalog = datakatalogcache( katalog=katalog, sjekkintervall=sjekkintervall )
+    else:
+        _datakatalog = None
+    return _datakatalog
+
+def vegobjekttype( objTypeID, apiurl, anrope ):
+    """Definisjon av vegobjekttype, via felles mellomlager hvis det er slått på. Se datakatalogcache.vegobjekttype"""
+    if _datakatalog is None:
+        return anrope( 'vegobjekttyper/' + str( objTypeID ) )
+    return _datakatalog.vegobjekttype( objTypeID, apiurl, anrope )
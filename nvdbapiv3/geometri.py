@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+Geometri fra NVDB api på binær form (WKB), og rask konvertering til shapely / geopandas
+
+NVDB api gir geometri som tekst (well known text, WKT). Å oversette WKT rad for rad med
+shapely.wkt.loads (typisk via pandas .apply) er noe av det mest tidkrevende når vi lager
+GeoDataFrame med mange vegsegmenter.
+
+wkt2wkb - Gjør om WKT til ISO well known binary (WKB) med kun standardbiblioteket, slik at det kan
+    gjøres i arbeiderprosessene til iter_records( prosesser=N, geometriformat='wkb' ). WKB tar mindre
+    plass enn WKT, og er mye raskere å lese for shapely/GEOS.
+
+tilgeometri - Gjør om en hel kolonne med WKT eller WKB til shapely-geometrier i ett (vektorisert) kall.
+    Krever shapely, og shapely >= 2.0 for vektorisert konvertering.
+
+    df = pd.DataFrame( sok.to_records( geometriformat='wkb' ) )
+    gdf = gpd.GeoDataFrame( df, geometry=tilgeometri( df['geometri'] ), crs=5973 )
+
+wkt2gpkg - Som wkt2wkb, men med GeoPackage-header (og omsluttende rektangel), se gpkg.gpkgskriver
+
+wkt2geojson - Gjør om WKT til GeoJSON geometri, uten shapely. wkt2geojsontekst gir JSON-teksten direkte,
+    uten å oversette koordinatene til tall og tilbake igjen (brukes av nvdb2geojson.skrivgeojson)
+"""
+import json
+import math
+import re
+import struct
+
+GEOMETRIFORMAT = ( 'wkt', 'wkb' )
+
+WKBTYPER = {    'POINT'                 : 1,
+                'LINESTRING'            : 2,
+                'POLYGON'               : 3,
+                'MULTIPOINT'            : 4,
+                'MULTILINESTRING'       : 5,
+                'MULTIPOLYGON'          : 6,
+                'GEOMETRYCOLLECTION'    : 7 }
+
+# Geometritypen til elementene i multi-geometrier
+_DELTYPER = {   'MULTIPOINT'        : 'POINT',
+                'MULTILINESTRING'   : 'LINESTRING',
+                'MULTIPOLYGON'      : 'POLYGON' }
+
+GEOJSONTYPER = {    'POINT'                 : 'Point',
+                    'LINESTRING'            : 'LineString',
+                    'POLYGON'               : 'Polygon',
+                    'MULTIPOINT'            : 'MultiPoint',
+                    'MULTILINESTRING'       : 'MultiLineString',
+                    'MULTIPOLYGON'          : 'MultiPolygon',
+                    'GEOMETRYCOLLECTION'    : 'GeometryCollection' }
+
+_HODE = re.compile( r'\s*([A-Za-z]+)\s*(ZM|Z|M)?\s*', re.IGNORECASE )
+_TOM = re.compile( r'EMPTY', re.IGNORECASE )
+_UINT = struct.Struct( '<I' )
+_INNERST = re.compile( r'\(([^()]*)\)' )
+_NOSTETPUNKT = re.compile( r'\(\s*\(' )
+_JSONTALL = re.compile( r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?' )
+
+def wkt2wkb( wkt ):
+    """
+    Gjør om geometri fra well known text (WKT) til ISO well known binary (WKB), little endian
+
+    Håndterer alle de enkle geometritypene (POINT, LINESTRING, POLYGON, MULTI*, GEOMETRYCOLLECTION)
+    med og uten Z (og M), og EMPTY.
+
+    ARGUMENTS
+        wkt - tekst, f.eks. 'LINESTRING Z(260000 6650000 100, 260010 6650010 101)'
+
+    RETURNS
+        bytes med WKB, evt None hvis wkt er None
+
+    RAISES
+        ValueError ved ugyldig WKT
+    """
+    if wkt is None:
+        return None
+
+    ut = bytearray()
+    try:
+        pos, dim = _skriv( wkt, 0, ut )
+    except ( IndexError, ValueError ) as e:
+        raise ValueError( 'wkt2wkb: Ugyldig WKT: ' + str( wkt )[:80] ) from e
+    if wkt[pos:].strip():
+        raise ValueError( 'wkt2wkb: Ugyldig WKT: ' + str( wkt )[:80] )
+    return bytes( ut )
+
+def wkt2gpkg( wkt, srid=5973 ):
+    """
+    Gjør om geometri fra well known text (WKT) til GeoPackage geometri (GPKG-header med omsluttende
+    rektangel, fulgt av ISO WKB)
+
+    ARGUMENTS
+        wkt - tekst, f.eks. 'LINESTRING Z(260000 6650000 100, 260010 6650010 101)'
+
+    KEYWORDS
+        srid=5973 : Koordinatsystem (srs_id i GeoPackage)
+
+    RETURNS
+        ( blob, omraade, wkbtype ) der blob er bytes for GeoPackage, omraade er omsluttende rektangel
+        ( minx, maxx, miny, maxy ) (None for tom geometri) og wkbtype er ISO WKB geometritype, f.eks. 1002
+
+    RAISES
+        ValueError ved ugyldig WKT
+    """
+    ut = bytearray()
+    omraade = [ float( 'inf' ), float( '-inf' ), float( 'inf' ), float( '-inf' ) ]
+    try:
+        pos, dim = _skriv( wkt, 0, ut, omraade )
+    except ( IndexError, ValueError ) as e:
+        raise ValueError( 'wkt2gpkg: Ugyldig WKT: ' + str( wkt )[:80] ) from e
+    if wkt[pos:].strip():
+        raise ValueError( 'wkt2gpkg: Ugyldig WKT: ' + str( wkt )[:80] )
+
+    wkbtype = _UINT.unpack_from( ut, 1 )[0]
+    if omraade[0] == float( 'inf' ):
+        # Tom geometri: Flagg for tom geometri, uten omsluttende rektangel
+        return b'GP\x00\x11' + struct.pack( '<i', srid ) + ut, None, wkbtype
+
+    # Flagg: Little endian, omsluttende rektangel [ minx, maxx, miny, maxy ]
+    return b'GP\x00\x03' + struct.pack( '<i4d', srid, *omraade ) + ut, tuple( omraade ), wkbtype
+
+def wkt2geojson( wkt ):
+    """
+    Gjør om geometri fra well known text (WKT) til GeoJSON geometri (dictionary), uten shapely
+
+    ARGUMENTS
+        wkt - tekst, f.eks. 'POINT Z(260000 6650000 100)'
+
+    RETURNS
+        dictionary, f.eks. { 'type' : 'Point', 'coordinates' : [ 260000, 6650000, 100 ] }, evt None
+
+    RAISES
+        ValueError ved ugyldig WKT
+    """
+    if wkt is None:
+        return None
+    try:
+        return json.loads( wkt2geojsontekst( wkt ) )
+    except ValueError as e:
+        raise ValueError( 'wkt2geojson: Ugyldig WKT: ' + str( wkt )[:80] ) from e
+
+def wkt2geojsontekst( wkt ):
+    """
+    Som wkt2geojson, men gir GeoJSON geometri som JSON-tekst. Koordinater som allerede er gyldige
+    JSON-tall kopieres som tekst, uten å oversettes til tall (og tilbake). Andre tall (f.eks. .5, 1.
+    eller +2) skrives om til gyldige JSON-tall. Gir ValueError for nan og inf, som ikke finnes i GeoJSON.
+
+    ARGUMENTS
+        wkt - tekst, f.eks. 'LINESTRING Z(260000 6650000 100, 260010 6650010 101)'
+
+    RETURNS
+        tekst, f.eks. '{"type": "LineString", "coordinates": [[260000,6650000,100],[260010,6650010,101]]}'
+    """
+    m = _HODE.match( wkt )
+    if not m or m.group( 1 ).upper() not in GEOJSONTYPER:
+        raise ValueError( 'wkt2geojsontekst: Ugyldig WKT: ' + str( wkt )[:80] )
+    navn = m.group( 1 ).upper()
+    kropp = wkt[m.end():].strip()
+
+    if navn == 'GEOMETRYCOLLECTION':
+        deler = [ ] if _TOM.fullmatch( kropp ) else _delgeometrier( kropp )
+        return '{"type": "GeometryCollection", "geometries": [' + \
+                    ', '.join( wkt2geojsontekst( d ) for d in deler ) + ']}'
+
+    if _TOM.fullmatch( kropp ):
+        koordinater = '[]'
+    else:
+        koordinater = _INNERST.sub( _koordinatliste, kropp ).replace( '(', '[' ).replace( ')', ']' )
+        if navn == 'POINT':
+            koordinater = koordinater[1:-1]
+        elif navn == 'MULTIPOINT' and _NOSTETPUNKT.search( kropp ):
+            # MULTIPOINT( (1 2), (3 4) ) gir en liste for mye rundt hvert punkt
+            koordinater = json.dumps( [ p[0] for p in json.loads( koordinater ) ] )
+
+    return '{"type": "' + GEOJSONTYPER[navn] + '", "coordinates": ' + koordinater + '}'
+
+def tilgeometri( verdier ):
+    """
+    Gjør om en sekvens (liste, pandas-kolonne) med geometri til shapely-geometrier i ett kall
+
+    Verdiene kan være WKT (tekst), WKB (bytes) eller geometri-elementet fra NVDB api ( { 'wkt' : ... } ).
+    Manglende verdier (None) blir None. Med shapely >= 2.0 gjøres konverteringen vektorisert i GEOS,
+    med eldre shapely faller vi tilbake til å oversette én og én.
+
+    Eksempel
+        mindf['geometry'] = tilgeometri( mindf['geometri'] )
+
+    ARGUMENTS
+        verdier - sekvens med WKT, WKB eller dictionary med WKT
+
+    RETURNS
+        numpy array med shapely-geometrier (evt liste med eldre shapely)
+    """
+    try:
+        import shapely
+    except ImportError:
+        raise ImportError( 'tilgeometri krever shapely, installer med: pip install shapely' )
+
+    verdier = list( verdier )
+    forste = next( ( v for v in verdier if v is not None ), None )
+    if isinstance( forste, dict ):
+        verdier = [ v['wkt'] if v is not None else None for v in verdier ]
+        forste = next( ( v for v in verdier if v is not None ), None )
+    binaer = isinstance( forste, ( bytes, bytearray, memoryview ) )
+
+    if hasattr( shapely, 'from_wkb' ):
+        if binaer:
+            return shapely.from_wkb( [ bytes( v ) if v is not None else None for v in verdier ] )
+        return shapely.from_wkt( verdier )
+
+    # shapely < 2.0
+    from shapely import wkb, wkt
+    if binaer:
+        return [ wkb.loads( bytes( v ) ) if v is not None else None for v in verdier ]
+    return [ wkt.loads( v ) if v is not None else None for v in verdier ]
+
+def _koordinatliste( m ):
+    """Koordinatliste 'x y z, x y z' (uten parentes) som JSON-tekst '[[x,y,z],[x,y,z]]'"""
+    return '[' + ','.join( '[' + ','.join( _jsontall( t ) for t in p.split() ) + ']'
+                                for p in m.group( 1 ).split( ',' ) ) + ']'
+
+def _jsontall( tekst ):
+    """Tall fra WKT som gyldig JSON-tall (tekst). Kopieres direkte hvis det allerede er gyldig"""
+    if _JSONTALL.fullmatch( tekst ):
+        return tekst
+    try:
+        tall = float( tekst )
+    except ValueError:
+        raise ValueError( 'wkt2geojsontekst: Ugyldig tall i WKT: ' + tekst[:80] )
+    if not math.isfinite( tall ):
+        raise ValueError( 'wkt2geojsontekst: ' + tekst + ' kan ikke skrives som GeoJSON' )
+    return repr( tall )
+
+def _delgeometrier( kropp ):
+    """Deler '( POINT(1 2), LINESTRING(1 2, 3 4) )' opp i geometriene (WKT) i samlingen"""
+    kropp = kropp.strip()
+    if not kropp.startswith( '(' ) or not kropp.endswith( ')' ):
+        raise ValueError( 'Ugyldig GEOMETRYCOLLECTION' )
+    deler = [ ]
+    dybde = 0
+    start = 1
+    for ii in range( 1, len( kropp ) - 1 ):
+        tegn = kropp[ii]
+        if tegn == '(':
+            dybde += 1
+        elif tegn == ')':
+            dybde -= 1
+        elif tegn == ',' and dybde == 0:
+            deler.append( kropp[start:ii] )
+            start = ii + 1
+    deler.append( kropp[start:-1] )
+    return deler
+
+def _wkbtype( navn, flagg, dim ):
+    """Geometritype-kode i ISO WKB, f.eks. 1002 for LINESTRING Z"""
+    kode = WKBTYPER[navn]
+    if dim == 4:
+        kode += 3000
+    elif dim == 3:
+        kode += 2000 if flagg == 'M' else 1000
+    return kode
+
+def _skriv( wkt, pos, ut, omraade=None ):
+    """
+    Leser en geometri (med navn) fra pos og skriver WKB til ut. Returnerer ( ny pos, dimensjon )
+    Hvis omraade er gitt ( [ minx, maxx, miny, maxy ] ) utvides det med koordinatene
+    """
+    m = _HODE.match( wkt, pos )
+    if not m or m.group( 1 ).upper() not in WKBTYPER:
+        raise ValueError( 'Ukjent geometritype' )
+    return _kropp( m.group( 1 ).upper(), ( m.group( 2 ) or '' ).upper(), wkt, m.end(), ut, omraade )
+
+def _kropp( navn, flagg, wkt, pos, ut, omraade=None ):
+    """Skriver WKB for geometri av typen navn, med koordinatene fra pos. Returnerer ( ny pos, dimensjon )"""
+    hode = len( ut )
+    ut += b'\x01\x00\x00\x00\x00'   # Little endian + plass til geometritype
+    dim = 2 + len( flagg )
+
+    tom = _TOM.match( wkt, _hoppover( wkt, pos ) )
+    if tom:
+        pos = tom.end()
+        if navn == 'POINT':
+            ut += struct.pack( '<%dd' % dim, *( [ float( 'nan' ) ] * dim ) )
+        else:
+            ut += _UINT.pack( 0 )
+
+    elif navn == 'POINT':
+        verdier, antall, dim, pos = _koordinater( wkt, pos, omraade )
+        ut += struct.pack( '<%dd' % len( verdier ), *verdier )
+
+    elif navn == 'LINESTRING':
+        verdier, antall, dim, pos = _koordinater( wkt, pos, omraade )
+        ut += _UINT.pack( antall )
+        ut += struct.pack( '<%dd' % len( verdier ), *verdier )
+
+    else:
+        pos = _start( wkt, pos )
+        antallpos = len( ut )
+        ut += _UINT.pack( 0 )
+        antall = 0
+        mer = True
+        while mer:
+            if navn == 'POLYGON':
+                verdier, n, dim, pos = _koordinater( wkt, pos, omraade )
+                ut += _UINT.pack( n )
+                ut += struct.pack( '<%dd' % len( verdier ), *verdier )
+            elif navn == 'GEOMETRYCOLLECTION':
+                pos, dim = _skriv( wkt, pos, ut, omraade )
+            elif navn == 'MULTIPOINT' and wkt[_hoppover( wkt, pos )] != '(':
+                # MULTIPOINT( 1 2, 3 4 ) uten parentes rundt hvert punkt
+                pos, dim = _punkt( wkt, pos, flagg, ut, omraade )
+            else:
+                pos, dim = _kropp( _DELTYPER[navn], flagg, wkt, pos, ut, omraade )
+            antall += 1
+            pos, mer = _neste( wkt, pos )
+        _UINT.pack_into( ut, antallpos, antall )
+
+    _UINT.pack_into( ut, hode + 1, _wkbtype( navn, flagg, dim ) )
+    return pos, dim
+
+def _punkt( wkt, pos, flagg, ut, omraade=None ):
+    """Skriver WKB for ett punkt i MULTIPOINT skrevet uten parentes rundt punktet"""
+    slutt = pos
+    while wkt[slutt] not in ',)':
+        slutt += 1
+    verdier = [ float( v ) for v in wkt[pos:slutt].split() ]
+    dim = len( verdier )
+    if omraade is not None:
+        _utvid( omraade, verdier, dim )
+    ut += b'\x01' + _UINT.pack( _wkbtype( 'POINT', flagg, dim ) )
+    ut += struct.pack( '<%dd' % dim, *verdier )
+    return slutt, dim
+
+def _koordinater( wkt, pos, omraade=None ):
+    """Leser koordinatlisten '( x y z, x y z, ... )' fra pos. Returnerer ( verdier, antall punkt, dimensjon, ny pos )"""
+    start = _start( wkt, pos )
+    slutt = wkt.index( ')', start )
+    tekst = wkt[start:slutt]
+    verdier = [ float( v ) for v in tekst.replace( ',', ' ' ).split() ]
+    antall = tekst.count( ',' ) + 1
+    if not verdier or len( verdier ) % antall:
+        raise ValueError( 'Ugyldig koordinatliste' )
+    if omraade is not None:
+        _utvid( omraade, verdier, len( verdier ) // antall )
+    return verdier, antall, len( verdier ) // antall, slutt + 1
+
+def _utvid( omraade, verdier, dim ):
+    """Utvider omraade [ minx, maxx, miny, maxy ] med koordinatene"""
+    xs = verdier[0::dim]
+    ys = verdier[1::dim]
+    omraade[0] = min( omraade[0], min( xs ) )
+    omraade[1] = max( omraade[1], max( xs ) )
+    omraade[2] = min( omraade[2], min( ys ) )
+    omraade[3] = max( omraade[3], max( ys ) )
+
+def _hoppover( wkt, pos ):
+    """Hopper over blanke tegn"""
+    while wkt[pos].isspace():
+        pos += 1
+    return pos
+
+def _start( wkt, pos ):
+    """Forventer '(' (etter evt blanke tegn), returnerer posisjonen etter"""
+    pos = _hoppover( wkt, pos )
+    if wkt[pos] != '(':
+        raise ValueError( "Forventet '('" )
+    return pos + 1
+
+def _neste( wkt, pos ):
+    """Etter et element i en liste: Returnerer ( posisjon etter skilletegnet, True hvis det kommer flere elementer )"""
+    pos = _hoppover( wkt, pos )
+    if wkt[pos] == ',':
+        return pos + 1, True
+    if wkt[pos] == ')':
+        return pos + 1, False
+    raise ValueError( "Forventet ',' eller ')'" )
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Eksport av vegnett og fagdata til GeoParquet, skrevet fortløpende mens dataene lastes ned
+
+Radene fra iter_records (med geometriformat='wkb') samles i radgrupper på inntil radgruppe rader,
+som skrives til Parquet-fil etter hvert. Vi holder aldri mer enn én radgruppe (per partisjon) i
+minnet. Kolonnene får datatyper fra datakatalogen (se kolonner.kolonnetyper), geometrien lagres som
+WKB, og filen får GeoParquet-metadata ('geo') slik at geopandas, GDAL/QGIS, DuckDB m.fl. kjenner igjen
+geometrikolonnen.
+
+Med partisjon='fylke' (eller en annen kolonne, f.eks. 'kommune' eller 'objekttype') skrives én fil
+per verdi i hive-stil katalogstruktur ( <katalog>/fylke=30/del-0.parquet ), som kan leses parallelt:
+
+    import pyarrow.dataset as ds
+    data = ds.dataset( 'fartsgrense', partitioning='hive' )
+
+Krever pyarrow (pip install pyarrow). Med pyproj installert får filen koordinatsystem som PROJJSON,
+uten pyproj er koordinatsystemet ukjent i GeoParquet-metadata.
+"""
+import json
+import os
+from urllib.parse import quote
+
+from . import kolonner
+
+GEOPARQUETVERSJON = '1.0.0'
+
+# Verdien pyarrow (og hive) bruker for tomme partisjonsverdier
+TOMPARTISJON = '__HIVE_DEFAULT_PARTITION__'
+
+class geoparquetskriver( ):
+    """
+    Skriver rader (dictionaries) til én GeoParquet-fil, én radgruppe av gangen
+
+    Skjemaet for filen bestemmes når den første radgruppen skrives, og består av alle kolonnene i typer
+    og kolonnenavn, pluss evt andre kolonner i første radgruppe. Kolonner vi vet om får dermed alltid
+    plass i filen, også når de først dukker opp i en senere radgruppe (f.eks. sluttdato), og blir tomme
+    for radene som mangler dem. Andre kolonner som dukker opp etter første radgruppe gir ValueError,
+    slik at vi aldri mister data uten at du får vite om det.
+
+    Eksempel
+        skriver = geoparquetskriver( 'vegnett.parquet', kolonner.kolonnetyper() )
+        for rad in v.iter_records( geometriformat='wkb' ):
+            skriver.leggtil( rad )
+        skriver.lukk()
+    """
+
+    def __init__( self, filnavn, typer=None, kolonnenavn=None, komprimering='zstd', radgruppe=50000, crs=5973,
+                        geometrikolonne='geometri' ):
+        """
+        ARGUMENTS
+            filnavn - Parquet-filen vi skal skrive til (katalogen opprettes ved behov)
+
+        KEYWORDS
+            typer=None : dictionary { kolonnenavn : datatype }, se kolonner.kolonnetyper
+
+            kolonnenavn=None : Liste med alle kolonnene radene kan ha (bestemmer rekkefølgen), f.eks.
+                        kolonner.VEGNETTKOLONNER eller kolonner.fagdatakolonner. Kolonner som ikke står i
+                        typer blir tekst
+
+            komprimering='zstd' : Komprimering i Parquet-filen, f.eks. 'snappy', 'gzip', 'zstd' eller None
+
+            radgruppe=50000 : Antall rader per radgruppe (row group)
+
+            crs=5973 : EPSG-kode for koordinatsystemet til geometrien
+
+            geometrikolonne='geometri' : Kolonne med geometri som WKB
+        """
+        self.filnavn = filnavn
+        self.typer = typer
+        self.kolonnenavn = kolonnenavn
+        self.komprimering = komprimering
+        self.radgruppe = radgruppe
+        self.crs = crs
+        self.geometrikolonne = geometrikolonne
+        self.antall = 0
+        self._rader = [ ]
+        self._skriver = None
+        self._skjema = None
+
+    def leggtil( self, rad ):
+        """Føyer en rad (dictionary) til filen, skriver radgruppen når den er full"""
+        self._rader.append( rad )
+        if len( self._rader ) >= self.radgruppe:
+            self._skriv( )
+
+    def lukk( self ):
+        """Skriver resten av radene og avslutter filen"""
+        if self._rader:
+            self._skriv( )
+        if self._skriver is not None:
+            self._skriver.close( )
+            self._skriver = None
+
+    def _skriv( self ):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        bygger = kolonner.kolonnebygger( )
+        for rad in self._rader:
+            bygger.leggtil( rad )
+        self.antall += len( self._rader )
+        self._rader = [ ]
+
+        if self._skriver is None:
+            tabell = kolonner.til_arrow( bygger.kolonner, self.typer )
+            self._skjema = _fastskjema( pa, tabell.schema, self.geometrikolonne, self.kolonnenavn, self.typer )
+            geo = self._geometadata( self._skjema )
+            if geo:
+                self._skjema = self._skjema.with_metadata( { b'geo' : json.dumps( geo ).encode( 'utf-8' ) } )
+            tabell = kolonner.til_arrow( bygger.kolonner, skjema=self._skjema )
+
+            katalog = os.path.dirname( self.filnavn )
+            if katalog:
+                os.makedirs( katalog, exist_ok=True )
+            self._skriver = pq.ParquetWriter( self.filnavn, self._skjema, compression=self.komprimering )
+        else:
+            nye = set( bygger.kolonner ) - set( self._skjema.names )
+            if nye:
+                raise ValueError( 'geoparquet: Ukjente kolonner etter første radgruppe i ' + self.filnavn + ': ' +
+                                    ', '.join( sorted( nye ) ) + '. Angi dem med kolonnenavn (eller typer)' )
+            tabell = kolonner.til_arrow( bygger.kolonner, skjema=self._skjema )
+
+        self._skriver.write_table( tabell, row_group_size=tabell.num_rows )
+
+    def _geometadata( self, skjema ):
+        """GeoParquet-metadata for filen, evt None hvis vi ikke har geometrikolonne"""
+        if self.geometrikolonne not in skjema.names:
+            return None
+        return { 'version'        : GEOPARQUETVERSJON,
+                 'primary_column' : self.geometrikolonne,
+                 'columns'        : { self.geometrikolonne : {   'encoding'       : 'WKB',
+                                                                 'geometry_types' : [ ],
+                                                                 'crs'            : _projjson( self.crs ) } } }
+
+def skrivgeoparquet( rader, filnavn, typer=None, kolonnenavn=None, partisjon=None, komprimering='zstd', radgruppe=50000, crs=5973 ):
+    """
+    Skriver rader (f.eks. fra iter_records( geometriformat='wkb' )) til GeoParquet, evt partisjonert
+
+    ARGUMENTS
+        rader - iterator med dictionaries, geometrien som WKB i kolonnen 'geometri'
+
+        filnavn - Parquet-fil, evt katalog hvis vi partisjonerer
+
+    KEYWORDS
+        typer=None : dictionary { kolonnenavn : datatype }, se kolonner.kolonnetyper
+
+        kolonnenavn=None : Liste med alle kolonnene radene kan ha, se geoparquetskriver
+
+        partisjon=None | kolonnenavn : Skriv én fil per verdi i denne kolonnen, f.eks. 'fylke', 'kommune'
+                    eller 'objekttype', til <filnavn>/<kolonnenavn>=<verdi>/del-0.parquet. Kolonnen tas ut
+                    av filene (verdien står i katalognavnet), slik som pyarrow gjør med hive-partisjonering
+
+        komprimering='zstd', radgruppe=50000, crs=5973 : Se geoparquetskriver
+
+    RETURNS
+        antall rader skrevet
+    """
+    if partisjon:
+        # Partisjonskolonnen står i katalognavnet, ikke i filene
+        if typer:
+            typer = { navn : hva for navn, hva in typer.items() if navn != partisjon }
+        if kolonnenavn:
+            kolonnenavn = [ navn for navn in kolonnenavn if navn != partisjon ]
+
+    skrivere = { }
+    try:
+        for rad in rader:
+            if partisjon:
+                verdi = rad.pop( partisjon, None )
+                skriver = skrivere.get( verdi )
+                if skriver is None:
+                    mappe = partisjon + '=' + ( TOMPARTISJON if verdi is None else quote( str( verdi ), safe='' ) )
+                    skriver = skrivere[verdi] = geoparquetskriver( os.path.join( filnavn, mappe, 'del-0.parquet' ),
+                                    typer=typer, kolonnenavn=kolonnenavn, komprimering=komprimering,
+                                    radgruppe=radgruppe, crs=crs )
+            else:
+                skriver = skrivere.get( None )
+                if skriver is None:
+                    skriver = skrivere[None] = geoparquetskriver( filnavn, typer=typer, kolonnenavn=kolonnenavn,
+                                                komprimering=komprimering, radgruppe=radgruppe, crs=crs )
+            skriver.leggtil( rad )
+    finally:
+        for skriver in skrivere.values():
+            skriver.lukk( )
+
+    return sum( skriver.antall for skriver in skrivere.values() )
+
+def _fastskjema( pa, skjema, geometrikolonne, kolonnenavn, typer ):
+    """
+    Skjema for hele filen: Kolonnene i kolonnenavn og typer, pluss evt andre kolonner i første radgruppe
+    (skjema). Kolonner som mangler i første radgruppe får datatype fra typer, tomme kolonner blir tekst
+    og geometri blir binær
+    """
+    typer = typer or { }
+    navneliste = list( kolonnenavn or [ ] )
+    kjente = set( navneliste )
+    for navn in list( skjema.names ) + list( typer ):
+        if navn not in kjente:
+            navneliste.append( navn )
+            kjente.add( navn )
+
+    felter = [ ]
+    for navn in navneliste:
+        if navn == geometrikolonne:
+            datatype = pa.binary()
+        elif navn in skjema.names and not pa.types.is_null( skjema.field( navn ).type ):
+            datatype = skjema.field( navn ).type
+        else:
+            datatype = kolonner._arrowtype( pa, typer.get( navn ) )
+        felter.append( pa.field( navn, datatype ) )
+
+    return pa.schema( felter )
+
+def _projjson( crs ):
+    """Koordinatsystem som PROJJSON (krever pyproj), evt None (ukjent)"""
+    try:
+        from pyproj import CRS
+    except ImportError:
+        return None
+    return CRS.from_epsg( crs ).to_json_dict( )
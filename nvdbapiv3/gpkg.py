@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+Skriver vegnett og fagdata rett til GeoPackage, fortløpende og i transaksjoner med N rader
+
+GeoPackage er en sqlite-database, så vi skriver med sqlite3 fra standardbiblioteket i stedet for
+å gå via (geo)pandas DataFrame og fiona/GDAL. Radene (f.eks. fra iter_records) legges til
+etter hvert som de kommer, og vi har aldri mer enn én transaksjon med rader i minnet.
+Geometrien gjøres om fra WKT til GeoPackage-geometri med geometri.wkt2gpkg.
+
+Romlig indeks (rtree) bygges én gang når laget avsluttes, ikke rad for rad. Nye kolonner som dukker
+opp underveis legges til tabellen (ALTER TABLE). Et lag med samme navn som finnes fra før erstattes,
+andre lag i filen blir liggende.
+
+    from nvdbapiv3.gpkg import gpkgskriver
+    lag = gpkgskriver( 'nvdbdata.gpkg', 'fartsgrense', typer=kolonner.kolonnetyper( f.objektTypeDef ) )
+    for rad in f.iter_records( ):
+        lag.leggtil( rad )
+    lag.lukk( )
+
+Bruker pyproj (hvis installert) for å beskrive koordinatsystemet, ellers kun EPSG-koden.
+"""
+import json
+import sqlite3
+import struct
+from datetime import datetime, timezone
+
+from . import geometri
+
+GPKG_APPLICATION_ID = 0x47504B47   # 'GPKG'
+GPKG_USER_VERSION = 10300           # GeoPackage 1.3
+
+# SQL-datatype for datatypene fra kolonner.kolonnetyper
+SQLTYPER = {    'int64'   : 'INTEGER',
+                'float64' : 'REAL',
+                'dato'    : 'DATE',
+                'enum'    : 'TEXT',
+                'tekst'   : 'TEXT' }
+
+GEOMETRITYPER = { kode : navn for navn, kode in geometri.WKBTYPER.items() }
+
+_METADATATABELLER = [
+    """CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys ( srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY,
+        organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT )""",
+    """CREATE TABLE IF NOT EXISTS gpkg_contents ( table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+        identifier TEXT UNIQUE, description TEXT DEFAULT '',
+        last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+        min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+        CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id) )""",
+    """CREATE TABLE IF NOT EXISTS gpkg_geometry_columns ( table_name TEXT NOT NULL, column_name TEXT NOT NULL,
+        geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+        CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+        CONSTRAINT uk_gc_table_name UNIQUE (table_name),
+        CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+        CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id) )""",
+    """CREATE TABLE IF NOT EXISTS gpkg_extensions ( table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL,
+        definition TEXT NOT NULL, scope TEXT NOT NULL,
+        CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name) )""" ]
+
+_STANDARD_SRS = [
+    ( 'Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system' ),
+    ( 'Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system' ),
+    ( 'WGS 84 geodetic', 4326, 'EPSG', 4326, 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+        'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+        'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AXIS["Latitude",NORTH],AXIS["Longitude",EAST],'
+        'AUTHORITY["EPSG","4326"]]', 'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid' ) ]
+
+# Triggere som holder rtree-indeksen oppdatert ved senere endringer (GeoPackage 1.3, rtree-utvidelsen)
+_RTREETRIGGERE = [
+    """CREATE TRIGGER "{r}_insert" AFTER INSERT ON "{t}" WHEN (new."{g}" NOT NULL AND NOT ST_IsEmpty(NEW."{g}"))
+        BEGIN INSERT OR REPLACE INTO "{r}" VALUES (NEW.fid, ST_MinX(NEW."{g}"), ST_MaxX(NEW."{g}"), ST_MinY(NEW."{g}"), ST_MaxY(NEW."{g}")); END""",
+    """CREATE TRIGGER "{r}_update1" AFTER UPDATE OF "{g}" ON "{t}" WHEN OLD.fid = NEW.fid AND (NEW."{g}" NOTNULL AND NOT ST_IsEmpty(NEW."{g}"))
+        BEGIN INSERT OR REPLACE INTO "{r}" VALUES (NEW.fid, ST_MinX(NEW."{g}"), ST_MaxX(NEW."{g}"), ST_MinY(NEW."{g}"), ST_MaxY(NEW."{g}")); END""",
+    """CREATE TRIGGER "{r}_update2" AFTER UPDATE OF "{g}" ON "{t}" WHEN OLD.fid = NEW.fid AND (NEW."{g}" ISNULL OR ST_IsEmpty(NEW."{g}"))
+        BEGIN DELETE FROM "{r}" WHERE id = OLD.fid; END""",
+    """CREATE TRIGGER "{r}_update3" AFTER UPDATE ON "{t}" WHEN OLD.fid != NEW.fid AND (NEW."{g}" NOTNULL AND NOT ST_IsEmpty(NEW."{g}"))
+        BEGIN DELETE FROM "{r}" WHERE id = OLD.fid;
+        INSERT OR REPLACE INTO "{r}" VALUES (NEW.fid, ST_MinX(NEW."{g}"), ST_MaxX(NEW."{g}"), ST_MinY(NEW."{g}"), ST_MaxY(NEW."{g}")); END""",
+    """CREATE TRIGGER "{r}_update4" AFTER UPDATE ON "{t}" WHEN OLD.fid != NEW.fid AND (NEW."{g}" ISNULL OR ST_IsEmpty(NEW."{g}"))
+        BEGIN DELETE FROM "{r}" WHERE id IN (OLD.fid, NEW.fid); END""",
+    """CREATE TRIGGER "{r}_delete" AFTER DELETE ON "{t}" WHEN old."{g}" NOT NULL
+        BEGIN DELETE FROM "{r}" WHERE id = OLD.fid; END""" ]
+
+class gpkgskriver( ):
+    """
+    Skriver rader (dictionaries med geometri som WKT) til ett lag i en GeoPackage-fil
+
+    Eksempel
+        lag = gpkgskriver( 'vegnett.gpkg', 'vegnett', transaksjon=20000 )
+        for rad in v.iter_records( ):
+            lag.leggtil( rad )
+        antall = lag.lukk( )
+    """
+
+    def __init__( self, filnavn, lagnavn, typer=None, crs=5973, transaksjon=10000, geometrikolonne='geometri', utelat=( ) ):
+        """
+        ARGUMENTS
+            filnavn - GeoPackage-fil, opprettes hvis den ikke finnes
+
+            lagnavn - Navn på laget (tabellen). Et lag med samme navn erstattes
+
+        KEYWORDS
+            typer=None : dictionary { kolonnenavn : datatype }, se kolonner.kolonnetyper. Øvrige kolonner
+                         får datatype ut fra den første verdien
+
+            crs=5973 : EPSG-kode for koordinatsystemet til geometrien
+
+            transaksjon=10000 : Antall rader per transaksjon (og maks antall rader vi holder i minnet)
+
+            geometrikolonne='geometri' : Kolonne med geometri som WKT (evt geometri-element fra NVDB api).
+                         WKB (geometriformat='wkb') går også, men krever shapely og er tregere
+
+            utelat=( ) : Kolonner som ikke skal skrives til fil, f.eks. ( 'vegsegmenter', )
+        """
+        self.filnavn = filnavn
+        self.lagnavn = lagnavn
+        self.typer = typer or { }
+        self.crs = crs
+        self.transaksjon = transaksjon
+        self.geometrikolonne = geometrikolonne
+        self.utelat = set( utelat ) | { geometrikolonne }
+        self.antall = 0
+
+        self._rader = [ ]
+        self._kolonner = { }                # kolonnenavn i radene => kolonnenavn i tabellen
+        self._brukt = { 'fid', 'geom' }     # kolonnenavn i tabellen (små bokstaver, sqlite skiller ikke på store/små)
+        self._opprettet = False
+        self._omraade = None
+        self._geometrityper = set( )
+
+        self._db = sqlite3.connect( filnavn )
+        _registrerfunksjoner( self._db )
+        self._db.execute( 'PRAGMA application_id = %d' % GPKG_APPLICATION_ID )
+        self._db.execute( 'PRAGMA user_version = %d' % GPKG_USER_VERSION )
+        for sql in _METADATATABELLER:
+            self._db.execute( sql )
+        self._db.executemany( 'INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES ( ?, ?, ?, ?, ?, ? )', _STANDARD_SRS )
+        self._db.execute( 'INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES ( ?, ?, ?, ?, ?, ? )', _srs( crs ) )
+        self._slettlag( )
+        self._db.commit( )
+
+    def leggtil( self, rad ):
+        """Føyer en rad (dictionary) til laget, skriver transaksjonen når den er full"""
+        self._rader.append( rad )
+        if len( self._rader ) >= self.transaksjon:
+            self._skriv( )
+
+    def lukk( self ):
+        """
+        Skriver resten av radene, bygger romlig indeks, oppdaterer metadata og lukker filen
+
+        RETURNS
+            antall rader skrevet
+        """
+        if self._db is None:
+            return self.antall
+
+        if self._rader:
+            self._skriv( )
+
+        if self._opprettet:
+            self._romligindeks( )
+            self._oppdatermetadata( )
+            self._db.commit( )
+
+        self._db.close( )
+        self._db = None
+        return self.antall
+
+    def _skriv( self ):
+        """Skriver radene i bufferet i én transaksjon"""
+        rader = self._rader
+        self._rader = [ ]
+
+        nye = [ ]
+        for rad in rader:
+            for navn, verdi in rad.items():
+                if navn not in self._kolonner and navn not in self.utelat:
+                    self._kolonner[navn] = self._kolonnenavn( navn )
+                    nye.append( navn )
+
+        if not self._opprettet:
+            self._opprettlag( nye, rader )
+        else:
+            for navn in nye:
+                self._db.execute( 'ALTER TABLE ' + _sitat( self.lagnavn ) + ' ADD COLUMN ' +
+                                    _sitat( self._kolonner[navn] ) + ' ' + self._sqltype( navn, rader ) )
+
+        navneliste = list( self._kolonner.keys() )
+        sql = 'INSERT INTO ' + _sitat( self.lagnavn ) + ' ( geom, ' + \
+                ', '.join( _sitat( self._kolonner[navn] ) for navn in navneliste ) + ' ) VALUES ( ' + \
+                ', '.join( [ '?' ] * ( len( navneliste ) + 1 ) ) + ' )'
+
+        self._db.executemany( sql, ( [ self._geometri( rad.get( self.geometrikolonne ) ) ] +
+                                        [ _sqlverdi( rad.get( navn ) ) for navn in navneliste ] for rad in rader ) )
+        self._db.commit( )
+        self.antall += len( rader )
+
+    def _geometri( self, verdi ):
+        """GeoPackage-geometri for WKT (evt geometri-element fra NVDB api), oppdaterer utstrekning for laget"""
+        if isinstance( verdi, dict ):
+            verdi = verdi.get( 'wkt' )
+        if verdi is None:
+            return None
+        elif isinstance( verdi, ( bytes, bytearray ) ):
+            # WKB (geometriformat='wkb'), går via shapely
+            from shapely import wkb
+            verdi = wkb.loads( bytes( verdi ) ).wkt
+
+        blob, omraade, wkbtype = geometri.wkt2gpkg( verdi, self.crs )
+        self._geometrityper.add( wkbtype )
+        if omraade:
+            if self._omraade is None:
+                self._omraade = list( omraade )
+            else:
+                self._omraade = [ min( self._omraade[0], omraade[0] ), max( self._omraade[1], omraade[1] ),
+                                  min( self._omraade[2], omraade[2] ), max( self._omraade[3], omraade[3] ) ]
+        return blob
+
+    def _kolonnenavn( self, navn ):
+        """Kolonnenavn i tabellen, med løpenummer hvis navnet allerede er i bruk (uavhengig av store/små bokstaver)"""
+        kolonne = str( navn )
+        nr = 0
+        while kolonne.lower() in self._brukt:
+            nr += 1
+            kolonne = str( navn ) + '_' + str( nr )
+        self._brukt.add( kolonne.lower() )
+        return kolonne
+
+    def _sqltype( self, navn, rader ):
+        """SQL-datatype for kolonnen, fra typer eller ut fra første verdi"""
+        if navn in self.typer and self.typer[navn] in SQLTYPER:
+            return SQLTYPER[self.typer[navn]]
+
+        verdi = next( ( rad[navn] for rad in rader if rad.get( navn ) is not None ), None )
+        if isinstance( verdi, bool ):
+            return 'BOOLEAN'
+        elif isinstance( verdi, int ):
+            return 'INTEGER'
+        elif isinstance( verdi, float ):
+            return 'REAL'
+        elif isinstance( verdi, ( bytes, bytearray ) ):
+            return 'BLOB'
+        return 'TEXT'
+
+    def _opprettlag( self, navneliste, rader ):
+        """Oppretter tabellen for laget og registrerer den i GeoPackage-metadata"""
+        kolonner = [ 'fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL', 'geom GEOMETRY' ]
+        kolonner.extend( _sitat( self._kolonner[navn] ) + ' ' + self._sqltype( navn, rader ) for navn in navneliste )
+        self._db.execute( 'CREATE TABLE ' + _sitat( self.lagnavn ) + ' ( ' + ', '.join( kolonner ) + ' )' )
+        self._db.execute( 'INSERT INTO gpkg_contents ( table_name, data_type, identifier, srs_id ) VALUES ( ?, ?, ?, ? )',
+                            ( self.lagnavn, 'features', self.lagnavn, self.crs ) )
+        self._db.execute( 'INSERT INTO gpkg_geometry_columns VALUES ( ?, ?, ?, ?, ?, ? )',
+                            ( self.lagnavn, 'geom', 'GEOMETRY', self.crs, 2, 0 ) )
+        self._opprettet = True
+
+    def _romligindeks( self ):
+        """Bygger rtree-indeksen i ett kall, og legger på triggere som holder den oppdatert"""
+        rtree = 'rtree_' + self.lagnavn + '_geom'
+        self._db.execute( 'CREATE VIRTUAL TABLE ' + _sitat( rtree ) + ' USING rtree( id, minx, maxx, miny, maxy )' )
+        # Leser kun headeren (de første 40 bytes) én gang per rad, i stedet for fire ST_-kall per rad
+        hoder = self._db.execute( 'SELECT fid, substr( geom, 1, 40 ) FROM ' + _sitat( self.lagnavn ) + ' WHERE geom NOT NULL' )
+        self._db.executemany( 'INSERT INTO ' + _sitat( rtree ) + ' VALUES ( ?, ?, ?, ?, ? )', _rtreerader( hoder ) )
+        for trigger in _RTREETRIGGERE:
+            self._db.execute( trigger.format( r=rtree.replace( '"', '""' ), t=self.lagnavn.replace( '"', '""' ), g='geom' ) )
+        self._db.execute( 'INSERT OR REPLACE INTO gpkg_extensions VALUES ( ?, ?, ?, ?, ? )',
+                            ( self.lagnavn, 'geom', 'gpkg_rtree_index',
+                              'http://www.geopackage.org/spec120/#extension_rtree', 'write-only' ) )
+
+    def _oppdatermetadata( self ):
+        """Geometritype, Z og utstrekning for laget, nå som vi har sett alle radene"""
+        basistyper = { kode % 1000 for kode in self._geometrityper }
+        if len( basistyper ) == 1:
+            geomtype = GEOMETRITYPER.get( basistyper.pop(), 'GEOMETRY' )
+        else:
+            geomtype = 'GEOMETRY'
+
+        zverdier = { kode // 1000 in ( 1, 3 ) for kode in self._geometrityper }
+        z = 2 if len( zverdier ) != 1 else ( 1 if zverdier.pop() else 0 )
+        mverdier = { kode // 1000 in ( 2, 3 ) for kode in self._geometrityper }
+        m = 2 if len( mverdier ) != 1 else ( 1 if mverdier.pop() else 0 )
+
+        self._db.execute( 'UPDATE gpkg_geometry_columns SET geometry_type_name=?, z=?, m=? WHERE table_name=?',
+                            ( geomtype, z, m, self.lagnavn ) )
+
+        omraade = self._omraade or [ None ] * 4
+        self._db.execute( 'UPDATE gpkg_contents SET min_x=?, max_x=?, min_y=?, max_y=?, last_change=? WHERE table_name=?',
+                            ( omraade[0], omraade[1], omraade[2], omraade[3],
+                              datetime.now( timezone.utc ).strftime( '%Y-%m-%dT%H:%M:%S.%fZ' )[:-4] + 'Z', self.lagnavn ) )
+
+    def _slettlag( self ):
+        """Fjerner et eksisterende lag med samme navn, inkludert romlig indeks og metadata"""
+        rtree = 'rtree_' + self.lagnavn + '_geom'
+        self._db.execute( 'DROP TABLE IF EXISTS ' + _sitat( rtree ) )
+        self._db.execute( 'DROP TABLE IF EXISTS ' + _sitat( self.lagnavn ) )
+        for tabell in ( 'gpkg_extensions', 'gpkg_geometry_columns', 'gpkg_contents' ):
+            self._db.execute( 'DELETE FROM ' + tabell + ' WHERE table_name=?', ( self.lagnavn, ) )
+
+def skrivgpkg( rader, filnavn, lagnavn, **kwargs ):
+    """
+    Skriver rader (f.eks. fra iter_records) til ett lag i GeoPackage
+
+    ARGUMENTS
+        rader - iterator (eller liste) med dictionaries, geometrien som WKT i kolonnen 'geometri'
+
+        filnavn, lagnavn - se gpkgskriver
+
+    KEYWORDS
+        Sendes videre til gpkgskriver (typer, crs, transaksjon, geometrikolonne, utelat)
+
+    RETURNS
+        antall rader skrevet (0 betyr at laget ikke ble opprettet)
+    """
+    lag = gpkgskriver( filnavn, lagnavn, **kwargs )
+    try:
+        for rad in rader:
+            lag.leggtil( rad )
+    finally:
+        antall = lag.lukk( )
+    return antall
+
+def _sitat( navn ):
+    """Navn på tabell eller kolonne, i anførselstegn for SQL"""
+    return '"' + str( navn ).replace( '"', '""' ) + '"'
+
+def _sqlverdi( verdi ):
+    """Verdi slik sqlite kan lagre den, nøstede elementer (dictionary, liste) blir JSON-tekst"""
+    if isinstance( verdi, ( dict, list, tuple ) ):
+        return json.dumps( verdi, ensure_ascii=False )
+    return verdi
+
+def _srs( crs ):
+    """Rad til gpkg_spatial_ref_sys for EPSG-koden. Beskrivelse (WKT) fra pyproj hvis den er installert"""
+    navn = 'EPSG:' + str( crs )
+    definisjon = 'undefined'
+    try:
+        from pyproj import CRS
+        proj = CRS.from_epsg( crs )
+        navn = proj.name
+        definisjon = proj.to_wkt( 'WKT1_GDAL' ) or definisjon
+    except Exception:
+        pass
+    return ( navn, crs, 'EPSG', crs, definisjon, None )
+
+def _gpkghode( blob ):
+    """Leser GeoPackage-header: Returnerer ( tom, omraade ) der omraade er ( minx, maxx, miny, maxy ) eller None"""
+    if blob is None or len( blob ) < 8 or blob[0:2] != b'GP':
+        return True, None
+    flagg = blob[3]
+    tom = bool( flagg & 0x10 )
+    if ( flagg >> 1 ) & 0x07 == 0:
+        return tom, None
+    rekkefolge = '<' if flagg & 0x01 else '>'
+    return tom, struct.unpack_from( rekkefolge + '4d', blob, 8 )
+
+def _rtreerader( hoder ):
+    """( fid, minx, maxx, miny, maxy ) for alle ikke-tomme geometrier med omsluttende rektangel"""
+    for fid, hode in hoder:
+        tom, omraade = _gpkghode( hode )
+        if not tom and omraade is not None:
+            yield ( fid, ) + omraade
+
+def _registrerfunksjoner( db ):
+    """
+    SQL-funksjonene rtree-indeksen og triggerne bruker (ST_MinX osv). GDAL og SpatiaLite har sine egne,
+    her leser vi kun det omsluttende rektangelet fra GeoPackage-headeren
+    """
+    def _del( ii ):
+        def funksjon( blob ):
+            tom, omraade = _gpkghode( blob )
+            return None if omraade is None else omraade[ii]
+        return funksjon
+
+    db.create_function( 'ST_MinX', 1, _del( 0 ) )
+    db.create_function( 'ST_MaxX', 1, _del( 1 ) )
+    db.create_function( 'ST_MinY', 1, _del( 2 ) )
+    db.create_function( 'ST_MaxY', 1, _del( 3 ) )
+    db.create_function( 'ST_IsEmpty', 1, lambda blob : int( _gpkghode( blob )[0] ) )
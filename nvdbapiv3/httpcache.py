@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Lokal mellomlagring (cache) på disk av svar fra NVDB api LES
+
+diskcache - Lagrer svar på http GET i en sqlite-fil, med nøkkel ut fra url, parametre og
+relevante http-headere. Hvert svar har en levetid (TTL) som avhenger av endepunktet, f.eks.
+lang levetid for datakatalogen (vegobjekttyper) og kortere for vegobjekter og vegnett.
+
+Når levetiden er ute spør vi NVDB api om svaret er endret (If-None-Match / If-Modified-Since),
+såfremt vi fikk ETag eller Last-Modified da svaret ble lagret. Svarer NVDB api 304 Not Modified
+bruker vi det vi har lagret. Blir cachen større enn maksbytes kaster vi de svarene som er
+brukt for lengst siden (LRU).
+
+Slås på for alle apiforbindelser i python-prosessen med setthttpcache:
+
+    from nvdbapiv3 import setthttpcache
+    setthttpcache( 'nvdbcache' )
+
+Bruker kun standardbiblioteket (sqlite3).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from time import time
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Levetid (sekunder) per type endepunkt, første treff på del av url-stien gjelder.
+STANDARD_TTL = [    ( '/statistikk',     3600 ),
+                    ( 'vegobjekttyper',  24*3600 ),
+                    ( 'omrader',         7*24*3600 ),
+                    ( 'status',          300 ),
+                    ( 'vegobjekt',       600 ),
+                    ( 'vegnett',         600 ),
+                    ( '',                600 ) ]
+
+# http-headere som kan gi ulikt svar for samme url, og derfor inngår i nøkkelen
+NOKKELHEADERE = ( 'accept', 'accept-language', 'x-kontaktperson' )
+
+class diskcache( ):
+    """
+    Mellomlager for svar fra NVDB api i en sqlite-fil på disk. Trådsikker.
+
+    Eksempel
+        cache = diskcache( 'nvdbcache', maksbytes=2e9 )
+        r = cache.hent( url, params, headers )
+    """
+
+    def __init__( self, katalog='nvdbcache', maksbytes=500e6, ttl=None ):
+        """
+        KEYWORDS
+            katalog='nvdbcache' : Katalog for cache-filen, opprettes ved behov
+
+            maksbytes=500e6 : Maks størrelse på lagrede svar (bytes). De minst nylig brukte
+                              svarene kastes når vi går over
+
+            ttl=None : Liste med ( del av url-sti, levetid i sekunder ), første treff gjelder.
+                       Default STANDARD_TTL
+        """
+        if ttl is None:
+            ttl = STANDARD_TTL
+        self.katalog = katalog
+        self.maksbytes = maksbytes
+        self.ttl = list( ttl )
+        self.statistikk = { 'treff' : 0, 'ikkeendret' : 0, 'bom' : 0, 'lagret' : 0, 'kastet' : 0 }
+
+        os.makedirs( katalog, exist_ok=True )
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect( os.path.join( katalog, 'nvdbapiv3cache.sqlite' ),
+                                    check_same_thread=False )
+        self._db.execute( """CREATE TABLE IF NOT EXISTS svar ( nokkel TEXT PRIMARY KEY, url TEXT,
+                            headere TEXT, innhold BLOB, lagret REAL, brukt REAL, storrelse INTEGER )""" )
+        self._db.execute( 'CREATE INDEX IF NOT EXISTS svar_brukt ON svar ( brukt )' )
+        self._db.commit()
+
+    def levetid( self, url ):
+        """Returnerer levetid (sekunder) for svar fra denne url'en"""
+        sti = urlsplit( url ).path
+        for delsti, sekunder in self.ttl:
+            if delsti in sti:
+                return sekunder
+        return 0
+
+    def nokkel( self, url, params=None, headers=None ):
+        """Normalisert nøkkel for url, parametre (sortert) og de http-headerne som kan endre svaret"""
+        deler = [ url ]
+        if params:
+            par = []
+            for k, v in params.items():
+                if isinstance( v, ( list, tuple ) ):
+                    par.extend( [ ( str(k), str(x) ) for x in v ] )
+                elif v is not None:
+                    par.append( ( str(k), str(v) ) )
+            deler.append( urlencode( sorted( par ) ) )
+
+        if headers:
+            hdr = { k.lower() : str(v) for k, v in headers.items() if k.lower() in NOKKELHEADERE }
+            deler.append( urlencode( sorted( hdr.items() ) ) )
+
+        return hashlib.sha256( '\n'.join( deler ).encode( 'utf-8' ) ).hexdigest()
+
+    def hent( self, nokkel ):
+        """
+        Slår opp lagret svar.
+
+        RETURNS
+            ( respons, fersk ) der respons er requests.Response laget ut fra det lagrede svaret (eller
+            None hvis vi ikke har det), og fersk er True hvis svaret er innenfor levetiden sin
+        """
+        with self._lock:
+            rad = self._db.execute( 'SELECT url, headere, innhold, lagret FROM svar WHERE nokkel=?',
+                                        ( nokkel, ) ).fetchone()
+            if not rad:
+                self.statistikk['bom'] += 1
+                return None, False
+
+            self._db.execute( 'UPDATE svar SET brukt=? WHERE nokkel=?', ( time(), nokkel ) )
+            self._db.commit()
+
+            url, headere, innhold, lagret = rad
+            fersk = time() - lagret < self.levetid( url )
+            if fersk:
+                self.statistikk['treff'] += 1
+
+        return _respons( url, json.loads( headere ), innhold ), fersk
+
+    def valideringsheadere( self, respons ):
+        """http-headere for betinget GET (If-None-Match / If-Modified-Since) ut fra lagret svar"""
+        hdr = { }
+        if respons is None:
+            return hdr
+        if 'ETag' in respons.headers:
+            hdr['If-None-Match'] = respons.headers['ETag']
+        if 'Last-Modified' in respons.headers:
+            hdr['If-Modified-Since'] = respons.headers['Last-Modified']
+        return hdr
+
+    def fornyet( self, nokkel ):
+        """NVDB api har svart 304 Not Modified, lagret svar får ny levetid"""
+        with self._lock:
+            self._db.execute( 'UPDATE svar SET lagret=? WHERE nokkel=?', ( time(), nokkel ) )
+            self._db.commit()
+            self.statistikk['ikkeendret'] += 1
+
+    def lagre( self, nokkel, respons ):
+        """Lagrer svaret hvis det er 200 OK og NVDB api ikke har bedt oss la være (Cache-Control: no-store)"""
+        if respons.status_code != 200 or 'no-store' in respons.headers.get( 'Cache-Control', '' ):
+            return
+
+        innhold = respons.content
+        headere = { k : v for k, v in respons.headers.items()
+                        if k.lower() not in ( 'content-encoding', 'content-length', 'transfer-encoding' ) }
+        naa = time()
+        with self._lock:
+            self._db.execute( 'INSERT OR REPLACE INTO svar VALUES ( ?, ?, ?, ?, ?, ?, ? )',
+                    ( nokkel, respons.url, json.dumps( headere ), innhold, naa, naa, len( innhold ) ) )
+            self.statistikk['lagret'] += 1
+            self._rydd()
+            self._db.commit()
+
+    def _rydd( self ):
+        """Kaster minst nylig brukte svar til vi er under maksbytes. Kalles med self._lock"""
+        totalt = self._db.execute( 'SELECT COALESCE( SUM( storrelse ), 0 ) FROM svar' ).fetchone()[0]
+        if totalt <= self.maksbytes:
+            return
+
+        for nokkel, storrelse in self._db.execute( 'SELECT nokkel, storrelse FROM svar ORDER BY brukt' ).fetchall():
+            if totalt <= 0.9 * self.maksbytes:
+                break
+            self._db.execute( 'DELETE FROM svar WHERE nokkel=?', ( nokkel, ) )
+            totalt -= storrelse
+            self.statistikk['kastet'] += 1
+
+    def tom( self ):
+        """Sletter alle lagrede svar"""
+        with self._lock:
+            self._db.execute( 'DELETE FROM svar' )
+            self._db.commit()
+
+def _respons( url, headere, innhold ):
+    """Lager requests.Response ut fra lagret svar, slik at den kan brukes akkurat som et svar fra NVDB api"""
+    r = requests.Response()
+    r.status_code = 200
+    r.reason = 'OK'
+    r.url = url
+    r.headers = CaseInsensitiveDict( headere )
+    r._content = innhold
+    r.encoding = requests.utils.get_encoding_from_headers( r.headers ) or 'utf-8'
+    return r
+
+_httpcache = None
+
+def httpcache( ):
+    """Returnerer den felles diskcache for python-prosessen, evt None hvis cache ikke er slått på"""
+    return _httpcache
+
+def setthttpcache( katalog='nvdbcache', maksbytes=500e6, ttl=None ):
+    """
+    Slår på (eller av) lokal cache på disk for alle http GET mot NVDB api i denne python-prosessen
+
+    Eksempel
+        setthttpcache( 'nvdbcache', maksbytes=2e9, ttl=[ ( 'vegobjekttyper', 7*24*3600 ), ( '', 3600 ) ] )
+        setthttpcache( None ) # Slår av cache
+
+    KEYWORDS
+        katalog='nvdbcache' : Katalog for cache-filen. None slår av cache
+
+        maksbytes=500e6, ttl=None : Se diskcache
+
+    RETURNS
+        diskcache-objektet som nå brukes, evt None
+    """
+    global _httpcache
+    if katalog is None:
+        _httpcache = None
+    else:
+        _httpcache = diskcache( katalog=katalog, maksbytes=maksbytes, ttl=ttl )
+    return _httpcache
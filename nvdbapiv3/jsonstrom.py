@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Inkrementell oversetting av JSON-respons fra NVDB api LES
+
+En side fra NVDB api har strukturen { "objekter" : [ ... ], "metadata" : { ... } }. Med
+klassen jsonside leser vi objektene ett og ett fra http-strømmen (requests med stream=True),
+i stedet for å oversette hele siden med r.json(). Vi holder da kun ett objekt i minnet av
+gangen, ikke hele siden. Øvrige elementer (metadata) blir oversatt på vanlig måte.
+
+Bruker kun standardbiblioteket (json.JSONDecoder.raw_decode).
+"""
+import codecs
+import json
+from json import JSONDecodeError
+
+_dekoder = json.JSONDecoder()
+_mellomrom = ' \t\n\r'
+
+class jsonside():
+    """
+    Leser en side fra NVDB api som strøm.
+
+    Iterer over jsonside.objekter for å få objektene ett og ett. Når objektene er lest ferdig
+    (eller når du ber om det) er resten av siden oversatt, og ligger i jsonside.metadata
+
+    Eksempel
+        r = forbindelse.les( url, stream=True )
+        side = jsonside( r.iter_content( chunk_size=65536 ) )
+        for obj in side.objekter:
+            print( obj['id'] )
+        print( side.metadata['returnert'] )
+    """
+
+    def __init__( self, biter, listenavn='objekter' ):
+        """
+        ARGUMENTS
+            biter - iterator med bytes (eller tekst), f.eks. requests.Response.iter_content()
+
+        KEYWORDS
+            listenavn='objekter' : Navn på den listen vi leser element for element
+        """
+        self.listenavn = listenavn
+        self.ovrige = { }
+        self._biter = iter( biter )
+        self._utf8 = codecs.getincrementaldecoder( 'utf-8' )()
+        self._buffer = ''
+        self._pos = 0
+        self._slutt = False
+        self._ferdig = False
+        self.objekter = self._objekter()
+
+    @property
+    def metadata( self ):
+        """Metadata for siden. Leser (og kaster) resten av objektene hvis vi ikke er ferdig med dem"""
+        if not self._ferdig:
+            for junk in self.objekter:
+                pass
+        return self.ovrige.get( 'metadata', { } )
+
+    def _lesmer( self ):
+        """Føyer neste bit av strømmen til bufferet. Returnerer False når strømmen er tom"""
+        if self._slutt:
+            return False
+
+        # Kaster det vi har lest ferdig, så bufferet ikke vokser med hele siden
+        if self._pos > 0:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+
+        try:
+            bit = next( self._biter )
+        except StopIteration:
+            self._buffer += self._utf8.decode( b'', final=True )
+            self._slutt = True
+            return False
+
+        if isinstance( bit, bytes ):
+            bit = self._utf8.decode( bit )
+        self._buffer += bit
+        return True
+
+    def _tegn( self ):
+        """Hopper over mellomrom og returnerer neste tegn (uten å flytte posisjon), evt None ved slutt"""
+        while True:
+            while self._pos < len( self._buffer ) and self._buffer[self._pos] in _mellomrom:
+                self._pos += 1
+            if self._pos < len( self._buffer ):
+                return self._buffer[self._pos]
+            if not self._lesmer():
+                return None
+
+    def _forvent( self, tegn ):
+        if self._tegn() != tegn:
+            raise JSONDecodeError( 'Forventet ' + tegn, self._buffer, self._pos )
+        self._pos += 1
+
+    def _verdi( self ):
+        """Oversetter en komplett JSON-verdi fra posisjon, leser mer fra strømmen ved behov"""
+        self._tegn()
+        behov = 0
+        while True:
+            if len( self._buffer ) - self._pos >= behov or self._slutt:
+                try:
+                    verdi, slutt = _dekoder.raw_decode( self._buffer, self._pos )
+                except JSONDecodeError:
+                    if self._slutt:
+                        raise
+                else:
+                    # Et tall helt på slutten av bufferet kan være avkuttet, må ha ett tegn til for å være sikker
+                    if slutt < len( self._buffer ) or self._slutt:
+                        self._pos = slutt
+                        return verdi
+
+                # Dobler hvor mye vi leser før neste forsøk, ellers blir store objekter kvadratisk dyre
+                behov = max( 2 * ( len( self._buffer ) - self._pos ), 1)
+
+            self._lesmer()
+
+    def _objekter( self ):
+        """Generator som gir oss elementene i listen med objekter, og oversetter resten av siden underveis"""
+        self._forvent( '{' )
+        while True:
+            tegn = self._tegn()
+            if tegn == '}':
+                self._pos += 1
+                break
+            elif tegn == ',':
+                self._pos += 1
+                continue
+
+            navn = self._verdi()
+            self._forvent( ':' )
+
+            if navn == self.listenavn and self._tegn() == '[':
+                self._pos += 1
+                while True:
+                    tegn = self._tegn()
+                    if tegn == ']':
+                        self._pos += 1
+                        break
+                    elif tegn == ',':
+                        self._pos += 1
+                    elif tegn is None:
+                        raise JSONDecodeError( 'Uventet slutt på liste ' + self.listenavn, self._buffer, self._pos )
+                    else:
+                        yield self._verdi()
+            else:
+                self.ovrige[navn] = self._verdi()
+
+        self._ferdig = True
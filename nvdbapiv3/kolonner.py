@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Kolonnevis lagring av utflatede NVDB-data, og konvertering til Apache Arrow
+
+to_records() gir en liste med dictionaries, én per rad. Det er lettvint, men hver rad har sin
+egen dictionary med alle kolonnenavnene, og når dataene deretter gjøres om til pandas DataFrame
+har vi alt to ganger i minnet. Med kolonnebygger legger vi verdiene rett inn i én liste per kolonne
+(dictionary { kolonnenavn : [ verdier ] }), som pandas.DataFrame og pyarrow leser direkte.
+
+til_arrow gjør om kolonnene til pyarrow.Table med datatyper fra datakatalogen (kolonnetyper):
+tall som int64/float64, enum-tekster som dictionary-kodet tekst, datoer som date32 og posisjoner
+langs veglenkesekvens som float64.
+
+Krever pyarrow (pip install pyarrow) for til_arrow, øvrige funksjoner bruker kun standardbiblioteket.
+"""
+import json
+from warnings import warn
+
+# Datatyper for de faste kolonnene fra nvdbfagdata2records og flatutvegnettsegment
+FASTETYPER = {  'objekttype'        : 'int64',
+                'nvdbId'            : 'int64',
+                'versjon'           : 'int64',
+                'veglenkesekvensid' : 'int64',
+                'kommune'           : 'int64',
+                'fylke'             : 'int64',
+                'vegnummer'         : 'int64',
+                'nummer'            : 'int64',
+                'startposisjon'     : 'float64',
+                'sluttposisjon'     : 'float64',
+                'relativPosisjon'   : 'float64',
+                'segmentlengde'     : 'float64',
+                'strekningslengde'  : 'float64',
+                'lengde'            : 'float64',
+                'startdato'         : 'dato',
+                'sluttdato'         : 'dato',
+                'detaljnivå'        : 'enum',
+                'typeVeg'           : 'enum',
+                'vegkategori'       : 'enum',
+                'fase'              : 'enum',
+                'trafikantgruppe'   : 'enum',
+                'medium'            : 'enum',
+                'veglenkeType'      : 'enum',
+                'adskilte_lop'      : 'enum' }
+
+# Kolonnene vi kan få fra flatutvegnettsegment (vegnett), i den rekkefølgen de normalt kommer
+VEGNETTKOLONNER = ( 'veglenkesekvensid', 'startposisjon', 'sluttposisjon', 'kortform', 'veglenkenummer',
+                    'segmentnummer', 'startnode', 'sluttnode', 'referanse', 'type', 'detaljnivå', 'typeVeg',
+                    'typeVeg_sosi', 'målemetode', 'måledato', 'feltoversikt', 'geometri', 'medium', 'lengde',
+                    'fylke', 'kommune', 'vegsystemreferanse', 'superstedfesting', 'startdato', 'sluttdato', 'vref',
+                    'vegkategori', 'fase', 'nummer', 'strekning', 'delstrekning', 'ankerpunktmeter', 'kryssdel',
+                    'sideanleggsdel', 'fra_meter', 'til_meter', 'trafikantgruppe' )
+
+# Faste kolonner fra nvdbfagdata2records: Metadata, og enten vegsegmenter eller lokasjon
+FAGDATAKOLONNER = ( 'objekttype', 'nvdbId', 'versjon', 'startdato', 'sluttdato' )
+VEGSEGMENTKOLONNER = (  'veglenkesekvensid', 'detaljnivå', 'typeVeg', 'kommune', 'fylke', 'vref', 'veglenkeType',
+                        'medium', 'vegkategori', 'fase', 'vegnummer', 'startposisjon', 'sluttposisjon',
+                        'segmentlengde', 'relativPosisjon', 'adskilte_lop', 'trafikantgruppe', 'geometri' )
+LOKASJONKOLONNER = ( 'vegsystemreferanser', 'stedfestinger', 'vegsegmenter', 'geometri', 'strekningslengde' )
+
+# Datatype for egenskapstypene i datakatalogen
+EGENSKAPSTYPER = {  'Tall'          : 'float64',
+                    'Heltallenum'   : 'int64',
+                    'Flyttallenum'  : 'float64',
+                    'Tekstenum'     : 'enum',
+                    'Tekst'         : 'tekst',
+                    'Dato'          : 'dato',
+                    'Kortdato'      : 'tekst',
+                    'Klokkeslett'   : 'tekst',
+                    'Binær'         : 'tekst',
+                    'Geometri'      : 'tekst' }
+
+class kolonnebygger( ):
+    """
+    Samler rader (dictionaries) kolonnevis, dvs som { kolonnenavn : [ verdier ] }
+
+    Kolonner som mangler i en rad får verdien None, og kolonner som dukker opp underveis fylles
+    med None for de radene vi allerede har.
+
+    Eksempel
+        bygger = kolonnebygger( )
+        for rad in rader:
+            bygger.leggtil( rad )
+        df = pd.DataFrame( bygger.kolonner )
+    """
+
+    def __init__( self, kolonnenavn=None ):
+        """
+        KEYWORDS
+            kolonnenavn=None : Liste med kolonnenavn vi vet om på forhånd (bestemmer rekkefølgen)
+        """
+        self.kolonner = { }
+        self.antall = 0
+        if kolonnenavn:
+            for navn in kolonnenavn:
+                self.kolonner[navn] = [ ]
+
+    def leggtil( self, rad ):
+        """Føyer en rad (dictionary) til kolonnene"""
+        kolonner = self.kolonner
+        for navn, verdi in rad.items():
+            kol = kolonner.get( navn )
+            if kol is None:
+                kol = kolonner[navn] = [ None ] * self.antall
+            kol.append( verdi )
+
+        self.antall += 1
+        if len( rad ) < len( kolonner ):
+            for kol in kolonner.values():
+                if len( kol ) < self.antall:
+                    kol.append( None )
+
+def kolonnetyper( objektTypeDef=None ):
+    """
+    Datatyper for kolonnene, ut fra datakatalogen for objekttypen (evt kun de faste kolonnene for vegnett)
+
+    ARGUMENTS
+        None
+
+    KEYWORDS
+        objektTypeDef=None : Definisjon av objekttypen fra datakatalogen, f.eks. nvdbFagdata.objektTypeDef
+
+    RETURNS
+        dictionary { kolonnenavn : 'int64' | 'float64' | 'enum' | 'dato' | 'tekst' }
+    """
+    typer = dict( FASTETYPER )
+    if objektTypeDef:
+        for eg in objektTypeDef.get( 'egenskapstyper', [ ] ):
+            hva = EGENSKAPSTYPER.get( eg.get( 'egenskapstype' ) )
+            if hva == 'float64' and eg.get( 'desimaler' ) == 0:
+                hva = 'int64'
+            if hva:
+                typer[eg['navn']] = hva
+    return typer
+
+def fagdatakolonner( egenskaper, vegsegmenter=True, relasjoner=True ):
+    """
+    Alle kolonnene nvdbfagdata2records kan gi, i rekkefølge
+
+    ARGUMENTS
+        egenskaper - liste med navn på egenskapstypene, f.eks. egenskapskjema( ..., fastskjema=True ).mal
+
+    KEYWORDS
+        vegsegmenter=True, relasjoner=True : Som for nvdbfagdata2records
+
+    RETURNS
+        liste med kolonnenavn
+    """
+    navn = list( FAGDATAKOLONNER ) + list( egenskaper )
+    if relasjoner:
+        navn.append( 'relasjoner' )
+    navn.extend( VEGSEGMENTKOLONNER if vegsegmenter else LOKASJONKOLONNER )
+    return navn
+
+def _arrowtype( pa, hva ):
+    """pyarrow-datatype for datatypene fra kolonnetyper, samme som til_arrow gir. Ukjent datatype blir tekst"""
+    if hva == 'enum':
+        return pa.dictionary( pa.int32(), pa.string() )
+    elif hva == 'dato':
+        return pa.date32()
+    elif hva == 'int64':
+        return pa.int64()
+    elif hva == 'float64':
+        return pa.float64()
+    return pa.string()
+
+def til_arrow( kolonner, typer=None, skjema=None ):
+    """
+    Gjør om kolonner ( { kolonnenavn : [ verdier ] } ) til pyarrow.Table
+
+    Kolonner med dictionary eller liste (f.eks. relasjoner, vegsegmenter) lagres som JSON-tekst.
+    Kolonner der verdiene ikke passer med datatypen fra datakatalogen får den datatypen pyarrow
+    selv finner (evt tekst).
+
+    ARGUMENTS
+        kolonner - dictionary { kolonnenavn : [ verdier ] }, f.eks. kolonnebygger.kolonner
+
+    KEYWORDS
+        typer=None : dictionary { kolonnenavn : datatype }, se kolonnetyper
+
+        skjema=None : pyarrow.Schema. Tabellen får nøyaktig disse kolonnene og datatypene (kolonner som
+                      mangler blir tomme, andre kolonner utelates). Brukes når flere tabeller skal
+                      skrives til samme fil, se geoparquet
+
+    RETURNS
+        pyarrow.Table
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError( 'to_arrow krever pyarrow, installer med: pip install pyarrow' )
+
+    if typer is None:
+        typer = FASTETYPER
+
+    arrowtyper = {  'int64'   : pa.int64(),
+                    'float64' : pa.float64(),
+                    'tekst'   : pa.string() }
+
+    if skjema is not None:
+        antall = len( next( iter( kolonner.values() ), [ ] ) )
+        navneliste = skjema.names
+    else:
+        navneliste = list( kolonner.keys() )
+
+    arrays = [ ]
+    for navn in navneliste:
+        verdier = kolonner.get( navn )
+        if verdier is None:
+            verdier = [ None ] * antall
+        forste = next( ( v for v in verdier if v is not None ), None )
+        if isinstance( forste, ( dict, list ) ):
+            verdier = [ json.dumps( v, ensure_ascii=False ) if v is not None else None for v in verdier ]
+
+        if skjema is not None:
+            arrays.append( _fastarray( pa, verdier, skjema.field( navn ).type ) )
+            continue
+
+        hva = typer.get( navn )
+        try:
+            if hva == 'enum':
+                arr = pa.array( verdier, type=pa.string() ).dictionary_encode()
+            elif hva == 'dato':
+                arr = pa.array( verdier, type=pa.string() ).cast( pa.date32() )
+            elif hva in arrowtyper:
+                arr = pa.array( verdier, type=arrowtyper[hva] )
+            else:
+                arr = pa.array( verdier )
+        except ( pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError ):
+            try:
+                arr = pa.array( verdier )
+            except ( pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError ):
+                arr = pa.array( [ str( v ) if v is not None else None for v in verdier ], type=pa.string() )
+        arrays.append( arr )
+
+    return pa.Table.from_arrays( arrays, names=navneliste )
+
+def _fastarray( pa, verdier, datatype ):
+    """pyarrow.Array med gitt datatype. Verdier som ikke lar seg konvertere blir tekst (evt tomme)"""
+    try:
+        if pa.types.is_dictionary( datatype ):
+            return pa.array( verdier, type=datatype.value_type ).dictionary_encode().cast( datatype )
+        elif pa.types.is_date32( datatype ):
+            return pa.array( verdier, type=pa.string() ).cast( datatype )
+        return pa.array( verdier, type=datatype )
+    except ( pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError ):
+        pass
+
+    try:
+        return pa.array( verdier ).cast( datatype )
+    except ( pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, TypeError, ValueError ):
+        pass
+
+    if pa.types.is_string( datatype ):
+        return pa.array( [ str( v ) if v is not None else None for v in verdier ], type=datatype )
+
+    # Går ikke å konvertere, f.eks. tekst i en tallkolonne
+    warn( 'Kunne ikke konvertere verdiene til ' + str( datatype ) + ', kolonnen blir tom for disse radene' )
+    return pa.nulls( len( verdier ), type=datatype )
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Kompakt representasjon av vegobjekter og vegsegmenter fra NVDB api LES
+
+Et vegobjekt eller vegsegment som python dictionary (slik det kommer fra json.loads) bruker mye mer
+minne enn selve dataene: Hver dictionary, hvert nøkkelnavn og hvert nøstet element er egne python-objekter.
+Skal du holde millioner av objekter i minnet blir det fort flere titalls GB.
+
+kompaktvegsegment og kompaktvegobjekt har de mest brukte verdiene (id, versjon, objekttype,
+veglenkesekvensid, start- og sluttposisjon, kommune, fylke og vegsystemreferanse) som attributter i
+__slots__-klasser. Resten av JSON-strukturen lagres som kompakt JSON-tekst (bytes), og oversettes først
+når noen spør etter den.
+
+Eksempel
+    v = nvdbVegnett()
+    segmenter = v.to_kompakt()
+    print( segmenter[0].veglenkesekvensid, segmenter[0].vref )
+    print( segmenter[0]['geometri'] )   # Oversetter resten av JSON-strukturen ved behov
+    rådata = segmenter[0].json()        # Opprinnelig dictionary
+"""
+import json
+
+def _pakk( data ):
+    """Kompakt JSON-tekst (bytes) for dictionary"""
+    return json.dumps( data, ensure_ascii=False, separators=( ',', ':' ) ).encode( 'utf-8' )
+
+class kompaktvegsegment( ):
+    """
+    Kompakt vegsegment, enten fra segmentert vegnett (nvdbVegnett) eller et vegobjekts vegsegmenter
+
+    Attributter: veglenkesekvensid, startposisjon, sluttposisjon, kommune, fylke, vref (kortform
+    vegsystemreferanse). Øvrige data slås opp med segment['nøkkel'] eller segment.json()
+    """
+    __slots__ = ( 'veglenkesekvensid', 'startposisjon', 'sluttposisjon', 'kommune', 'fylke', 'vref', '_rest' )
+
+    _FELT = ( 'veglenkesekvensid', 'startposisjon', 'sluttposisjon', 'kommune', 'fylke' )
+
+    def __init__( self, segment ):
+        """
+        ARGUMENTS
+            segment - dictionary med vegsegment slik det kommer fra NVDB api
+        """
+        rest = dict( segment )
+        self.veglenkesekvensid  = rest.pop( 'veglenkesekvensid', None )
+        self.startposisjon      = rest.pop( 'startposisjon', None )
+        self.sluttposisjon      = rest.pop( 'sluttposisjon', None )
+        self.kommune            = rest.pop( 'kommune', None )
+        self.fylke              = rest.pop( 'fylke', None )
+
+        vegref = rest.get( 'vegsystemreferanse' )
+        self.vref = vegref.get( 'kortform' ) if isinstance( vegref, dict ) else None
+        self._rest = _pakk( rest )
+
+    def json( self ):
+        """Returnerer vegsegmentet som dictionary, samme struktur som fra NVDB api"""
+        data = { }
+        for felt in self._FELT:
+            verdi = getattr( self, felt )
+            if verdi is not None:
+                data[felt] = verdi
+        data.update( json.loads( self._rest ) )
+        return data
+
+    def __getitem__( self, nokkel ):
+        if nokkel in self._FELT:
+            verdi = getattr( self, nokkel )
+            if verdi is None:
+                raise KeyError( nokkel )
+            return verdi
+        return json.loads( self._rest )[nokkel]
+
+    def get( self, nokkel, default=None ):
+        try:
+            return self[nokkel]
+        except KeyError:
+            return default
+
+    def __repr__( self ):
+        return 'kompaktvegsegment( ' + str( self.veglenkesekvensid ) + ' ' + str( self.startposisjon ) + '-' + \
+                    str( self.sluttposisjon ) + ' ' + str( self.vref ) + ' )'
+
+class kompaktvegobjekt( ):
+    """
+    Kompakt vegobjekt (fagdata)
+
+    Attributter: id, versjon, type (objekttype-ID) og vegsegmenter (tuple med kompaktvegsegment).
+    Øvrige data (egenskaper, lokasjon, geometri, relasjoner...) slås opp med objekt['nøkkel'] eller
+    objekt.json()
+    """
+    __slots__ = ( 'id', 'versjon', 'type', 'vegsegmenter', '_rest' )
+
+    def __init__( self, vegobjekt ):
+        """
+        ARGUMENTS
+            vegobjekt - dictionary med vegobjekt slik det kommer fra NVDB api
+        """
+        rest = dict( vegobjekt )
+        self.id = rest.pop( 'id', None )
+        metadata = rest.get( 'metadata', { } )
+        self.versjon = metadata.get( 'versjon' )
+        self.type = metadata.get( 'type', { } ).get( 'id' )
+        if 'vegsegmenter' in rest:
+            self.vegsegmenter = tuple( kompaktvegsegment( seg ) for seg in rest.pop( 'vegsegmenter' ) )
+        else:
+            self.vegsegmenter = None
+        self._rest = _pakk( rest )
+
+    def json( self ):
+        """Returnerer vegobjektet som dictionary, samme struktur som fra NVDB api"""
+        data = { 'id' : self.id }
+        data.update( json.loads( self._rest ) )
+        if self.vegsegmenter is not None:
+            data['vegsegmenter'] = [ seg.json() for seg in self.vegsegmenter ]
+        return data
+
+    def __getitem__( self, nokkel ):
+        if nokkel == 'id':
+            return self.id
+        elif nokkel == 'vegsegmenter' and self.vegsegmenter is not None:
+            return [ seg.json() for seg in self.vegsegmenter ]
+        return json.loads( self._rest )[nokkel]
+
+    def get( self, nokkel, default=None ):
+        try:
+            return self[nokkel]
+        except KeyError:
+            return default
+
+    def __repr__( self ):
+        return 'kompaktvegobjekt( type=' + str( self.type ) + ' id=' + str( self.id ) + ' versjon=' + str( self.versjon ) + ' )'
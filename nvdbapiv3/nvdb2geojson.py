@@ -4,13 +4,16 @@
 Bruker klassene nvdbVegnett og nvdbFagdata fra nvdbapi.py
 Pga shapely-biblioteket, som kan være litt trælete å installere, har jeg 
 valgt å skille lagring til geojson fra resten. 
+
+vegnett2geojson og fagdata2geojson bygger hele FeatureCollection i minnet. For store uttak 
+bruker du skrivgeojson, som skriver ett og ett objekt rett til fil (GeoJSON eller GeoJSON Lines)
 """ 
 import nvdbapiv3 as nvdbapi
 import geojson 
 import json 
-import copy
 import shapely.wkt
 from warnings import warn
+from . import geometri
 
 
 
@@ -124,7 +127,7 @@ def __addfag2geojson( fag, mygeojson, vegsegmenter=True):
         egenskaper['antall vegsegmenter'] = len( fag['vegsegmenter'])
         count = 0
         for seg in fag['vegsegmenter']: 
-            eg = copy.deepcopy( egenskaper )
+            eg = dict( egenskaper )
             count += 1
             eg['vegsegment nr'] = count
             
@@ -221,4 +224,159 @@ def geojsontemplate():
                     },
                     "features": []
                 }
-    
\ No newline at end of file
+    
+
+
+def skrivgeojson( sokeobjekt, fil, linjer=False, maxcount=False, vegsegmenter=True ): 
+    """Skriver vegnett eller fagdata til fil som GeoJSON, ett og ett objekt etter hvert som de 
+    lastes ned fra NVDB api. Minnebruken er den samme uansett hvor stort uttaket er. 
+
+    Egenskapene blir de samme som fra vegnett2geojson og fagdata2geojson, men vi bruker ikke 
+    shapely: Koordinatene i WKT kopieres rett over til GeoJSON (se geometri.wkt2geojsontekst). 
+    Koordinatene er i UTM sone 33 (epsg:25833), som angitt i crs for FeatureCollection. 
+
+    Eksempel
+        v = nvdbVegnett()
+        v.filter( { 'kommune' : 5001 } )
+        skrivgeojson( v, 'vegnett.geojson' )
+
+        f = nvdbFagdata( 105 ) # Fartsgrense
+        with open( 'fartsgrense.geojsonl', 'w', encoding='utf-8' ) as fil: 
+            skrivgeojson( f, fil, linjer=True )
+
+    ARGUMENTS
+        sokeobjekt - nvdbVegnett eller nvdbFagdata, evt liste med vegnett eller fagdata fra NVDB api 
+
+        fil - filnavn eller åpen (tekst)fil 
+
+    KEYWORDS
+        linjer=False | True : True gir GeoJSON Lines (én feature per linje, uten FeatureCollection og crs)
+
+        maxcount=False | heltall : Stopp etter så mange vegsegmenter / vegobjekter 
+
+        vegsegmenter=True | False : Kun fagdata, se fagdata2geojson 
+
+    RETURNS
+        antall features skrevet til fil 
+    """
+    if isinstance( fil, str ): 
+        with open( fil, 'w', encoding='utf-8' ) as f: 
+            return skrivgeojson( sokeobjekt, f, linjer=linjer, maxcount=maxcount, vegsegmenter=vegsegmenter )
+
+    if linjer: 
+        skilletegn = '\n'
+    else: 
+        mal = geojsontemplate()
+        mal.pop( 'features' )
+        fil.write( json.dumps( mal )[:-1] + ', "features": [\n' )
+        skilletegn = ',\n'
+
+    antall = 0
+    for geomtekst, egenskaper in __features( sokeobjekt, maxcount=maxcount, vegsegmenter=vegsegmenter ): 
+        if antall > 0 and not linjer: 
+            fil.write( skilletegn )
+        fil.write( '{"type": "Feature", "geometry": ' + geomtekst + ', "properties": ' + 
+                        json.dumps( egenskaper, ensure_ascii=False ) + '}' )
+        if linjer: 
+            fil.write( skilletegn )
+        antall += 1
+
+    if not linjer: 
+        fil.write( '\n]}\n' )
+
+    return antall 
+
+
+def __features( sokeobjekt, maxcount=False, vegsegmenter=True ): 
+    """Intern metode, generator med ( geometri som GeoJSON-tekst, egenskaper ) for skrivgeojson"""
+
+    if isinstance( sokeobjekt, ( nvdbapi.nvdbVegnett, list ) ): 
+        if isinstance( sokeobjekt, list ): 
+            objekter = iter( sokeobjekt )
+        else: 
+            objekter = __forekomster( sokeobjekt )
+
+        fagdata = isinstance( sokeobjekt, nvdbapi.nvdbFagdata ) or ( 
+                            isinstance( sokeobjekt, list ) and len( sokeobjekt ) > 0 and 'egenskaper' in sokeobjekt[0] )
+
+        count = 0
+        for obj in objekter: 
+            if fagdata: 
+                yield from __fagfeatures( obj, vegsegmenter=vegsegmenter )
+            else: 
+                yield __vegfeature( obj )
+
+            count += 1
+            if maxcount and count >= maxcount: 
+                break 
+
+    elif isinstance( sokeobjekt, dict ) and 'egenskaper' in sokeobjekt: 
+        yield from __fagfeatures( sokeobjekt, vegsegmenter=vegsegmenter )
+
+    else: 
+        warn( 'Sorry, men gjenkjenner ikke dette som vegnett eller fagdata' )
+
+
+def __forekomster( sokeobjekt ): 
+    """Intern metode, generator med forekomstene fra søkeobjektet"""
+    obj = sokeobjekt.nesteForekomst()
+    while obj: 
+        yield obj 
+        obj = sokeobjekt.nesteForekomst()
+
+
+def __geomtekst( geom ): 
+    """Intern metode, GeoJSON-tekst for geometri-elementet fra NVDB api (evt null)"""
+    if geom and geom.get( 'wkt' ): 
+        return geometri.wkt2geojsontekst( geom['wkt'] )
+    return 'null'
+
+
+def __vegfeature( v ): 
+    """Intern metode, som __addveg2geojson men uten å endre vegsegmentet eller bruke shapely"""
+    egenskaper = {}
+    if 'vegreferanse' in v: 
+        vegref = dict( v['vegreferanse'] )
+        vegref['vrefkortform'] = vegref.pop( 'kortform', None )
+        egenskaper.update( vegref )
+
+    for k, verdi in v.items(): 
+        if k != 'vegreferanse': 
+            egenskaper[k] = verdi
+
+    geom = v.get( 'geometri' )
+    if isinstance( geom, dict ): 
+        egenskaper['geometri'] = { k : verdi for k, verdi in geom.items() if k != 'wkt' }
+
+    return __geomtekst( geom ), egenskaper
+
+
+def __fagfeatures( fag, vegsegmenter=True ): 
+    """Intern metode, som __addfag2geojson men uten deepcopy, uten å endre objektet og uten shapely"""
+
+    egenskaper = {}
+    for k in fag.get( 'egenskaper', [] ):
+        if 'verdi' in k:
+            egenskaper[k['navn']] = k['verdi']
+
+    egenskaper['id'] = fag['id']
+    egenskaper['metadata'] = fag['metadata']
+
+    if vegsegmenter: 
+        segmenter = fag.get( 'vegsegmenter', [] )
+        egenskaper['antall vegsegmenter'] = len( segmenter )
+        for count, seg in enumerate( segmenter, start=1 ): 
+            eg = dict( egenskaper )
+            eg['vegsegment nr'] = count
+            eg.update( seg.get( 'vegsystemreferanse', {} ) )
+            for k, verdi in seg.items(): 
+                if k not in ( 'geometri', 'vegsystemreferanse' ): 
+                    eg[k] = verdi
+
+            yield __geomtekst( seg.get( 'geometri' ) ), eg
+
+    else: 
+        lokasjon = fag.get( 'lokasjon' )
+        if isinstance( lokasjon, dict ): 
+            egenskaper['lokasjon'] = { k : verdi for k, verdi in lokasjon.items() if k != 'geometri' }
+        yield __geomtekst( fag.get( 'geometri' ) ), egenskaper
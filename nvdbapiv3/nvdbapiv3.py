@@ -20,15 +20,27 @@ import json
 import requests
 from warnings import warn
 import os
+import copy
 from copy import deepcopy
-from time import sleep
+from time import perf_counter
 import pdb
 from datetime import datetime
 import dateutil.parser
 import re
+import urllib.parse
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
 from json import JSONDecodeError
 
 from . import apiforbindelse
+from . import jsonstrom
+from . import datakatalog
+from . import kolonner
+from . import kompakt
+from . import geometri
+from . import geoparquet
 import nvdbapiv3
 
 # Uncomment to silent those unverified https-request warnings
@@ -78,8 +90,18 @@ class nvdbVegnett:
                                                         # 
                                 'meredata'      : True, # Gjetning på om vi kan hente mere data
                                 'initielt'      : True,  # Initiell ladning av datasett
-                                'dummy'         : False # Jukse-bruk av paginering 
+                                'dummy'         : False, # Jukse-bruk av paginering 
+                                'prefetch'      : 0,    # Antall sider vi henter i bakgrunnen, 0 = av
+                                'strom'         : False, # Les objektene ett og ett fra http-strømmen
+                                'adaptiv'       : False # Tilpass antall per side etter responstid og datamengde
                     } 
+        self._prefetchtraad = None
+        self._prefetchko    = None
+        self._prefetchstopp = None
+        self.checkpointfil  = None
+        self._stromside     = None
+        self._adaptivmaal   = None
+        self.anropstelling  = { 'anrop' : 0, 'forsok' : 0, 'jsonfeil' : 0, 'timeout' : 0 }
         
         # Standardverdier for responsen, og holder evt tilleggsparametre
         # Initielt tom for vegnett, men langt fagdata
@@ -114,7 +136,7 @@ class nvdbVegnett:
                                     '\tEks: N = nvdbFagData(45)', 
                                     '\teller: N = nvdbFagData()',
                                     '       N.objektType(45)')))
-        if isinstance( self, nvdbFagdata) and not self.antall: 
+        if isinstance( self, nvdbFagdata) and not self.antall and not self.lazy: 
            self.statistikk()
 
         if self.debug: 
@@ -122,16 +144,7 @@ class nvdbVegnett:
         
         if self.paginering['initielt']:
 
-        
-            if isinstance( self, nvdbFagdata): 
-                parametre = merge_dicts(  self.filterdata, self.respons )
-                self.data = self.anrope( '/'.join(('vegobjekter', str(self.objektTypeId) )), 
-                    parametre=parametre ) 
-                    
-            elif isinstance( self, nvdbVegnett): 
-                parametre = self.filterdata
-                self.data = self.anrope( 'vegnett/veglenkesekvenser/segmentert', parametre=parametre )
-
+            self.data = self._hentside()
             self.paginering['initielt'] = False
 
             if self.debug: 
@@ -146,7 +159,7 @@ class nvdbVegnett:
                 return False
                 
         elif self.paginering['meredata']:
-            self.data = self.anrope( self.data['metadata']['neste']['href'] ) 
+            self.data = self._hentside()
 
             if self.debug: 
                 print( 'debug', 'Paginering, anroper API', self.sisteanrop) 
@@ -199,7 +212,7 @@ class nvdbVegnett:
                                     '\teller: N = nvdbFagData()',
                                     '       N.objektType(45)')))
 
-        if isinstance( self, nvdbFagdata) and not self.antall:
+        if isinstance( self, nvdbFagdata) and not self.antall and not self.lazy:
             self.statistikk()
 
         antObjLokalt = len(self.data['objekter'])
@@ -214,17 +227,12 @@ class nvdbVegnett:
             else: 
                 return None
              
+        elif self.paginering['strom']: 
+            return self._nesteForekomst_strom()
+
         elif self.paginering['initielt']: 
         
-            if isinstance( self, nvdbFagdata): 
-                parametre = merge_dicts(  self.filterdata, self.respons )
-                self.data = self.anrope( '/'.join(('vegobjekter', str(self.objektTypeId) )), 
-                    parametre=parametre ) 
-                    
-            elif isinstance( self, nvdbVegnett): 
-                parametre = self.filterdata
-                self.data = self.anrope( 'vegnett/veglenkesekvenser/segmentert', parametre=parametre )
-
+            self.data = self._hentside()
             self.paginering['initielt'] = False
 
             if self.data['metadata']['returnert'] > 0: 
@@ -235,7 +243,7 @@ class nvdbVegnett:
                 return None
                 
         elif self.paginering['meredata'] and self.paginering['hvilken'] > antObjLokalt-1: 
-            self.data = self.anrope( self.data['metadata']['neste']['href'] ) 
+            self.data = self._hentside()
             self.paginering['hvilken'] = 1
             
             if self.data['metadata']['returnert'] > 0: 
@@ -249,6 +257,418 @@ class nvdbVegnett:
             self.paginering['hvilken'] += 1
             return self.data['objekter'][self.paginering['hvilken']-1]
 
+    def strom(self, paa=True): 
+        """
+        Slår på (eller av) strømmende lesing av data fra NVDB api. 
+
+        I stedet for å oversette hele siden (typisk 1000 objekter) fra JSON på en gang leser 
+        nesteForekomst (og dermed to_records, iterasjon med for-løkke etc) objektene ett og 
+        ett direkte fra http-strømmen. Vi holder da omtrent ett objekt i minnet av gangen, 
+        i stedet for en hel side. Nyttig for objekttyper med mye geometri, f.eks. flater. 
+
+        Har ingen effekt for nestePaginering, som per definisjon gir deg hele siden. 
+        Bakgrunnshenting (prefetch) brukes ikke når strømmende lesing er slått på. 
+
+        ARGUMENTS
+            None
+
+        KEYWORDS
+            paa=True | False : Slå strømmende lesing på eller av 
+
+        RETURNS
+            None
+        """
+        self._stromlukk()
+        self.paginering['strom'] = bool( paa )
+
+    def _nesteForekomst_strom(self): 
+        """nesteForekomst for strømmende lesing, der self.data['objekter'] ikke brukes"""
+        while True: 
+            if not self._stromside: 
+                if self.paginering['initielt']: 
+                    path, parametre = self._forsteanrop()
+                elif self.paginering['meredata']: 
+                    if self.checkpointfil: 
+                        self._skrivcheckpoint( self.data['metadata']['neste']['href'] )
+                    path, parametre = self.data['metadata']['neste']['href'], None
+                else: 
+                    return None
+
+                self._stromside = self._anrope_strom( path, parametre=parametre )
+                self.paginering['initielt'] = False
+                self.paginering['hvilken'] = 0
+
+            obj = next( self._stromside.objekter, None )
+            if obj is not None: 
+                self.paginering['hvilken'] += 1
+                return obj 
+
+            # Siden er lest ferdig, da har vi også metadata
+            self.data = { 'objekter' : [], 'metadata' : self._stromside.metadata }
+            self._stromlukk()
+            if isinstance( self, nvdbFagdata) and self.antall is None: 
+                self.antall = self.data['metadata'].get( 'antall' )
+            if self.data['metadata']['returnert'] == 0: 
+                self.paginering['meredata'] = False
+                if self.checkpointfil: 
+                    self._skrivcheckpoint( None, ferdig=True )
+                return None 
+
+    def _anrope_strom(self, path, parametre=None): 
+        """
+        Som anrope, men returnerer jsonstrom.jsonside som leser objektene ett og ett fra http-strømmen. 
+        Nettverksfeil og http 429, 502, 503 og 504 håndteres av apiforbindelse.les, andre http-feil 
+        gir ValueError (samme som anrope). Kallet telles i self.anropstelling, og self.sistebytes 
+        oppdateres etter hvert som strømmen leses. 
+        """
+        if not 'http' in path: 
+            url = ''.join(( self.apiurl, path)) 
+        else: 
+            url = path 
+
+        self.anropstelling['anrop'] += 1
+        self.anropstelling['forsok'] += 1
+        r = self.forbindelse.les( url, params=parametre, headers=self.headers, stream=True )
+        self.sisteanrop = r.url
+        self.sistebytes = 0
+
+        if r.status_code != requests.codes.ok: 
+            try: 
+                self.sistebytes = len( r.content )
+                self._httpfeil( r )
+            finally: 
+                r.close()
+
+        self._stromrespons = r
+        return jsonstrom.jsonside( self._tellbytes( r.iter_content( chunk_size=65536 ) ) )
+
+    def _tellbytes(self, biter): 
+        """Sender bitene videre, og teller antall bytes i self.sistebytes"""
+        for bit in biter: 
+            self.sistebytes += len( bit )
+            yield bit 
+
+    def _stromlukk(self): 
+        """Lukker evt åpen http-strøm"""
+        respons = getattr( self, '_stromrespons', None )
+        if respons is not None: 
+            respons.close()
+        self._stromrespons = None
+        self._stromside = None
+
+    def adaptiv_antall(self, paa=True, maalsekunder=5, maksbytes=20000000, minantall=50, maksantall=1000): 
+        """
+        Slår på (eller av) automatisk tilpasning av hvor mange objekter vi henter per side. 
+
+        Vi måler tid og antall bytes for hver side, og justerer paginering['antall'] for neste side 
+        slik at hver side tar omtrent maalsekunder og ikke blir større enn maksbytes. Punktobjekter 
+        med få egenskaper får da store sider, mens flater med mye geometri får mindre sider. Ved 
+        timeout (http 504) halverer vi antallet før vi prøver på ny. 
+
+        ARGUMENTS
+            None
+
+        KEYWORDS
+            paa=True | False : Slå tilpasningen på eller av 
+
+            maalsekunder=5 : Hvor lang tid vi ønsker at hvert kall mot NVDB api skal ta 
+
+            maksbytes=20000000 : Maksimal størrelse på respons (bytes) 
+
+            minantall=50, maksantall=1000 : Grenser for antall objekter per side 
+
+        RETURNS
+            None
+        """
+        if minantall < 1 or maksantall < minantall: 
+            raise ValueError( 'adaptiv_antall: Ugyldige grenser for antall per side ' + str( minantall ) + ', ' + str( maksantall )) 
+
+        self.paginering['adaptiv'] = bool( paa )
+        self._adaptivmaal = {   'sekunder'  : maalsekunder, 
+                                'bytes'     : maksbytes, 
+                                'min'       : minantall, 
+                                'maks'      : maksantall }
+        self.paginering['antall'] = min( max( self.paginering['antall'], minantall ), maksantall )
+
+    def _anrope_side(self, path, parametre=None): 
+        """Henter en side med data, og tilpasser antall objekter per side etterpå hvis adaptiv_antall er slått på"""
+        if not self.paginering['adaptiv']: 
+            return self.anrope( path, parametre=parametre )
+
+        path, parametre = _settantall( path, parametre, self.paginering['antall'] )
+        t0 = perf_counter()
+        data = self.anrope( path, parametre=parametre )
+        self._tilpassantall( perf_counter() - t0, self.sistebytes, data['metadata']['returnert'] )
+        return data
+
+    def _anrope_bytes(self, path, parametre=None): 
+        """Henter en side fra NVDB api som rå bytes (uten å oversette JSON), brukes av iter_records( prosesser=N )"""
+        if not 'http' in path: 
+            url = ''.join(( self.apiurl, path)) 
+        else: 
+            url = path 
+
+        self.anropstelling['anrop'] += 1
+        self.anropstelling['forsok'] += 1
+        r = self.forbindelse.les( url, params=parametre, headers=self.headers )
+        self.sisteanrop = r.url
+        self.sistebytes = len( r.content )
+        if r.status_code != requests.codes.ok: 
+            raise ValueError('Http error: '+str(r.status_code) +' '+r.url + '\n' + r.text )
+
+        return r.content 
+
+    def _tilpassantall(self, sekunder, antallbytes, returnert): 
+        """Regner ut nytt antall objekter per side ut fra tid og datamengde for forrige side"""
+        if returnert == 0: 
+            return 
+
+        maal = self._adaptivmaal 
+        forslag = maal['sekunder'] * returnert / max( sekunder, 0.001 )
+        if antallbytes: 
+            forslag = min( forslag, maal['bytes'] * returnert / antallbytes )
+
+        # Demper endringene, maks dobling per side 
+        gammel = self.paginering['antall']
+        ny = min( ( gammel + forslag ) / 2, 2 * gammel )
+        self.paginering['antall'] = int( min( max( ny, maal['min'] ), maal['maks'] ))
+
+        if self.debug: 
+            print( 'debug adaptiv_antall:', returnert, 'objekter', round( sekunder, 2 ), 'sekunder', 
+                    antallbytes, 'bytes, neste side:', self.paginering['antall'] )
+
+    def prefetch(self, dybde=2): 
+        """Slår på (eller av) henting av neste side(r) i bakgrunnen mens du jobber med data fra denne siden. 
+
+        Med prefetch påslått henter en egen tråd side N+1, N+2 ... fra NVDB api mens du itererer 
+        over side N med nesteForekomst, nestePaginering, to_records etc. Nettverkstid og 
+        databehandling overlapper da i stedet for å legges sammen. Maks antall sider som ligger 
+        ferdig nedlastet i minnet er begrenset av dybde. 
+
+        Eksempel
+            f = nvdbFagdata( 105 ) 
+            f.prefetch( 2 ) 
+            data = f.to_records()
+
+        ARGUMENTS
+            None 
+
+        KEYWORDS
+            dybde=2 : Hvor mange sider vi kan hente på forskudd. 0 slår av bakgrunnshenting 
+
+        RETURNS
+            None 
+        """
+        dybde = int( dybde )
+        if dybde < 0: 
+            raise ValueError( 'prefetch: dybde må være 0 eller positivt heltall' )
+
+        self._prefetch_stopp()
+        self.paginering['prefetch'] = dybde
+
+    def _forsteanrop(self): 
+        """Returnerer path og parametre for første side i pagineringen"""
+        if isinstance( self, nvdbFagdata): 
+            path = '/'.join(('vegobjekter', str(self.objektTypeId) ))
+            parametre = merge_dicts(  self.filterdata, self.respons, { 'antall' : self.paginering['antall'] } )
+        else: 
+            path = 'vegnett/veglenkesekvenser/segmentert'
+            parametre = merge_dicts( self.filterdata, { 'antall' : self.paginering['antall'] } )
+
+        return path, parametre
+
+    def _hentside(self): 
+        """Henter neste side fra NVDB api, enten direkte eller fra køen med sider hentet i bakgrunnen"""
+
+        # Forrige side er ferdig behandlet når vi ber om neste, og det er da trygt å lagre hvor vi er
+        if self.checkpointfil and not self.paginering['initielt']:
+            self._skrivcheckpoint( self.data['metadata']['neste']['href'] )
+
+        if self.paginering['prefetch'] > 0:
+            data = self._prefetch_neste()
+
+        elif self.paginering['initielt']:
+            path, parametre = self._forsteanrop()
+            data = self._anrope_side( path, parametre=parametre )
+
+        else:
+            data = self._anrope_side( self.data['metadata']['neste']['href'] )
+
+        if self.checkpointfil and data['metadata']['returnert'] == 0:
+            self._skrivcheckpoint( None, ferdig=True )
+
+        # Metadata har totalt antall treff, da trenger vi ikke eget kall mot statistikk
+        if isinstance( self, nvdbFagdata) and self.antall is None: 
+            self.antall = data['metadata'].get( 'antall' )
+
+        return data
+
+    def checkpoint(self, filnavn):
+        """
+        Lagrer pagineringstilstanden til fil hver gang en side er ferdig behandlet, slik at en lang
+        nedlasting kan fortsette der den stoppet (se resume).
+
+        Sjekkpunktet peker alltid på den første siden som ikke er ferdig behandlet. Sider som er
+        ferdig behandlet blir ikke lastet ned (eller behandlet) på ny etter resume.
+
+        ARGUMENTS
+            filnavn - tekst, navn på sjekkpunkt-fila (JSON). None slår av sjekkpunkt
+
+        KEYWORDS
+            None
+
+        RETURNS
+            None
+        """
+        self.checkpointfil = filnavn
+
+    def resume(self, checkpoint):
+        """
+        Fortsetter en nedlasting fra sjekkpunkt skrevet av et søkeobjekt med checkpoint(filnavn) påslått.
+
+        Filtre og responsparametre hentes fra sjekkpunktet, og pagineringen starter på den første
+        siden som ikke var ferdig behandlet. Videre sjekkpunkt skrives til samme fil. Merk at
+        to_records() og lignende funksjoner kun gir deg de objektene som ikke var ferdig behandlet.
+
+        Eksempel
+            f = nvdbFagdata( 105 )
+            f.resume( 'fartsgrense_sjekkpunkt.json' )
+            for fart in f:
+                ...
+
+        ARGUMENTS
+            checkpoint - tekst (filnavn) eller dictionary med sjekkpunkt-data
+
+        KEYWORDS
+            None
+
+        RETURNS
+            None
+        """
+        if isinstance( checkpoint, dict ):
+            sjekkpunkt = checkpoint
+        else:
+            with open( checkpoint, encoding='utf-8' ) as f:
+                sjekkpunkt = json.load( f )
+            self.checkpointfil = checkpoint
+
+        objektTypeId = getattr( self, 'objektTypeId', None )
+        if sjekkpunkt.get( 'objektTypeId' ) != objektTypeId:
+            raise ValueError( 'Sjekkpunktet gjelder objekttype ' + str( sjekkpunkt.get( 'objektTypeId' )) +
+                            ', søkeobjektet har objekttype ' + str( objektTypeId ))
+
+        self.refresh()
+        self.filterdata = sjekkpunkt['filter']
+        self.respons    = sjekkpunkt['respons']
+        self.paginering['antall'] = sjekkpunkt['paginering']['antall']
+
+        if sjekkpunkt['ferdig']:
+            self.paginering['meredata'] = False
+            self.paginering['initielt'] = False
+        elif sjekkpunkt['neste']:
+            self.paginering['initielt'] = False
+            self.data = { 'objekter' : [], 'metadata' : { 'neste' : { 'href' : sjekkpunkt['neste'] }}}
+
+    def _skrivcheckpoint(self, neste, ferdig=False):
+        """Skriver sjekkpunkt til fil. Skriver først til temporær fil så vi aldri etterlater halvskrevne sjekkpunkt"""
+        sjekkpunkt = {  'objektTypeId'  : getattr( self, 'objektTypeId', None ),
+                        'filter'        : self.filterdata,
+                        'respons'       : self.respons,
+                        'paginering'    : self.paginering,
+                        'neste'         : neste,
+                        'ferdig'        : ferdig,
+                        'tidspunkt'     : datetime.now().isoformat()
+                    }
+
+        tmpfil = self.checkpointfil + '.tmp'
+        with open( tmpfil, 'w', encoding='utf-8' ) as f:
+            json.dump( sjekkpunkt, f, indent=4, ensure_ascii=False )
+        os.replace( tmpfil, self.checkpointfil )
+
+    def _prefetch_neste(self): 
+        """Henter neste side fra prefetch-køen, starter bakgrunnstråden ved behov"""
+        if not self._prefetchtraad: 
+            if self.paginering['initielt']: 
+                path, parametre = self._forsteanrop()
+            else: 
+                path, parametre = self.data['metadata']['neste']['href'], None
+            self._prefetch_start( path, parametre )
+
+        data, tilstand = self._prefetchko.get()
+        self._prefetch_oppdater( tilstand )
+        if isinstance( data, Exception ): 
+            self._prefetch_stopp()
+            raise data 
+
+        if data['metadata']['returnert'] == 0: 
+            self._prefetch_stopp()
+
+        return data 
+
+    def _prefetch_start(self, path, parametre): 
+        """Starter bakgrunnstråd som henter sider og legger dem i en begrenset kø"""
+        self._prefetchko    = queue.Queue( maxsize=self.paginering['prefetch'] )
+        self._prefetchstopp = threading.Event()
+
+        # Bakgrunnstråden jobber på en egen kopi av søkeobjektet, med egne tellere og egen paginering. 
+        # Endringene sendes sammen med hver side, og legges inn her av _prefetch_oppdater
+        arbeider = copy.copy( self )
+        arbeider.paginering    = dict( self.paginering )
+        arbeider.anropstelling = dict.fromkeys( self.anropstelling, 0 )
+
+        self._prefetchtraad = threading.Thread( target=arbeider._prefetch_arbeider, 
+                                    args=( path, parametre, self._prefetchko, self._prefetchstopp ), 
+                                    daemon=True )
+        self._prefetchtraad.start()
+
+    def _prefetch_arbeider(self, path, parametre, ko, stopp): 
+        """
+        Kjøres i bakgrunnstråden, på kopien av søkeobjektet. Følger neste.href til vi får en tom side, 
+        feil eller beskjed om å stoppe. Legger ( side eller feil, tilstand ) i køen
+        """
+        try: 
+            while not stopp.is_set(): 
+                data = self._anrope_side( path, parametre=parametre )
+                if not _prefetch_leggtil( ko, stopp, ( data, self._prefetch_tilstand() ) ): 
+                    return 
+                if data['metadata']['returnert'] == 0: 
+                    return 
+                path, parametre = data['metadata']['neste']['href'], None
+
+        except Exception as err: 
+            _prefetch_leggtil( ko, stopp, ( err, self._prefetch_tilstand() ) )
+
+    def _prefetch_tilstand(self): 
+        """Kjøres i bakgrunnstråden: Anrop og antall per side siden forrige side, nullstiller tellerne"""
+        tilstand = {    'anropstelling' : dict( self.anropstelling ), 
+                        'sisteanrop'    : getattr( self, 'sisteanrop', None ), 
+                        'sistebytes'    : getattr( self, 'sistebytes', None ), 
+                        'antall'        : self.paginering['antall'] }
+        for nokkel in self.anropstelling: 
+            self.anropstelling[nokkel] = 0
+        return tilstand 
+
+    def _prefetch_oppdater(self, tilstand): 
+        """Legger tellere og antall per side fra bakgrunnstråden inn i søkeobjektet"""
+        for nokkel, verdi in tilstand['anropstelling'].items(): 
+            self.anropstelling[nokkel] = self.anropstelling.get( nokkel, 0 ) + verdi 
+        self.sisteanrop = tilstand['sisteanrop']
+        self.sistebytes = tilstand['sistebytes']
+        self.paginering['antall'] = tilstand['antall']
+
+    def _prefetch_stopp(self, ventetid=30): 
+        """
+        Ber bakgrunnstråden avslutte, venter på at den blir ferdig (maks ventetid sekunder, f.eks. 
+        hvis den står midt i et anrop) og glemmer sider som ikke er brukt ennå
+        """
+        if self._prefetchstopp: 
+            self._prefetchstopp.set()
+        if self._prefetchtraad and self._prefetchtraad is not threading.current_thread(): 
+            self._prefetchtraad.join( timeout=ventetid )
+        self._prefetchtraad = None
+        self._prefetchko    = None
+        self._prefetchstopp = None
+
         
     def addfilter_geo(self, *args):
         """
@@ -317,39 +737,61 @@ class nvdbVegnett:
     
 
     def anrope(self, path, parametre=None, debug=False, silent=False, logganrop=False, iterasjontelling = 0): 
+        """
+        Henter data fra NVDB api og returnerer JSON-responsen (oversatt til python-objekter)
+
+        Ugyldig JSON i responsen og (med adaptiv_antall) timeout på sider med data prøves på ny 
+        i en løkke etter reglene i self.forbindelse.retry. Nettverksfeil og http 429, 502, 503 
+        og 504 håndteres av apiforbindelse.les. Alle forsøk telles i self.anropstelling. 
+
+        Gir ValueError hvis vi må gi opp. 
+        """
     
         logganrop = False # Logger alle anrop til fil
-        maks_iterasjoner = 5
+
+        # Felles regler for å prøve på ny, se apiforbindelse.retrypolicy
+        retry = self.forbindelse.retry
+        self.anropstelling['anrop'] += 1
     
-        # if not self.apiurl in path: 
-        if not 'http' in path: 
-            url = ''.join(( self.apiurl, path)) 
-        else: 
-            url = path 
+        while True: 
+
+            # if not self.apiurl in path: 
+            if not 'http' in path: 
+                url = ''.join(( self.apiurl, path)) 
+            else: 
+                url = path 
+
+            # Med adaptiv_antall håndterer vi selv timeout på sider med data, slik at vi kan 
+            # prøve på ny med færre objekter per side 
+            adaptivside = self.paginering['adaptiv'] and ( ( parametre and 'antall' in parametre ) or 'antall=' in path )
+            if adaptivside: 
+                lesretry = retry.uten( 504 )
+            else: 
+                lesretry = retry 
+
+            # r = requests.get(url, params=parametre, headers=self.headers)
+            iterasjontelling += 1
+            self.anropstelling['forsok'] += 1
+            r = self.forbindelse.les( url, params=parametre, headers=self.headers, retry=lesretry )
+            
+            self.sisteanrop = r.url
+            self.sistebytes = len( r.content )
+            
+            if debug:
+                print( r.url[33:]) # DEBUG
+            
+            if r.status_code == requests.codes.ok:
+                try: 
+                    data = r.json()
+                except JSONDecodeError as err: 
+                    self.anropstelling['jsonfeil'] += 1
+                    if retry.skalprove( iterasjontelling ): 
+                        retry.vent( iterasjontelling, melding='Fikk feilmelding på JSON-dekoding av respons, hikke fra NVDB api?' )
+                        continue 
 
-        # r = requests.get(url, params=parametre, headers=self.headers)
-        r = self.forbindelse.les( url, params=parametre, headers=self.headers )
-        
-        self.sisteanrop = r.url
-        
-        if debug:
-            print( r.url[33:]) # DEBUG
-        
-        if r.status_code == requests.codes.ok:
-            data = None 
-            try: 
-                data = r.json()
-            except JSONDecodeError as err: 
-                if iterasjontelling < maks_iterasjoner: 
-                    print( 'Fikk feilmelding på JSON-dekoding av respons, hikke fra NVDB api? Prøver på ny en håndfull ganger med litt pause')
-                    sleep( 15 )
-                    iterasjontelling += 1
-                    self.anrope( path, parametre=parametre, debug=debug, silent=silent, logganrop=logganrop, iterasjontelling=iterasjontelling )
-                else: 
                     print( 'Beklager, må gi opp å parse data hentet med url', r.url)
                     print( err )
                     raise ValueError("Klarte ikke oversette respons fra NVDB api til JSON for kall " + r.url ) 
-            else: 
 
                 if debug and 'metadata' in data.keys(): 
                     print( '\n',  data['metadata'], '\n' ) 
@@ -371,18 +813,25 @@ class nvdbVegnett:
                         f.write( json.dumps( data, indent=4, ensure_ascii=False) )
                         f.write( '\n' )  
 
-            # Normalsituasjon, returnerer JSON-data    
-            return data 
+                # Normalsituasjon, returnerer JSON-data    
+                return data 
 
-        elif r.status_code in [ 503, 504 ] and iterasjontelling < maks_iterasjoner: # Gateway timeout
-            iterasjontelling += 1
-            print( 'Http error, prøver om igjen', str( iterasjontelling), 'av', str( maks_iterasjoner), 'ganger om bittelita stund: '+str(r.status_code) +' '+r.url +
-                            '\n' + r.text )
-            sleep( 15 )
-            data = self.anrope( path, parametre=parametre, debug=debug, silent=silent, logganrop=logganrop, iterasjontelling=iterasjontelling )
-            return data 
+            elif r.status_code == 504 and adaptivside and retry.skalprove( iterasjontelling, 504 ): # Gateway timeout
+                self.anropstelling['timeout'] += 1
 
-        elif r.status_code == 401: 
+                # Timeout på en side med data, prøver på ny med færre objekter per side
+                self.paginering['antall'] = max( self._adaptivmaal['min'], self.paginering['antall'] // 2 )
+                path, parametre = _settantall( path, parametre, self.paginering['antall'] )
+
+                retry.vent( iterasjontelling, respons=r, melding='Http error ' + str(r.status_code) + ' ' + r.url + 
+                                ', prøver med ' + str( self.paginering['antall'] ) + ' objekter per side' )
+
+            else:
+                self._httpfeil( r, silent=silent )
+
+    def _httpfeil(self, r, silent=False): 
+        """Gir ValueError for http-respons med feilkode, felles for anrope og _anrope_strom"""
+        if r.status_code == 401: 
             raise ValueError( 'Ugyldig pålogging', str(r.status_code) + ' ' + r.url + '\n' + r.text ) 
 
         elif r.status_code == 403: 
@@ -397,6 +846,8 @@ class nvdbVegnett:
                             
     def refresh(self):
         """Deletes all data, resets pagination to 0"""
+        self._prefetch_stopp()
+        self._stromlukk()
         self.paginering['hvilken'] = 0
         self.paginering['initielt'] = True
         self.paginering['meredata'] = True
@@ -509,7 +960,7 @@ class nvdbVegnett:
         print( 'Pagineringsinfo: Antall objekt i databuffer=', len( self.data['objekter']))
         print( json.dumps( self.paginering, indent = 4)) 
                 
-    def to_records(self): 
+    def to_records(self, prosesser=None, geometriformat='wkt'): 
         """
         Eksporterer søk for vegnett til liste med NVDB api V3 segmentert vegnett, littegrann forflatet
 
@@ -519,20 +970,152 @@ class nvdbVegnett:
         ARGUMENTS
             None
         KEYWORDS 
-            None 
+            prosesser=None | heltall : Flat ut sidene parallelt i så mange prosesser, se iter_records 
+
+            geometriformat='wkt' | 'wkb' : Geometri som tekst (WKT) eller binær (WKB), se iter_records 
         Returns
             Liste med segmentert vegnett fra NVDB api V3, forflatet for enklere bruk 
         """
 
-        data = []
+        return list( self.iter_records( prosesser=prosesser, geometriformat=geometriformat ) )
+
+    def iter_records(self, batch=None, prosesser=None, geometriformat='wkt'): 
+        """
+        Generator som gir de samme radene som to_records(), men én og én (evt i bunker) etter hvert 
+        som sidene lastes ned fra NVDB api. Vi holder aldri hele resultatsettet i minnet. 
+
+        KEYWORDS 
+            batch=None | heltall : Gi lister med (inntil) så mange rader i stedet for én og én rad 
+
+            prosesser=None | heltall : Flat ut sidene parallelt i så mange prosesser, mens vi laster ned 
+                        neste side. Radene kommer i samme rekkefølge som ellers. Se _prosessrader 
+
+            geometriformat='wkt' | 'wkb' : 'wkb' gir geometri som well known binary (bytes) i stedet for 
+                        tekst. Tar mindre plass, og kan gjøres om til shapely i ett kall med 
+                        geometri.tilgeometri. Med prosesser gjøres konverteringen i arbeiderprosessene 
+
+        RETURNS
+            generator med dictionaries (evt lister med dictionaries), samme struktur som to_records()
+        """
+        _sjekkgeometriformat( geometriformat )
+        if prosesser: 
+            yield from _bunker( _prosessrader( self, prosesser, geometriformat=geometriformat ), batch )
+            return 
+
+        bunke = []
         v1 = self.nesteForekomst()
         while v1: 
 
             v1 = flatutvegnettsegment( v1 )
-            data.append( v1 )
+            if geometriformat != 'wkt': 
+                _geometriformat( [ v1 ], geometriformat )
+            if batch: 
+                bunke.append( v1 )
+                if len( bunke ) >= batch: 
+                    yield bunke 
+                    bunke = []
+            else: 
+                yield v1 
             v1 = self.nesteForekomst()
 
-        return data
+        if bunke: 
+            yield bunke 
+
+    def to_columns(self, geometriformat='wkt'): 
+        """
+        Som to_records(), men data lagres kolonnevis, dvs dictionary { kolonnenavn : [ verdier ] }
+
+        Bruker langt mindre minne enn liste med dictionaries, og kan gjøres om til pandas 
+        uten mellomledd: pd.DataFrame( sok.to_columns() ) 
+
+        KEYWORDS
+            geometriformat='wkt' | 'wkb' : Se iter_records 
+
+        RETURNS
+            dictionary { kolonnenavn : [ verdier ] }, alle listene er like lange 
+        """
+        bygger = kolonner.kolonnebygger( )
+        for v1 in self.iter_records( geometriformat=geometriformat ): 
+            bygger.leggtil( v1 )
+
+        return bygger.kolonner 
+
+    def to_arrow(self, **kwargs): 
+        """
+        Som to_columns(), men returnerer pyarrow.Table med faste datatyper (heltall, flyttall, 
+        dictionary-kodet tekst for enum-verdier, datoer). Krever pyarrow. 
+
+        Eksempel
+            tabell = sok.to_arrow()
+            df = tabell.to_pandas() 
+
+        KEYWORDS
+            Sendes videre til to_columns() 
+
+        RETURNS
+            pyarrow.Table
+        """
+        return kolonner.til_arrow( self.to_columns( **kwargs ), kolonner.kolonnetyper( ) )
+
+    def to_geoparquet(self, filnavn, partisjon=None, komprimering='zstd', radgruppe=50000, prosesser=None): 
+        """
+        Skriver vegnettet til GeoParquet-fil, én radgruppe av gangen etter hvert som sidene lastes ned. 
+        Geometrien lagres som WKB, kolonnene får faste datatyper. Krever pyarrow. Se modulen geoparquet 
+
+        Eksempel
+            v = nvdbVegnett()
+            v.to_geoparquet( 'vegnett', partisjon='fylke' )
+
+        ARGUMENTS
+            filnavn - Parquet-fil, evt katalog hvis vi partisjonerer 
+
+        KEYWORDS
+            partisjon=None | kolonnenavn : Én fil per verdi i kolonnen, f.eks. 'fylke' eller 'kommune', i 
+                        katalogstruktur <filnavn>/fylke=30/del-0.parquet (hive-partisjonering) 
+
+            komprimering='zstd' : Komprimering i Parquet-filen, f.eks. 'snappy', 'gzip' eller None 
+
+            radgruppe=50000 : Antall rader per radgruppe (row group) 
+
+            prosesser=None | heltall : Flat ut sidene parallelt i så mange prosesser, se iter_records 
+
+        RETURNS
+            antall rader skrevet 
+        """
+        rader = self.iter_records( prosesser=prosesser, geometriformat='wkb' )
+        typer = { navn : hva for navn, hva in kolonner.kolonnetyper( ).items() if navn in kolonner.VEGNETTKOLONNER }
+        return geoparquet.skrivgeoparquet( rader, filnavn, typer=typer, kolonnenavn=kolonner.VEGNETTKOLONNER, 
+                                            partisjon=partisjon, komprimering=komprimering, radgruppe=radgruppe )
+
+    def to_kompakt(self): 
+        """
+        Henter alle data for søket som kompakte objekter med langt mindre minnebruk enn dictionaries 
+
+        Vegnett gir liste med kompaktvegsegment, fagdata (nvdbFagdata) gir liste med kompaktvegobjekt. 
+        De mest brukte verdiene (id, versjon, type, veglenkesekvensid, startposisjon, sluttposisjon, 
+        kommune, fylke, vref) er attributter, resten av JSON-strukturen oversettes først ved behov. 
+        Se modulen kompakt 
+
+        Eksempel
+            v = nvdbVegnett()
+            segmenter = v.to_kompakt()
+            print( segmenter[0].vref, segmenter[0]['geometri']['wkt'] ) 
+
+        RETURNS
+            Liste med kompaktvegsegment eller kompaktvegobjekt. Metoden json() gir opprinnelig dictionary 
+        """
+        if isinstance( self, nvdbFagdata ): 
+            klasse = kompakt.kompaktvegobjekt
+        else: 
+            klasse = kompakt.kompaktvegsegment
+
+        data = []
+        v1 = self.nesteForekomst()
+        while v1: 
+            data.append( klasse( v1 ))
+            v1 = self.nesteForekomst()
+
+        return data 
 
     def vegrefrutesok(self, vref1, vref2, **kwargs ): 
         """
@@ -602,11 +1185,15 @@ class nvdbFagdata(nvdbVegnett):
         print bomst['id']  # Gjør noe spennende
         bomst = n.nesteForekomst()
 
+    # EKSEMPEL: lazy=True gir ingen kall mot NVDB api før vi trenger data. Typedefinisjonen 
+    # hentes ved første bruk, og vi hopper over kallet mot statistikk før første side
+    sokeobjekter = [ nvdbFagdata( typeid, lazy=True ) for typeid in [ 45, 105, 581 ] ]
+
     """
     
     
     
-    def __init__( self, objTypeID, miljo=None, debug=False):
+    def __init__( self, objTypeID, miljo=None, debug=False, lazy=False):
 
 
         self.headers =   { 'accept' : 'application/vnd.vegvesen.nvdb-v3-rev1+json', 
@@ -622,14 +1209,25 @@ class nvdbFagdata(nvdbVegnett):
                                                     # 
                             'meredata'      : True, # Gjetning på om vi kan hente mere data
                             'initielt'      : True, # Initiell ladning av datasett
-                            'dummy'         : False # For jukse-bruk av søkeobjektet
+                            'dummy'         : False, # For jukse-bruk av søkeobjektet
+                            'prefetch'      : 0,    # Antall sider vi henter i bakgrunnen, 0 = av
+                            'strom'         : False, # Les objektene ett og ett fra http-strømmen
+                            'adaptiv'       : False # Tilpass antall per side etter responstid og datamengde
                 } 
+        self._prefetchtraad = None
+        self._prefetchko    = None
+        self._prefetchstopp = None
+        self.checkpointfil  = None
+        self._stromside     = None
+        self._adaptivmaal   = None
+        self.anropstelling  = { 'anrop' : 0, 'forsok' : 0, 'jsonfeil' : 0, 'timeout' : 0 }
     
         self.data = { 'objekter' : []}
         self.apiurl = 'https://www.vegvesen.no/nvdb/api/v3/'
 
         self.objektTypeId = None
-        self.objektTypeDef = None
+        self._objektTypeDef = None
+        self.lazy = lazy
         self.antall = None
         self.strekningslengde = None
         self.filterdata = {}
@@ -655,10 +1253,22 @@ class nvdbFagdata(nvdbVegnett):
         # Refresh er lurt, (arver tilstand fra andre instanser). 
         self.refresh()
 
-        # Leser typedefinisjon fra NVDB api
-        self.objektTypeDef = self.anrope( '/'.join(( 'vegobjekttyper', 
-                                            str(objTypeID))) )
+        # Leser typedefinisjon fra felles datakatalog (henter fra NVDB api ved behov). 
+        # Med lazy=True venter vi til noen spør etter self.objektTypeDef
         self.objektTypeId = objTypeID 
+        if not lazy: 
+            self._objektTypeDef = datakatalog.vegobjekttype( objTypeID, self.apiurl, self.anrope )
+
+    @property
+    def objektTypeDef(self): 
+        """Definisjon av objekttypen fra datakatalogen, hentes ved første bruk hvis søkeobjektet er laget med lazy=True"""
+        if self._objektTypeDef is None and self.objektTypeId: 
+            self._objektTypeDef = datakatalog.vegobjekttype( self.objektTypeId, self.apiurl, self.anrope )
+        return self._objektTypeDef
+
+    @objektTypeDef.setter
+    def objektTypeDef(self, verdi): 
+        self._objektTypeDef = verdi 
 
     def statistikk(self): 
         if self.objektTypeId: 
@@ -706,11 +1316,8 @@ class nvdbFagdata(nvdbVegnett):
         f.eks. CSV-dump eller tilsvarende 
         """ 
         
-        data = {}
-        for eg in self.objektTypeDef['egenskapstyper']:
-                data[eg['navn']] = missing
-                
-        return data
+        # Samme mal som egenskapskjema bruker for to_records( fastskjema=True ) 
+        return dict( egenskapskjema( self.objektTypeDef, fastskjema=True, missing=missing ).mal )
                
     def addfilter_overlapp( self, *arg): 
         """
@@ -752,7 +1359,8 @@ class nvdbFagdata(nvdbVegnett):
         else: 
             return None
         
-    def to_records(self, vegsegmenter=True, relasjoner=True, geometri=False, debug=False, tidspunkt=None ): 
+    def to_records(self, vegsegmenter=True, relasjoner=True, geometri=False, debug=False, tidspunkt=None, fastskjema=False, prosesser=None, 
+                        geometriformat='wkt' ): 
         """
         Eksporterer til en liste med dictionaries med struktur 
         "objekttype" : INT,
@@ -792,13 +1400,56 @@ class nvdbFagdata(nvdbVegnett):
             tidspunkt=None | datostreng (tekst) på formen '2010-01-01'. DEAKTIVERT, NVDB api gir oss uansett kun de vegsegmentene
                         som er gyldige for det tidspunktet som står i API-kallet. 
 
+            fastskjema=False (default) | True : Alle rader får kolonner for alle egenskapstypene vi kan flate ut, 
+                        evt med verdien None. Se egenskapskjema 
+
+            prosesser=None | heltall : Flat ut sidene parallelt i så mange prosesser, se iter_records 
+
+            geometriformat='wkt' (default) | 'wkb' : Geometri som tekst (WKT) eller binær (WKB), se iter_records 
+
         RETURNS
             liste med dictionaries (NVDB-objekt fra NVDB api LES v3 i utflatet struktur)
 
         """
 
-        mydata = []
-        if not self.antall: 
+        return list( self.iter_records( vegsegmenter=vegsegmenter, relasjoner=relasjoner, geometri=geometri, 
+                                        debug=debug, tidspunkt=tidspunkt, fastskjema=fastskjema, prosesser=prosesser, 
+                                        geometriformat=geometriformat ) )
+
+    def iter_records(self, vegsegmenter=True, relasjoner=True, geometri=False, debug=False, tidspunkt=None, fastskjema=False, 
+                        batch=None, prosesser=None, geometriformat='wkt' ): 
+        """
+        Generator som gir de samme radene som to_records(), men én og én (evt i bunker) etter hvert som 
+        sidene lastes ned fra NVDB api. Vi holder aldri hele resultatsettet i minnet, nyttig for eksport 
+        rett til fil. 
+
+        Eksempel
+            f = nvdbFagdata( 105 )
+            for rad in f.iter_records( vegsegmenter=False ): 
+                skriv( rad ) 
+
+            for bunke in f.iter_records( batch=5000 ): 
+                skrivmange( bunke ) 
+
+        KEYWORDS 
+            vegsegmenter, relasjoner, geometri, debug, tidspunkt, fastskjema : Som for to_records() 
+
+            batch=None | heltall : Gi lister med (inntil) så mange rader i stedet for én og én rad 
+
+            prosesser=None | heltall : Flat ut sidene parallelt i så mange prosesser, mens vi laster ned 
+                        neste side. Radene kommer i samme rekkefølge som ellers. Lønner seg for store uttak, 
+                        der utflatingen (ikke nedlastingen) er flaskehalsen. Se _prosessrader 
+
+            geometriformat='wkt' | 'wkb' : 'wkb' gir geometri som well known binary (bytes) i stedet for 
+                        tekst. Tar mindre plass, og kan gjøres om til shapely i ett kall med 
+                        geometri.tilgeometri. Med prosesser gjøres konverteringen i arbeiderprosessene 
+
+        RETURNS
+            generator med dictionaries (evt lister med dictionaries), samme struktur som to_records()
+        """
+        _sjekkgeometriformat( geometriformat )
+
+        if not self.antall and not self.lazy: 
             self.statistikk()
 
         if self.antall and self.antall > 10000: 
@@ -809,9 +1460,18 @@ class nvdbFagdata(nvdbVegnett):
             if 'tidspunkt' in self.filterdata.keys():
                 tidspunkt = self.filterdata['tidspunkt']
 
+        if prosesser: 
+            rader = _prosessrader( self, prosesser, vegsegmenter=vegsegmenter, relasjoner=relasjoner, geometri=geometri, 
+                                        debug=debug, tidspunkt=tidspunkt, fastskjema=fastskjema, geometriformat=geometriformat )
+            yield from _bunker( rader, batch )
+            return 
+
+        # Avgjør én gang per egenskapstype hvordan egenskapverdiene skal flates ut
+        skjema = egenskapskjema( self.objektTypeDef, geometri=geometri, fastskjema=fastskjema )
+
         count = 0
+        bunke = []
         nvdbid_manglergeom = []
-        terskler = [ 1000, 10000]
         feat = self.nesteForekomst()
         while feat:
             count += 1
@@ -822,16 +1482,18 @@ class nvdbFagdata(nvdbVegnett):
             # https://github.com/LtGlahn/diskusjon_diverse/tree/master/debug_nvdbapilesv3/vegobjekter 
             if 'geometri' in feat.keys():
 
-                featureliste = nvdbfagdata2records( feat, vegsegmenter=vegsegmenter, relasjoner=relasjoner, geometri=geometri, debug=debug, tidspunkt=tidspunkt )
+                featureliste = nvdbfagdata2records( feat, vegsegmenter=vegsegmenter, relasjoner=relasjoner, geometri=geometri, 
+                                                        debug=debug, tidspunkt=tidspunkt, skjema=skjema )
+                if geometriformat != 'wkt': 
+                    _geometriformat( featureliste, geometriformat )
 
-
-                    # tmp = deepcopy( featureliste )
-                    # featureliste = []
-                    # for enfeature in tmp: 
-                    #     enfeature['relasjoner'] = feat['relasjoner']
-
-            
-                mydata.extend( featureliste )
+                if batch: 
+                    bunke.extend( featureliste )
+                    while len( bunke ) >= batch: 
+                        yield bunke[:batch]
+                        bunke = bunke[batch:]
+                else: 
+                    yield from featureliste 
             else: 
                 nvdbid_manglergeom.append( feat['id'])
 
@@ -845,7 +1507,269 @@ class nvdbFagdata(nvdbVegnett):
             if debug: 
                 print( nvdbid_manglergeom )
 
-        return mydata
+        if bunke: 
+            yield bunke 
+
+    def to_columns(self, vegsegmenter=True, relasjoner=True, geometri=False, debug=False, tidspunkt=None, geometriformat='wkt' ): 
+        """
+        Som to_records(), men data lagres kolonnevis, dvs dictionary { kolonnenavn : [ verdier ] }
+
+        Radene flates ut ett objekt av gangen og legges rett inn i kolonnene, vi har aldri hele 
+        resultatsettet som liste med dictionaries. Alle egenskapstypene fra datakatalogen får en kolonne 
+        (fast skjema, se egenskapskjema). Kan gjøres om til pandas uten mellomledd: 
+            df = pd.DataFrame( sok.to_columns() ) 
+
+        KEYWORDS
+            vegsegmenter, relasjoner, geometri, debug, tidspunkt, geometriformat : Som for to_records() 
+
+        RETURNS
+            dictionary { kolonnenavn : [ verdier ] }, alle listene er like lange 
+        """
+        bygger = kolonner.kolonnebygger( )
+        for rad in self.iter_records( vegsegmenter=vegsegmenter, relasjoner=relasjoner, geometri=geometri, 
+                                        debug=debug, tidspunkt=tidspunkt, fastskjema=True, geometriformat=geometriformat ): 
+            bygger.leggtil( rad )
+
+        return bygger.kolonner 
+
+    def to_arrow(self, **kwargs): 
+        """
+        Som to_columns(), men returnerer pyarrow.Table med datatyper fra datakatalogen: Tall som 
+        int64/float64, enum-verdier som dictionary-kodet tekst, datoer som date32 og posisjoner 
+        langs veglenkesekvens som float64. Relasjoner og andre nøstede elementer lagres som JSON-tekst. 
+        Krever pyarrow. 
+
+        Eksempel
+            f = nvdbFagdata( 105 )
+            tabell = f.to_arrow( )
+            df = tabell.to_pandas( )
+
+        KEYWORDS
+            Sendes videre til to_columns() (vegsegmenter, relasjoner, geometri, debug, tidspunkt, geometriformat) 
+
+        RETURNS
+            pyarrow.Table
+        """
+        return kolonner.til_arrow( self.to_columns( **kwargs ), kolonner.kolonnetyper( self.objektTypeDef ) )
+
+    def to_geoparquet(self, filnavn, partisjon=None, komprimering='zstd', radgruppe=50000, prosesser=None, 
+                        vegsegmenter=True, relasjoner=True, geometri=False, debug=False, tidspunkt=None ): 
+        """
+        Skriver vegobjektene til GeoParquet-fil, én radgruppe av gangen etter hvert som sidene lastes ned. 
+        Kolonnene får datatyper fra datakatalogen (alle egenskapstypene får kolonne, se egenskapskjema), 
+        geometrien lagres som WKB. Krever pyarrow. Se modulen geoparquet 
+
+        Eksempel
+            f = nvdbFagdata( 105 )
+            f.to_geoparquet( 'fartsgrense.parquet', komprimering='snappy' )
+
+            # Flere objekttyper i samme datasett, én katalog per objekttype 
+            for objtype in [ 105, 540 ]: 
+                nvdbFagdata( objtype ).to_geoparquet( 'nvdbdata', partisjon='objekttype', vegsegmenter=False ) 
+
+        ARGUMENTS
+            filnavn - Parquet-fil, evt katalog hvis vi partisjonerer 
+
+        KEYWORDS
+            partisjon=None | kolonnenavn : Én fil per verdi i kolonnen, f.eks. 'fylke' eller 'objekttype', i 
+                        katalogstruktur <filnavn>/fylke=30/del-0.parquet (hive-partisjonering) 
+
+            komprimering='zstd' : Komprimering i Parquet-filen, f.eks. 'snappy', 'gzip' eller None 
+
+            radgruppe=50000 : Antall rader per radgruppe (row group) 
+
+            prosesser=None | heltall : Flat ut sidene parallelt i så mange prosesser, se iter_records 
+
+            vegsegmenter, relasjoner, geometri, debug, tidspunkt : Som for to_records() 
+
+        RETURNS
+            antall rader skrevet 
+        """
+        rader = self.iter_records( vegsegmenter=vegsegmenter, relasjoner=relasjoner, geometri=geometri, debug=debug, 
+                                    tidspunkt=tidspunkt, fastskjema=True, prosesser=prosesser, geometriformat='wkb' )
+
+        # Alle kolonnene vi kan få, slik at f.eks. sluttdato og relasjoner kommer med i filen selv om 
+        # de ikke finnes i første radgruppe 
+        egenskaper = egenskapskjema( self.objektTypeDef, geometri=geometri, fastskjema=True ).mal 
+        kolonnenavn = kolonner.fagdatakolonner( egenskaper, vegsegmenter=vegsegmenter, relasjoner=relasjoner )
+        typer = { navn : hva for navn, hva in kolonner.kolonnetyper( self.objektTypeDef ).items() if navn in kolonnenavn }
+        return geoparquet.skrivgeoparquet( rader, filnavn, typer=typer, kolonnenavn=kolonnenavn, 
+                                            partisjon=partisjon, komprimering=komprimering, radgruppe=radgruppe )
+
+    def to_records_parallell(self, arbeidere=4, partisjon='fylke', maksantall=50000, komplett=False, **kwargs): 
+        """
+        Som to_records, men deler søket opp i geografisk adskilte delsøk som lastes ned parallelt 
+
+        Søket splittes på fylke (evt de fylkene eller kommunene som allerede står i filteret). 
+        Vi henter statistikk for hvert delsøk, og fylker med flere enn maksantall objekter 
+        deles videre opp per kommune, slik at ingen av trådene blir sittende med en kjempejobb. 
+        Delsøk uten treff hoppes over, og de største delsøkene startes først. Alle delsøk bruker 
+        samme apiforbindelse (og dermed samme http-sesjon) som dette søkeobjektet. 
+
+        Objekter som går over grensa mellom to partisjoner kommer i begge delsøkene. Vi fjerner 
+        duplikatene ut fra nvdbId, slik at hvert objekt kun kommer fra ett av delsøkene. 
+
+        Objekter som ikke har fylke/kommune i sin stedfesting (f.eks. uten vegtilknytning) kommer ikke 
+        med i noen av delsøkene. Vi sammenligner derfor antall objekter fra delsøkene med statistikk for 
+        hele søket. Mangler det objekter får du en advarsel med antallet. NVDB api har ikke noe filter for 
+        objekter uten fylke/kommune, så vi kan ikke hente bare dem som mangler. Med komplett=True henter vi 
+        derfor hele søket på nytt uten oppdeling, slik at resultatet blir det samme som fra to_records. 
+        Det koster en full seriell nedlasting i tillegg til den parallelle, selv om det bare mangler ett 
+        objekt. For objekttyper der mange objekter mangler vegtilknytning er to_records raskere. 
+
+        ARGUMENTS
+            None
+
+        KEYWORDS 
+            arbeidere=4 : Antall parallelle nedlastinger (tråder) 
+
+            partisjon='fylke' | 'kommune' : Minste enhet vi starter oppdelingen med
+
+            maksantall=50000 : Fylker med flere objekter enn dette deles opp videre per kommune 
+
+            komplett=False | True : Hent hele søket på nytt uten oppdeling (seriell nedlasting) hvis delsøkene 
+                        ikke fikk med alle objektene. Med komplett=False får du kun advarselen, og resultatet 
+                        fra delsøkene 
+
+            Øvrige nøkkelord som for to_records (vegsegmenter, relasjoner, geometri, debug, tidspunkt, 
+            fastskjema, geometriformat)
+
+        RETURNS
+            liste med dictionaries, samme struktur som to_records()
+        """
+
+        if self.checkpointfil: 
+            warn( 'to_records_parallell: checkpoint/resume støttes ikke, delsøkene lastes ned fra starten uten sjekkpunkt' )
+
+        _sjekkgeometriformat( kwargs.get( 'geometriformat', 'wkt' ) )
+        totalt = self.statistikk()['antall']
+        delsok = self._partisjoner( partisjon=partisjon, maksantall=maksantall )
+
+        objekter = []
+        if len( delsok ) > 0: 
+            print( 'Parallell nedlasting av', sum( [ d.antall for d in delsok ] ), 'objekter fordelt på', 
+                    len( delsok ), 'delsøk og', arbeidere, 'tråder' )
+
+            # Henter objektene slik de kommer fra NVDB api, slik at vi kan telle også dem som 
+            # to_records hopper over (uten geometri). Utflatingen gjøres etter at duplikatene er fjernet 
+            with ThreadPoolExecutor( max_workers=arbeidere ) as pool: 
+                resultater = list( pool.map( list, delsok ))
+            for sok in delsok: 
+                self._tellingfra( sok )
+
+            sett = set()
+            for delresultat in resultater: 
+                for feat in delresultat: 
+                    if feat['id'] not in sett: 
+                        objekter.append( feat )
+                        sett.add( feat['id'] )
+
+        if totalt and len( objekter ) < totalt: 
+            melding = 'to_records_parallell: ' + str( totalt - len( objekter ) ) + ' av ' + str( totalt ) + \
+                        ' objekter har ikke fylke/kommune og kom ikke med i delsøkene'
+            if komplett: 
+                warn( melding + ', henter hele søket uten oppdeling' )
+                self.refresh()
+                objekter = list( self )
+            else: 
+                warn( melding )
+
+        return self._flatut( objekter, **kwargs )
+
+    def _flatut(self, objekter, vegsegmenter=True, relasjoner=True, geometri=False, debug=False, tidspunkt=None, 
+                        fastskjema=False, prosesser=None, geometriformat='wkt' ): 
+        """Flater ut liste med objekter fra NVDB api, samme resultat som to_records med samme nøkkelord"""
+        if not tidspunkt and 'tidspunkt' in self.filterdata: 
+            tidspunkt = self.filterdata['tidspunkt']
+
+        skjema = egenskapskjema( self.objektTypeDef, geometri=geometri, fastskjema=fastskjema )
+        rader = nvdbfagdata2records( objekter, vegsegmenter=vegsegmenter, relasjoner=relasjoner, geometri=geometri, 
+                                        debug=debug, tidspunkt=tidspunkt, skjema=skjema )
+        return _geometriformat( rader, geometriformat )
+
+    def _klon(self, filterdata=None): 
+        """
+        Lager en kopi av søkeobjektet uten å hente typedefinisjonen fra NVDB api på ny. 
+
+        Kopien deler apiforbindelse (http-sesjon) og typedefinisjon med originalen, men har 
+        egne filtre, responsparametre og egen paginering. 
+        """
+        klon = copy.copy( self )
+        klon.filterdata = deepcopy( self.filterdata )
+        if filterdata: 
+            klon.filterdata.update( filterdata )
+        klon.respons    = deepcopy( self.respons )
+        klon.paginering = deepcopy( self.paginering )
+        klon.antall = None
+        klon.strekningslengde = None
+        klon._prefetchtraad = None
+        klon._prefetchstopp = None
+        klon._stromside     = None
+        klon._stromrespons  = None
+        klon.checkpointfil  = None   # Ellers skriver alle klonene til samme sjekkpunkt-fil 
+        klon.anropstelling  = dict.fromkeys( self.anropstelling, 0 )    # Ellers teller alle trådene i samme dictionary
+        klon.refresh()
+        return klon 
+
+    def _tellingfra(self, klon): 
+        """Legger tellerne fra en klon (se _klon) inn i søkeobjektet, og nullstiller klonens tellere"""
+        for nokkel, verdi in klon.anropstelling.items(): 
+            self.anropstelling[nokkel] = self.anropstelling.get( nokkel, 0 ) + verdi 
+            klon.anropstelling[nokkel] = 0 
+
+    def _partisjoner(self, partisjon='fylke', maksantall=50000): 
+        """
+        Deler søket inn i delsøk per fylke eller kommune, størrelsen styres av statistikk fra NVDB api. 
+
+        Returnerer liste med søkeobjekter (kloner av dette) som har treff, sortert med størst først. 
+        """
+
+        if 'kommune' in self.filterdata: 
+            partisjon = 'kommune'
+            omrader = _omradenummer( self.filterdata['kommune'] )
+        elif 'fylke' in self.filterdata and partisjon == 'fylke': 
+            omrader = _omradenummer( self.filterdata['fylke'] )
+        elif partisjon == 'fylke': 
+            omrader = [ x['nummer'] for x in self.anrope( 'omrader/fylker' ) ]
+        elif partisjon == 'kommune': 
+            kommuner = self.anrope( 'omrader/kommuner' )
+            if 'fylke' in self.filterdata: 
+                fylker = _omradenummer( self.filterdata['fylke'] )
+                kommuner = [ x for x in kommuner if x.get( 'fylke' ) in fylker ]
+            omrader = [ x['nummer'] for x in kommuner ]
+        else: 
+            raise ValueError( "Ugyldig partisjon, lovlige verdier er 'fylke' eller 'kommune': " + str( partisjon ))
+
+        kommuner = None 
+        delsok = []
+        for omrade in omrader: 
+            if partisjon == 'fylke': 
+                sok = self._klon( filterdata={ 'fylke' : omrade } )
+            else: 
+                sok = self._klon( filterdata={ 'kommune' : omrade } )
+            sok.statistikk()
+            self._tellingfra( sok )
+
+            if partisjon == 'fylke' and sok.antall and sok.antall > maksantall: 
+                if kommuner is None: 
+                    kommuner = self.anrope( 'omrader/kommuner' )
+                fylkeskommuner = [ x['nummer'] for x in kommuner if x.get( 'fylke' ) == omrade ]
+
+                if len( fylkeskommuner ) > 0: 
+                    for kommune in fylkeskommuner: 
+                        sok2 = self._klon( filterdata={ 'kommune' : kommune } )
+                        sok2.filterdata.pop( 'fylke', None )
+                        sok2.statistikk()
+                        self._tellingfra( sok2 )
+                        if sok2.antall: 
+                            delsok.append( sok2 )
+                    continue 
+
+            if sok.antall: 
+                delsok.append( sok )
+
+        delsok.sort( key=lambda x : x.antall, reverse=True )
+        return delsok 
 
 
 class nvdbFagObjekt():
@@ -883,8 +1807,19 @@ class nvdbFagObjekt():
             if not ignorewarnings: 
                 warn(' '.join(['Ingen egenskaper i NVDB objekt', str(rawdata['id'])]) )
 
+        # Oppslag på egenskapstype-ID og navn, lages første gang vi trenger det (se _indekser)
+        self._egenskapid = None 
+        self._egenskapnavn = None 
+
+    def _indekser( self ): 
+        """Lager dictionaries for oppslag på egenskapstype-ID og eksakt navn. Ved duplikater gjelder den første"""
+        self._egenskapid = { }
+        self._egenskapnavn = { }
+        for dic in self.egenskaper: 
+            self._egenskapid.setdefault( dic['id'], dic )
+            self._egenskapnavn.setdefault( dic['navn'], dic )
         
-    def egenskap( self, id_or_navn, empty=None ):
+    def egenskap( self, id_or_navn, empty=None, delvis=True ):
         """Returns property egenskap with ID or NAME (navn) = id_or_navn
         Optional keyword empty changes what you get if this property 
         does not exist (i.e. does not have value) for this data
@@ -896,20 +1831,36 @@ class nvdbFagObjekt():
               'navn': 'Navn',
               'verdi': 'Lofoten'}}
 
+        Lookup by ID (int or digits as text) and exact name uses an index built on first call. 
+        If that fails, and keyword delvis=True (default), we fall back to the first property 
+        whose name contains id_or_navn (case insensitive). IDs never fall back to partial 
+        name matching, so asking for many IDs an object does not have stays cheap. 
+
         To just get the data value, use function egenskapverdi
         """
-        
-        for i, dic in enumerate( self.egenskaper): 
-            if dic['id'] == id_or_navn or str( id_or_navn) == dic['navn'] or \
-                        str( id_or_navn ).lower() in dic['navn'].lower() or \
-                        str(dic['id']) == str( id_or_navn): 
+        if self._egenskapid is None: 
+            self._indekser()
+
+        if id_or_navn in self._egenskapid: 
+            return self._egenskapid[id_or_navn]
+
+        tekst = str( id_or_navn )
+        if tekst in self._egenskapnavn: 
+            return self._egenskapnavn[tekst]
 
-                return dic
+        if tekst.isdigit(): 
+            return self._egenskapid.get( int( tekst ), empty )
+
+        if delvis and not isinstance( id_or_navn, int ): 
+            tekst = tekst.lower()
+            for dic in self.egenskaper: 
+                if tekst in dic['navn'].lower(): 
+                    return dic
 
         return empty 
     
             
-    def egenskapverdi( self, id_or_navn, empty=None ):
+    def egenskapverdi( self, id_or_navn, empty=None, delvis=True ):
         """Returns the property VALUE with ID or NAME (navn) = id_or_navn
         Just a convenient wraper around the egenskap - method, so you just 
         get the data value (and not all metadata, with ID's and definitions)
@@ -917,8 +1868,10 @@ class nvdbFagObjekt():
         Nytt i NVDB api V3: Stedfesting på vegnett og assossiasjon (relasjon mellom objekter) 
         er også egenskaper. Hvis du eksplisitt ber om disse så får du en tekst-representasjon av 
         denne datastrukturen(json.dumps)
+
+        Keyword delvis=True: See egenskap
         """ 
-        egenskap = self.egenskap( id_or_navn, empty=empty)
+        egenskap = self.egenskap( id_or_navn, empty=empty, delvis=delvis)
 
         stedfesting_eller_assosiasjon = [ 'Stedfesting', 'Liste' ]
 
@@ -933,12 +1886,12 @@ class nvdbFagObjekt():
         else: 
             return egenskap
 
-    def enumverdi( self, id_or_navn, empty=None): 
+    def enumverdi( self, id_or_navn, empty=None, delvis=True): 
         """Same as egenskapsverdi - but will return the ENUM code 
         for ENUM values. For non-enum datatypes you will get 
         your favourite empty-value (default: None) 
         """ 
-        egenskap = self.egenskap( id_or_navn, empty=empty)
+        egenskap = self.egenskap( id_or_navn, empty=empty, delvis=delvis)
         if egenskap and egenskap['datatype'] in [29,30]: 
             return egenskap['enum_id']
         else: 
@@ -1037,7 +1990,7 @@ def nvdbfagobjekt2records( feature_eller_liste, **kwargs):
     data = nvdbfagdata2records( feature_eller_liste, **kwargs) 
     return data 
 
-def nvdbfagdata2records( feature_eller_liste, vegsegmenter=True, relasjoner=True, geometri=False, debug=False, tidspunkt=None ): 
+def nvdbfagdata2records( feature_eller_liste, vegsegmenter=True, relasjoner=True, geometri=False, debug=False, tidspunkt=None, skjema=None ): 
     """
     Gjør om (liste med) nvdb fagdata fra NVDB api LES til records, dvs de-normalisert til dictionaries med enkel struktur. 
 
@@ -1064,7 +2017,8 @@ def nvdbfagdata2records( feature_eller_liste, vegsegmenter=True, relasjoner=True
     ikke lister, men dictionaries 
 
     Paramter relasjoner=True: Tar med dataelementet "relasjoner" fra objektet (dictionary-struktur med de ulike typer
-    relasjoner for objektet)
+    relasjoner for objektet). Med vegsegmenter=True får hver rad sin egen kopi av elementet, med vegsegmenter=False 
+    deles det med objektet fra NVDB api. 
 
     Parameter geometri=False: Tar ikke med s.k. egengeometri(er)
 
@@ -1084,6 +2038,9 @@ def nvdbfagdata2records( feature_eller_liste, vegsegmenter=True, relasjoner=True
         tidspunkt=None | dato som tekst på formen '2010-01-01'. Angi tidspunkt som brukes til å filtrere hvilke vegsegmenter som tas med
                 DEAKTIVERT, NVDB api gir kun ut de vegsegmentene som er gyldige på angitt tidspunkt for spørringen
 
+        skjema=None | instans av egenskapskjema : Ferdig kompilert utflating av egenskapverdier for objekttypen. 
+                Brukes for objekter av samme objekttype som skjemaet, øvrige flates ut med egenskaper2records
+
     RETURNS
         liste med dictionaries (vegobjekt fra NVDB api LES i flatere dictionary-struktur)
 
@@ -1097,7 +2054,6 @@ def nvdbfagdata2records( feature_eller_liste, vegsegmenter=True, relasjoner=True
         gyldigdato = dateutil.parser.parse( tidspunkt )
 
     nvdbid_manglergeom = []
-    terskler = [ 1000, 10000]
 
     for count, feat in enumerate(feature_eller_liste): 
         
@@ -1114,13 +2070,19 @@ def nvdbfagdata2records( feature_eller_liste, vegsegmenter=True, relasjoner=True
 
             # meta['metadata'] = feat['metadata']
 
-            egenskaper = egenskaper2records( feat['egenskaper'], relasjoner=False, geometri=geometri )
+            if skjema and skjema.objekttype == meta['objekttype']: 
+                egenskaper = skjema.records( feat['egenskaper'] )
+            else: 
+                egenskaper = egenskaper2records( feat['egenskaper'], relasjoner=False, geometri=geometri )
             if relasjoner and 'relasjoner' in feat.keys() and len( feat['relasjoner']) > 0: 
                 egenskaper['relasjoner'] = feat['relasjoner']
 
-            egenskaper = merge_dicts( meta, egenskaper)
+            egenskaper = { **meta, **egenskaper }
 
             if vegsegmenter: 
+                # Hver rad får sin egen kopi av relasjoner-elementet. json.loads er langt raskere enn deepcopy
+                relasjonstekst = json.dumps( egenskaper['relasjoner'] ) if 'relasjoner' in egenskaper else None 
+
                 for seg in feat['vegsegmenter']:
 
                     # Kommenterer ut tidspunkt-logikk fordi NVDB api nå (per mai 2021) kun presenterer de vegsegmentene som er 
@@ -1173,9 +2135,13 @@ def nvdbfagdata2records( feature_eller_liste, vegsegmenter=True, relasjoner=True
                         
                 
                     s2['geometri'] = seg['geometri']['wkt']
-                    egenskaper_kopi = deepcopy( egenskaper )
-                    egenskaper_kopi = merge_dicts( egenskaper_kopi, s2)
-                    mydata.append( egenskaper_kopi )
+
+                    # Én grunn kopi per vegsegment. Egenskapverdiene er tall og tekst, kun relasjoner-elementet
+                    # er nøstet og må kopieres for at radene ikke skal dele det
+                    rad = { **egenskaper, **s2 }
+                    if relasjonstekst: 
+                        rad['relasjoner'] = json.loads( relasjonstekst )
+                    mydata.append( rad )
             else: 
                 egenskaper['vegsystemreferanser'] = ','.join([ d['kortform'] for d in feat['lokasjon']['vegsystemreferanser'] ] )
                 egenskaper['stedfestinger']       = ','.join([ d['kortform'] for d in feat['lokasjon']['stedfestinger'] ] )
@@ -1208,8 +2174,9 @@ def finnid(objektid, kunvegnett=False, kunfagdata=False, miljo=False):
     miljø som skal brukes.
     """
     
-    # Dummy objekt for å gjenbruke anrops-funksjonene
-    b = nvdbFagdata(45)
+    # Dummy objekt for å gjenbruke anrops-funksjonene. nvdbVegnett gjør ingen kall mot NVDB api 
+    # når det opprettes, og bruker den delte http-sesjonen for miljøet 
+    b = nvdbVegnett()
     if miljo:
         b.miljo( miljo)
     res = None
@@ -1268,13 +2235,18 @@ def vegrefpunkt( vref, retur='veglenkeposisjon', forb=None ):
     params = { 'vegsystemreferanse' : vref }
     r = forb.les('/veg', params=params)
     if r.ok: 
-        data = r.json() 
-        if 'vegle' in retur.lower()  and 'veglenkesekvens' in data.keys() and 'kortform' in data['veglenkesekvens'].keys(): 
-            return data['veglenkesekvens']['kortform']
-        elif retur.lower() == 'wkt' and 'geometri' in data.keys() and 'wkt' in data['geometri'].keys(): 
-            return data['geometri']['wkt']
-        elif retur.lower() == 'komplett': 
-            return data 
+        return _vegrefpunkt_svar( r.json(), retur )
+
+    return None 
+
+def _vegrefpunkt_svar( data, retur ): 
+    """Plukker ut det vi skal returnere fra vegrefpunkt-oppslag, se vegrefpunkt"""
+    if 'vegle' in retur.lower()  and 'veglenkesekvens' in data.keys() and 'kortform' in data['veglenkesekvens'].keys(): 
+        return data['veglenkesekvens']['kortform']
+    elif retur.lower() == 'wkt' and 'geometri' in data.keys() and 'wkt' in data['geometri'].keys(): 
+        return data['geometri']['wkt']
+    elif retur.lower() == 'komplett': 
+        return data 
 
     return None 
 
@@ -1304,13 +2276,18 @@ def veglenkepunkt( vpos, retur='wkt', forb=None ):
     params = { 'veglenkesekvens' : vpos }
     r = forb.les('/veg', params=params)
     if r.ok: 
-        data = r.json() 
-        if 'ref' in retur.lower()  and 'vegsystemreferanse' in data.keys() and 'kortform' in data['vegsystemreferanse'].keys(): 
-            return data['vegsystemreferanse']['kortform']
-        elif retur.lower() == 'wkt' and 'geometri' in data.keys() and 'wkt' in data['geometri'].keys(): 
-            return data['geometri']['wkt']
-        elif retur.lower() == 'komplett': 
-            return data 
+        return _veglenkepunkt_svar( r.json(), retur )
+
+    return None 
+
+def _veglenkepunkt_svar( data, retur ): 
+    """Plukker ut det vi skal returnere fra veglenkepunkt-oppslag, se veglenkepunkt"""
+    if 'ref' in retur.lower()  and 'vegsystemreferanse' in data.keys() and 'kortform' in data['vegsystemreferanse'].keys(): 
+        return data['vegsystemreferanse']['kortform']
+    elif retur.lower() == 'wkt' and 'geometri' in data.keys() and 'wkt' in data['geometri'].keys(): 
+        return data['geometri']['wkt']
+    elif retur.lower() == 'komplett': 
+        return data 
 
     return None 
 
@@ -1405,7 +2382,29 @@ def hentrute( pos1, pos2, forb=None, **kwargs ):
 
     return returdata 
 
-def flatutvegnettsegment( vegnettsegment ): 
+# Oppslag vegsystemreferanse -> ( del, nøkkel ) for flatutvegnettsegment, settes opp én gang. Noen av 
+# verdiene hentes fra strekning, men overskrives med data fra kryssdel eller sidenanlegg dersom de finnes, 
+# så rekkefølgen er viktig. 
+_VEGSYSTEMSTIER = ( ( 'vegkategori'     , 'vegsystem'   , 'vegkategori'     ), 
+                    ( 'fase'            , 'vegsystem'   , 'fase'            ), 
+                    ( 'nummer'          , 'vegsystem'   , 'nummer'          ), 
+                    ( 'strekning'       , 'strekning'   , 'strekning'       ), 
+                    ( 'delstrekning'    , 'strekning'   , 'delstrekning'    ), 
+                    ( 'ankerpunktmeter' , 'strekning'   , 'meter'           ), 
+                    ( 'kryssdel'        , 'kryssystem'  , 'kryssdel'        ), 
+                    ( 'sideanleggsdel'  , 'sideanlegg'  , 'sideanleggsdel'  ), 
+                    ( 'fra_meter'       , 'strekning'   , 'fra_meter'       ), 
+                    ( 'til_meter'       , 'strekning'   , 'til_meter'       ), 
+                    ( 'trafikantgruppe' , 'strekning'   , 'trafikantgruppe' ), 
+                    ( 'fra_meter'       , 'kryssystem'  , 'fra_meter'       ), 
+                    ( 'til_meter'       , 'kryssystem'  , 'til_meter'       ), 
+                    ( 'trafikantgruppe' , 'kryssystem'  , 'trafikantgruppe' ), 
+                    ( 'fra_meter'       , 'sideanlegg'  , 'fra_meter'       ), 
+                    ( 'til_meter'       , 'sideanlegg'  , 'til_meter'       ), 
+                    ( 'trafikantgruppe' , 'sideanlegg'  , 'trafikantgruppe' ), 
+                    ( 'adskilte_lop'    , 'strekning'   , 'adskilte_løp'    ) ) 
+
+def flatutvegnettsegment( vegnettsegment, inplace=False ): 
     """
     Flater ut et veglenkesegment til en forenklet dictionary-struktur 
 
@@ -1415,74 +2414,47 @@ def flatutvegnettsegment( vegnettsegment ):
 
     Denne funksjonen brukes av søkebojektet nvdbVegnett.to_records() og rutesøk-funksjonene 
 
+    Resultatet er en grunn kopi, dvs nøstede elementer (f.eks. vegsystemreferanse) deles med input-data. 
+
     ARGUMENTS
         vegnettsegment - dictionary med data for et vegnettsegment 
 
     KEYWORDS 
-        None 
+        inplace=False | True : Endrer vegnettsegment direkte i stedet for å lage kopi. Bruk denne 
+                               når du ikke trenger det opprinnelige segmentet etterpå 
     
     RETURNS 
         dictionary, input-data med vegnettsinformasjon omarbeidet til flat struktur 
     """
 
-    v1 = deepcopy( vegnettsegment ) 
-
-    metadata = v1.pop( 'metadata', { } )
-    v1.update( metadata)
-    vr = 'vegsystemreferanse'
-    vsys = 'vegsystem'
-    strek = 'strekning'
-    kryss = 'kryssystem'
-    sidea = 'sideanlegg'
-
-    struktur = [ 
-        { 'navn' : 'medium',    'verdi' : { 'l1' : 'geometri',    'l2' : 'medium'  }}, 
-        { 'navn' : 'geometri',  'verdi' : { 'l1' : 'geometri',    'l2' : 'wkt'  }}, # NB! Geometri-dictionary byttes nå ut med WKT-tekststreng!
-                                                                                    # Hvis du vil ha mer data ut av geometri-elementet 
-                                                                                    # må du gjøre det FØR denne operasjonen (eller ta vare på data eksplisitt)
-        { 'navn' : 'vref',      'verdi' : { 'l1' : vr,            'l2' : 'kortform'  }}
-    ]
-
-    for mykey in struktur: 
-        try: 
-                v1[mykey['navn']] = v1[mykey['verdi']['l1']][mykey['verdi']['l2']]
-        except (KeyError, TypeError): 
-            pass                 
+    v1 = vegnettsegment if inplace else dict( vegnettsegment ) 
+
+    metadata = v1.pop( 'metadata', None )
+    if metadata: 
+        v1.update( metadata)
+
+    # NB! Geometri-dictionary byttes nå ut med WKT-tekststreng! Hvis du vil ha mer data ut av 
+    # geometri-elementet må du gjøre det FØR denne operasjonen (eller ta vare på data eksplisitt)
+    geometri = v1.get( 'geometri' )
+    if isinstance( geometri, dict ): 
+        if 'medium' in geometri: 
+            v1['medium'] = geometri['medium']
+        if 'wkt' in geometri: 
+            v1['geometri'] = geometri['wkt']
+
+    vegref = v1.get( 'vegsystemreferanse' )
+    if isinstance( vegref, dict ) and 'kortform' in vegref: 
+        v1['vref'] = vegref['kortform']
+
     # Gjør om feltoversikt fra liste-objekt til (kommaseparert) ren tekst 
-    try: 
+    if 'feltoversikt' in v1: 
         v1['feltoversikt']  = ','.join( v1['feltoversikt'])
-    except KeyError: 
-        pass 
-
-    # Noen av disse verdiene hentes fra strekning, men overskrives med  data
-    # fra kryssdel eller sidenanlegg dersom de finnes. 
-    # Vi følger python-idomet med å prøve om verdiene er der og ubekymret springe 
-    # videre hvis de ikke finnes. 
-    struktur = [{ 'navn' : 'vegkategori'     , 'verdi' :  { 'l1' : vr, 'l2' : vsys, 'l3' : 'vegkategori'        }}, 
-                { 'navn' : 'fase'            , 'verdi' :  { 'l1' : vr, 'l2' : vsys, 'l3' : 'fase'               }},  
-                { 'navn' : 'nummer'          , 'verdi' :  { 'l1' : vr, 'l2' : vsys, 'l3' : 'nummer'             }}, 
-                { 'navn' : 'strekning'       , 'verdi' :  { 'l1' : vr, 'l2' : strek, 'l3' : 'strekning'         }}, 
-                { 'navn' : 'delstrekning'    , 'verdi' :  { 'l1' : vr, 'l2' : strek, 'l3' : 'delstrekning'      }}, 
-                { 'navn' : 'ankerpunktmeter' , 'verdi' :  { 'l1' : vr, 'l2' : strek, 'l3' : 'meter'             }}, 
-                { 'navn' : 'kryssdel'        , 'verdi' :  { 'l1' : vr, 'l2' : kryss, 'l3' : 'kryssdel'          }}, 
-                { 'navn' : 'sideanleggsdel'  , 'verdi' :  { 'l1' : vr, 'l2' : sidea, 'l3' : 'sideanleggsdel'    }},   
-                { 'navn' : 'fra_meter'       , 'verdi' :  { 'l1' : vr, 'l2' : strek, 'l3' : 'fra_meter'         }}, 
-                { 'navn' : 'til_meter'       , 'verdi' :  { 'l1' : vr, 'l2' : strek, 'l3' : 'til_meter'         }}, 
-                { 'navn' : 'trafikantgruppe' , 'verdi' :  { 'l1' : vr, 'l2' : strek, 'l3' : 'trafikantgruppe'   }}, 
-                { 'navn' : 'fra_meter'       , 'verdi' :  { 'l1' : vr, 'l2' : kryss, 'l3' : 'fra_meter'         }}, 
-                { 'navn' : 'til_meter'       , 'verdi' :  { 'l1' : vr, 'l2' : kryss, 'l3' : 'til_meter'         }}, 
-                { 'navn' : 'trafikantgruppe' , 'verdi' :  { 'l1' : vr, 'l2' : kryss, 'l3' : 'trafikantgruppe'   }}, 
-                { 'navn' : 'fra_meter'       , 'verdi' :  { 'l1' : vr, 'l2' : sidea, 'l3' : 'fra_meter'         }}, 
-                { 'navn' : 'til_meter'       , 'verdi' :  { 'l1' : vr, 'l2' : sidea, 'l3' : 'til_meter'         }}, 
-                { 'navn' : 'trafikantgruppe' , 'verdi' :  { 'l1' : vr, 'l2' : sidea, 'l3' : 'trafikantgruppe'   }}, 
-                { 'navn' : 'adskilte_lop'    , 'verdi' :  { 'l1' : vr, 'l2' : strek, 'l3' : 'adskilte_løp'      }}
-                ]
-
-    for mykey in struktur: 
-        try: 
-            v1[mykey['navn']] = v1[mykey['verdi']['l1']][mykey['verdi']['l2']][mykey['verdi']['l3']]
-        except KeyError: 
-            pass 
+
+    if vegref is not None: 
+        for navn, del_, nokkel in _VEGSYSTEMSTIER: 
+            verdier = vegref.get( del_ )
+            if verdier is not None and nokkel in verdier: 
+                v1[navn] = verdier[nokkel]
     
     v1.pop( 'kontraktsområder', None)
     v1.pop( 'riksvegruter', None)    
@@ -1506,41 +2478,297 @@ def egenskaper2records( egenskaper, relasjoner=False, geometri=False ):
     data = {}
 
     for eg in egenskaper: 
-        if eg['id'] < 100000 and not eg['egenskapstype'].lower() in ['struktur', 'liste']: 
-
-            if eg['navn'] == 'Vedlegg':
-                vedleggnavn = eg['navn']
-                count = 0 
-                # Legger til rette for at vi kan ha en liste med vedlegg (vedlegg1, vedlegg2, ...)
-                # Bør testes før vi stoler 100% på denne funksjonen, gjetter
-                # litt i blinde her. 
-                while vedleggnavn in data.keys():
-                    count += 1
-                    vedleggnavn = eg['navn'] + str( count )
-                    print( "Flere vedlegg (eksperimentelt!", vedleggnavn)
-                    print( json.dumps( eg, indent=4 ))
-
-                if 'href' in eg: 
-                    data[vedleggnavn] = eg['href']
-                else: 
-                    print( 'Primitiv vedleggshåndtering, denne skjønte jeg ikke:')
-                    print( json.dumps( eg, indent=4 ))
-
-            elif geometri or not 'geometri' in eg['navn'].lower(): 
-                if 'egenskapstype' in eg.keys() and eg['egenskapstype'] == 'Binær' and 'href' in eg.keys(): 
-                    data[eg['navn']] = eg['href']
-                else: 
-                    try: 
-                        data[eg['navn']] = eg['verdi']
-                    except KeyError:
-                        print( 'Fant ingen verdi i denne egenskapen, ignorerer:\n', json.dumps( eg, indent=4) )
-                        # TODO må kanskje gå gjennom alle egenskaptype-varianter mer i detalj og eksplisitt? 
+        _egenskap2record( eg, data, geometri=geometri )
 
     if relasjoner: 
         warn( 'Uthenting av relasjoner fra egenskapverdier er ikke implementert (ennå). Bruk to_records() eller nvdbfagdata2records()')
 
     return data 
             
+
+def _egenskap2record( eg, data, geometri=False ): 
+    """Føyer en enkelt egenskapverdi til dictionary data, etter reglene i egenskaper2records"""
+    if eg['id'] < 100000 and not eg['egenskapstype'].lower() in ['struktur', 'liste']: 
+
+        if eg['navn'] == 'Vedlegg':
+            vedleggnavn = eg['navn']
+            count = 0 
+            # Legger til rette for at vi kan ha en liste med vedlegg (vedlegg1, vedlegg2, ...)
+            # Bør testes før vi stoler 100% på denne funksjonen, gjetter
+            # litt i blinde her. 
+            while vedleggnavn in data.keys():
+                count += 1
+                vedleggnavn = eg['navn'] + str( count )
+                print( "Flere vedlegg (eksperimentelt!", vedleggnavn)
+                print( json.dumps( eg, indent=4 ))
+
+            if 'href' in eg: 
+                data[vedleggnavn] = eg['href']
+            else: 
+                print( 'Primitiv vedleggshåndtering, denne skjønte jeg ikke:')
+                print( json.dumps( eg, indent=4 ))
+
+        elif geometri or not 'geometri' in eg['navn'].lower(): 
+            if 'egenskapstype' in eg.keys() and eg['egenskapstype'] == 'Binær' and 'href' in eg.keys(): 
+                data[eg['navn']] = eg['href']
+            else: 
+                try: 
+                    data[eg['navn']] = eg['verdi']
+                except KeyError:
+                    print( 'Fant ingen verdi i denne egenskapen, ignorerer:\n', json.dumps( eg, indent=4) )
+                    # TODO må kanskje gå gjennom alle egenskaptype-varianter mer i detalj og eksplisitt?
+
+class egenskapskjema(): 
+    """
+    Ferdig kompilert oppskrift for å flate ut egenskapverdiene til én objekttype, ut fra datakatalogen. 
+
+    egenskaper2records avgjør for hver egenskap i hvert objekt om det er struktur, liste, geometri, binær 
+    eller vedlegg. Her gjør vi det én gang per egenskapstype, og utflatingen blir en enkel løkke med 
+    oppslag på egenskapstype-ID. Resultatet er det samme som fra egenskaper2records. Egenskaper som ikke 
+    finnes i datakatalogen (f.eks. ny versjon) håndteres av egenskaper2records-logikken. 
+
+    Med fastskjema=True får alle radene de samme kolonnene som egenskaper_fastskjema, dvs alle egenskapstypene 
+    i datakatalogen (evt med verdien missing), i samme rekkefølge som i datakatalogen. Struktur, liste og 
+    (med geometri=False) egengeometri flates ikke ut, og disse kolonnene får alltid verdien missing. 
+
+    Eksempel
+        sok = nvdbFagdata( 105 )
+        skjema = egenskapskjema( sok.objektTypeDef, fastskjema=True )
+        rader = [ skjema.records( obj['egenskaper'] ) for obj in sok ]
+    """
+
+    # Hva slags egenskap, avgjort ut fra datakatalogen
+    HOPPOVER = 0
+    VERDI    = 1
+    BINAER   = 2
+    SPESIELL = 3 # Vedlegg m.m, bruker egenskaper2records-logikken
+
+    def __init__( self, objektTypeDef, geometri=False, fastskjema=False, missing=None ): 
+        """
+        ARGUMENTS
+            objektTypeDef - definisjon av objekttypen fra datakatalogen, f.eks. nvdbFagdata.objektTypeDef 
+
+        KEYWORDS
+            geometri=False | True : Ta med egengeometri, som for egenskaper2records 
+
+            fastskjema=False | True : Alle rader får alle kolonnene 
+
+            missing=None : Verdi for egenskaper som mangler, brukes med fastskjema=True
+        """
+        self.objekttype = objektTypeDef['id'] if 'id' in objektTypeDef else None
+        self.geometri = geometri 
+        self.tabell = { }
+        mal = { }
+
+        for eg in objektTypeDef['egenskapstyper']: 
+            if eg['id'] >= 100000 or eg['egenskapstype'].lower() in [ 'struktur', 'liste' ]: 
+                hva = self.HOPPOVER
+            elif eg['navn'] == 'Vedlegg': 
+                hva = self.SPESIELL 
+            elif not geometri and 'geometri' in eg['navn'].lower(): 
+                hva = self.HOPPOVER
+            elif eg['egenskapstype'] == 'Binær': 
+                hva = self.BINAER 
+            else: 
+                hva = self.VERDI 
+
+            self.tabell[eg['id']] = hva 
+            mal[eg['navn']] = missing 
+
+        self.mal = mal if fastskjema else None 
+        self.missing = missing 
+
+    def records( self, egenskaper ): 
+        """
+        Oversetter liste med egenskapverdier til dictionary med struktur "egenskapnavn" : Verdi, 
+        samme resultat som egenskaper2records( egenskaper, geometri=self.geometri ) 
+        """
+        data = dict( self.mal ) if self.mal else { }
+        tabell = self.tabell 
+        spesiell = None 
+
+        for eg in egenskaper: 
+            hva = tabell.get( eg['id'] )
+            if hva == self.HOPPOVER: 
+                continue 
+            elif hva == self.VERDI and 'verdi' in eg: 
+                data[eg['navn']] = eg['verdi']
+            elif hva == self.BINAER and 'href' in eg: 
+                data[eg['navn']] = eg['href']
+            elif hva == self.SPESIELL and self.mal and eg['navn'] in self.mal: 
+                # Første vedlegg erstatter plassholderen fra malen, kun flere vedlegg nummereres (Vedlegg1, ...)
+                if spesiell is None: 
+                    spesiell = set( )
+                if eg['navn'] in spesiell: 
+                    _egenskap2record( eg, data, geometri=self.geometri )
+                else: 
+                    spesiell.add( eg['navn'] )
+                    data[eg['navn']] = eg.get( 'href', eg.get( 'verdi', self.missing ) )
+            else: 
+                _egenskap2record( eg, data, geometri=self.geometri )
+
+        return data 
+
+def _omradenummer( verdi ): 
+    """Fylke- eller kommunenummer fra filteret som liste med heltall. Godtar heltall, liste og kommaseparert tekst"""
+    if isinstance( verdi, ( list, tuple, set ) ): 
+        return [ int( x ) for x in verdi ]
+    return [ int( x ) for x in str( verdi ).split( ',' ) if x.strip() ]
+
+def _settantall( path, parametre, antall ): 
+    """
+    Setter antall objekter per side, enten i parametre (dictionary) eller i lenke til neste side fra NVDB api. 
+    Returnerer (path, parametre) 
+    """
+    if not parametre and '?' in path: 
+        deler = urllib.parse.urlsplit( path )
+        query = [ (k, v) for k, v in urllib.parse.parse_qsl( deler.query, keep_blank_values=True ) if k != 'antall' ]
+        query.append( ( 'antall', str( antall ) ) )
+        return urllib.parse.urlunsplit( deler._replace( query=urllib.parse.urlencode( query ) ) ), parametre
+
+    return path, merge_dicts( parametre or { }, { 'antall' : antall } )
+
+def _prosessrader( sokeobjekt, prosesser, **kwargs ): 
+    """
+    Generator for iter_records( prosesser=N ): Laster ned sidene i denne prosessen og lar N andre 
+    prosesser flate dem ut parallelt. 
+
+    Arbeiderne får sidene som rå bytes og oversetter JSON selv, så vi slipper å oversette (og pickle) 
+    hele siden i denne prosessen. Her leser vi kun metadata for å finne neste side. Radene gis i samme 
+    rekkefølge som sidene, og vi har maks 2*N sider underveis. 
+
+    Pagineringen fortsetter der søkeobjektet slapp (f.eks. etter resume), og med checkpoint påslått 
+    skrives sjekkpunkt når alle radene fra en side er gitt videre, slik som for nesteForekomst 
+    """
+    if isinstance( sokeobjekt, nvdbFagdata): 
+        oppsett = ( sokeobjekt.objektTypeDef, kwargs )
+    else: 
+        oppsett = ( None, kwargs )
+
+    if sokeobjekt.paginering['initielt']: 
+        path, parametre = sokeobjekt._forsteanrop()
+    elif sokeobjekt.paginering['meredata']: 
+        path, parametre = sokeobjekt.data['metadata']['neste']['href'], None 
+    else: 
+        return 
+
+    sokeobjekt.paginering['initielt'] = False 
+    underveis = deque()     # ( arbeid, lenke til siden etter denne ) 
+
+    def _ferdigside( ): 
+        arbeid, neste = underveis.popleft()
+        yield from arbeid.result()
+        # Alle radene fra siden er gitt videre, da er det trygt å lagre hvor vi er 
+        if sokeobjekt.checkpointfil: 
+            sokeobjekt._skrivcheckpoint( neste )
+
+    with ProcessPoolExecutor( max_workers=prosesser, initializer=_prosess_start, initargs=oppsett ) as pool: 
+        while path: 
+            innhold = sokeobjekt._anrope_bytes( path, parametre=parametre )
+            metadata = _sidemetadata( innhold )
+            sokeobjekt.data = { 'objekter' : [], 'metadata' : metadata }
+            if isinstance( sokeobjekt, nvdbFagdata) and sokeobjekt.antall is None: 
+                sokeobjekt.antall = metadata.get( 'antall' )
+
+            if metadata['returnert'] > 0: 
+                path, parametre = metadata['neste']['href'], None 
+                underveis.append( ( pool.submit( _prosess_flatut, innhold ), path ) )
+            else: 
+                path = None 
+
+            while underveis and ( len( underveis ) >= 2 * prosesser or underveis[0][0].done() ): 
+                yield from _ferdigside( )
+
+        while underveis: 
+            yield from _ferdigside( )
+
+    sokeobjekt.paginering['meredata'] = False 
+    if sokeobjekt.checkpointfil: 
+        sokeobjekt._skrivcheckpoint( None, ferdig=True )
+
+# Oppsett for arbeiderprosessene i _prosessrader, settes av _prosess_start
+_prosessoppsett = { }
+
+def _prosess_start( objektTypeDef, kwargs ): 
+    """Kjøres én gang i hver arbeiderprosess, kompilerer egenskapskjema for objekttypen"""
+    _prosessoppsett['kwargs'] = dict( kwargs )
+    _prosessoppsett['fagdata'] = objektTypeDef is not None 
+    _prosessoppsett['geometriformat'] = _prosessoppsett['kwargs'].pop( 'geometriformat', 'wkt' )
+    if objektTypeDef is not None: 
+        fastskjema = _prosessoppsett['kwargs'].pop( 'fastskjema', False )
+        _prosessoppsett['kwargs']['skjema'] = egenskapskjema( objektTypeDef, geometri=kwargs.get( 'geometri', False ), 
+                                                                fastskjema=fastskjema )
+
+def _prosess_flatut( innhold ): 
+    """Kjøres i arbeiderprosess: Oversetter en side (rå bytes) fra NVDB api og flater ut objektene"""
+    objekter = json.loads( innhold )['objekter']
+    if _prosessoppsett['fagdata']: 
+        rader = nvdbfagdata2records( objekter, **_prosessoppsett['kwargs'] )
+    else: 
+        rader = [ flatutvegnettsegment( v1, inplace=True ) for v1 in objekter ]
+    return _geometriformat( rader, _prosessoppsett['geometriformat'] )
+
+def _sjekkgeometriformat( geometriformat ): 
+    if geometriformat not in geometri.GEOMETRIFORMAT: 
+        raise ValueError( 'Ukjent geometriformat ' + str( geometriformat ) + ', gyldige verdier: ' + 
+                            ', '.join( geometri.GEOMETRIFORMAT ) )
+
+def _geometriformat( rader, geometriformat ): 
+    """Gjør om geometri (WKT) i utflatede rader til angitt geometriformat, endrer radene direkte"""
+    if geometriformat == 'wkb': 
+        for rad in rader: 
+            if isinstance( rad.get( 'geometri' ), str ): 
+                rad['geometri'] = geometri.wkt2wkb( rad['geometri'] )
+    return rader 
+
+def _sidemetadata( innhold ): 
+    """
+    Leser metadata fra en side (rå bytes) fra NVDB api uten å oversette hele siden. Metadata for 
+    siden kommer etter objektene, og objektene har selv et metadata-element, så vi leter bakfra og 
+    sjekker at vi har funnet riktig element. 
+    """
+    pos = innhold.rfind( b'"metadata"' )
+    if pos >= 0: 
+        hale = innhold[pos:].decode( 'utf-8' )
+        hale = hale[hale.index( ':' )+1:].lstrip()
+        try: 
+            metadata, slutt = json.JSONDecoder().raw_decode( hale )
+        except JSONDecodeError: 
+            metadata = None 
+        if isinstance( metadata, dict) and 'returnert' in metadata and hale[slutt:].strip() == '}': 
+            return metadata 
+
+    return json.loads( innhold )['metadata']
+
+def _bunker( rader, batch ): 
+    """Gir radene én og én, evt samlet i lister med (inntil) batch rader"""
+    if not batch: 
+        yield from rader 
+        return 
+
+    bunke = []
+    for rad in rader: 
+        bunke.append( rad )
+        if len( bunke ) >= batch: 
+            yield bunke 
+            bunke = []
+    if bunke: 
+        yield bunke 
+
+def _prefetch_leggtil( ko, stopp, element ): 
+    """
+    Legger element i prefetch-køen uten å henge evig hvis søkeobjektet slutter å lese fra køen. 
+    Returnerer False dersom vi har fått beskjed om å stoppe. 
+    """
+    while not stopp.is_set(): 
+        try: 
+            ko.put( element, timeout=0.5 )
+            return True 
+        except queue.Full: 
+            pass 
+
+    return False 
+
 def merge_dicts(*dict_args):
     """
     Python < 3.5 kompatibel kode for å slå sammen to eller flere dict. 
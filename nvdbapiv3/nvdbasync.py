@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Asynkron (asyncio) klient for NVDB api LES
+
+asyncforbindelse - Asynkron motpart til apiforbindelse. Henter data fra NVDB api med
+aiohttp, og kan iterere asynkront over søkeobjektene nvdbVegnett og nvdbFagdata. Bruker
+samme filtre (søkeobjektet), samme regler for nye forsøk (retrypolicy) og samme
+utflating (nvdbfagdata2records, flatutvegnettsegment) som resten av biblioteket.
+
+Nyttig når du skal hente mange objekttyper eller gjøre tusenvis av punktoppslag samtidig,
+der tråder rundt blokkerende requests-kall skalerer dårlig og er vanskelige å avbryte.
+
+Kallene går via den samme felles ratebegrenseren for miljøet som apiforbindelse (se
+settratebegrensning), og bruker lokal cache hvis den er slått på (se setthttpcache). Blander du
+synkrone og asynkrone kall holder dere dere altså innenfor den samme begrensningen.
+
+Lag søkeobjektene med lazy=True (eller før event-løkka startes), ellers henter nvdbFagdata
+typedefinisjonen fra NVDB api med et blokkerende kall.
+
+Krever aiohttp (pip install aiohttp), som IKKE er nødvendig for resten av biblioteket.
+
+Eksempel
+    import asyncio
+    from nvdbapiv3 import nvdbFagdata, asyncforbindelse
+
+    async def hentalt( ):
+        async with asyncforbindelse( ) as forb:
+            fart = nvdbFagdata( 105, lazy=True )
+            fart.filter( { 'kommune' : 5001 } )
+            bom = nvdbFagdata( 45, lazy=True )
+            return await asyncio.gather( forb.to_records( fart ), forb.to_records( bom ) )
+
+    fartsgrenser, bomstasjoner = asyncio.run( hentalt() )
+"""
+import asyncio
+import json
+from json import JSONDecodeError
+
+from .apiforbindelse import apiforbindelse, ratebegrensning
+from .httpcache import httpcache, _respons
+from .nvdbapiv3 import nvdbFagdata, nvdbfagdata2records, flatutvegnettsegment, _vegrefpunkt_svar, _veglenkepunkt_svar
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class asyncforbindelse( ):
+    """
+    Asynkron forbindelse mot NVDB api LES. Brukes som asynkron context manager:
+
+        async with asyncforbindelse( miljo='prodles' ) as forb:
+            data = await forb.anrope( 'vegobjekttyper/105' )
+            async for fart in forb.objekter( nvdbFagdata( 105, lazy=True ) ):
+                ...
+    """
+
+    def __init__( self, miljo='prodles', retry=None, maks_samtidige=20 ):
+        """
+        Keywords:
+            miljo='prodles' : Miljø, samme verdier som for apiforbindelse (kun LES-miljøene er aktuelle)
+
+            retry=None : Instans av retrypolicy. Default er det felles regelsettet
+
+            maks_samtidige=20 : Maks antall kall som er underveis samtidig fra denne forbindelsen
+        """
+        if aiohttp is None:
+            raise ImportError( 'asyncforbindelse krever aiohttp, installer med: pip install aiohttp' )
+
+        # Gjenbruker apiforbindelse for url, http-headere og regler for nye forsøk
+        synkron = apiforbindelse( miljo=miljo, retry=retry )
+        self.miljo = miljo
+        self.apiurl = synkron.apiurl
+        self.headers = synkron.headers
+        self.retry = synkron.retry
+        self.maks_samtidige = maks_samtidige
+        self.sesjon = None
+        self._semafor = None
+
+    async def __aenter__( self ):
+        await self.apne()
+        return self
+
+    async def __aexit__( self, *args ):
+        await self.lukk()
+        return False
+
+    async def apne( self ):
+        """Oppretter http-sesjon. Skjer automatisk ved første kall, eller med async with"""
+        if self.sesjon is None:
+            self._semafor = asyncio.Semaphore( self.maks_samtidige )
+            self.sesjon = aiohttp.ClientSession( connector=aiohttp.TCPConnector( limit=self.maks_samtidige ) )
+
+    async def lukk( self ):
+        """Lukker http-sesjonen"""
+        if self.sesjon is not None:
+            await self.sesjon.close()
+        self.sesjon = None
+        self._semafor = None
+
+    async def anrope( self, path, parametre=None, headers=None ):
+        """
+        Henter data fra NVDB api og returnerer JSON-responsen, tilsvarer nvdbVegnett.anrope
+
+        Nettverksfeil, ugyldig JSON og http-statuskoder som 429, 502, 503 og 504 prøves på ny
+        etter reglene i self.retry. Gir ValueError hvis vi må gi opp. Kallene går via den felles
+        ratebegrenseren for miljøet, og lokal cache brukes på samme måte som i apiforbindelse.les
+
+        ARGUMENTS
+            path - URL, enten relativt til rot-endepunkt for API, eller fullstendig
+
+        KEYWORDS
+            parametre=None : Dictionary med parametre til spørringen
+
+            headers=None : Dictionary med ekstra http-headere
+
+        RETURNS
+            JSON-respons fra NVDB api (dictionary eller liste)
+        """
+        await self.apne()
+
+        if path[0:4] == 'http':
+            url = path
+        else:
+            url = self.apiurl.rstrip( '/' ) + '/' + path.lstrip( '/' )
+
+        myheaders = _slasammenheadere( self.headers, headers )
+        params = _aiohttpparametre( parametre )
+
+        # Lokal cache (sqlite på disk, korte oppslag), samme nøkler og regler som apiforbindelse.les
+        cache = httpcache()
+        lagret = None
+        if cache:
+            nokkel = cache.nokkel( url, parametre, myheaders )
+            lagret, fersk = cache.hent( nokkel )
+            if fersk:
+                return lagret.json()
+            myheaders.update( cache.valideringsheadere( lagret ) )
+
+        forsok = 0
+        while True:
+            forsok += 1
+            try:
+                async with self._semafor, ratebegrensning( self.miljo ):
+                    async with self.sesjon.get( url, params=params, headers=myheaders ) as r:
+                        respons = r
+                        innhold = await r.read()
+                        tekst = await r.text()
+
+            except ( aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError ) as e:
+                if not self.retry.skalprove( forsok ):
+                    raise
+                tid = self.retry.ventetid( forsok )
+                print( 'Feilmelding ved henting av data', str( e ), '- forsøk', forsok, 'av', self.retry.maks_forsok,
+                        ', prøver på ny om', round( tid, 1 ), 'sekunder' )
+                await asyncio.sleep( tid )
+                continue
+
+            if respons.status == 304 and lagret is not None:
+                cache.fornyet( nokkel )
+                return lagret.json()
+
+            if respons.status == 200:
+                try:
+                    data = json.loads( tekst )
+                    if cache:
+                        cache.lagre( nokkel, _respons( str( respons.url ), dict( respons.headers ), innhold ) )
+                    return data
+                except JSONDecodeError:
+                    if not self.retry.skalprove( forsok ):
+                        raise ValueError( 'Klarte ikke oversette respons fra NVDB api til JSON for kall ' + str( respons.url ) )
+
+            elif not self.retry.skalprove( forsok, respons.status ):
+                raise ValueError( 'Http error: ' + str( respons.status ) + ' ' + str( respons.url ) + '\n' + tekst )
+
+            await asyncio.sleep( self.retry.ventetid( forsok, respons=respons ) )
+
+    async def objekter( self, sokeobjekt ):
+        """
+        Asynkron iterator over alle objekter (vegnett eller vegobjekter) som passer med søkeobjektets filtre
+
+        Eksempel
+            async for fart in forb.objekter( nvdbFagdata( 105, lazy=True ) ):
+                print( fart['id'] )
+
+        ARGUMENTS
+            sokeobjekt - instans av nvdbVegnett eller nvdbFagdata
+
+        RETURNS
+            asynkron iterator med objekter slik de kommer fra NVDB api
+        """
+        path, parametre = sokeobjekt._forsteanrop()
+        while True:
+            data = await self.anrope( path, parametre=parametre, headers=sokeobjekt.headers )
+            for obj in data['objekter']:
+                yield obj
+
+            if data['metadata']['returnert'] == 0:
+                return
+            path, parametre = data['metadata']['neste']['href'], None
+
+    async def to_records( self, sokeobjekt, **kwargs ):
+        """
+        Asynkron variant av nvdbVegnett.to_records() og nvdbFagdata.to_records()
+
+        ARGUMENTS
+            sokeobjekt - instans av nvdbVegnett eller nvdbFagdata
+
+        KEYWORDS
+            For nvdbFagdata sendes nøkkelordene videre til nvdbfagdata2records (vegsegmenter,
+            relasjoner, geometri, debug, tidspunkt)
+
+        RETURNS
+            liste med dictionaries, samme struktur som to_records()
+        """
+        mydata = []
+        if isinstance( sokeobjekt, nvdbFagdata ):
+            if not kwargs.get( 'tidspunkt' ) and 'tidspunkt' in sokeobjekt.filterdata:
+                kwargs['tidspunkt'] = sokeobjekt.filterdata['tidspunkt']
+
+            async for feat in self.objekter( sokeobjekt ):
+                if 'geometri' in feat:
+                    mydata.extend( nvdbfagdata2records( feat, **kwargs ) )
+        else:
+            async for v1 in self.objekter( sokeobjekt ):
+                mydata.append( flatutvegnettsegment( v1, inplace=True ) )
+
+        return mydata
+
+    async def vegrefpunkt( self, vref, retur='veglenkeposisjon' ):
+        """Asynkron variant av nvdbapiv3.vegrefpunkt. Returnerer None hvis oppslaget feiler"""
+        try:
+            data = await self.anrope( '/veg', parametre={ 'vegsystemreferanse' : vref } )
+        except ValueError:
+            return None
+        return _vegrefpunkt_svar( data, retur )
+
+    async def veglenkepunkt( self, vpos, retur='wkt' ):
+        """Asynkron variant av nvdbapiv3.veglenkepunkt. Returnerer None hvis oppslaget feiler"""
+        try:
+            data = await self.anrope( '/veg', parametre={ 'veglenkesekvens' : vpos } )
+        except ValueError:
+            return None
+        return _veglenkepunkt_svar( data, retur )
+
+
+def _slasammenheadere( standard, ekstra ):
+    """Slår sammen http-headere uten å skille på store og små bokstaver, ekstra har forrang"""
+    if not ekstra:
+        return dict( standard )
+
+    overstyrt = { k.lower() for k in ekstra }
+    myheaders = { k : v for k, v in standard.items() if k.lower() not in overstyrt }
+    myheaders.update( ekstra )
+    return myheaders
+
+def _aiohttpparametre( parametre ):
+    """
+    Oversetter parametre til liste med (nøkkel, tekst)-par for aiohttp. Lister blir gjentatte
+    nøkler, slik requests gjør det (f.eks. inkluder=['alle'])
+    """
+    if not parametre:
+        return None
+
+    params = []
+    for key, verdi in parametre.items():
+        if isinstance( verdi, ( list, tuple ) ):
+            params.extend( [ ( key, str( v ) ) for v in verdi ] )
+        else:
+            params.append( ( key, str( verdi ) ) )
+    return params
@@ -14,7 +14,6 @@ import pdb
 from copy import deepcopy
 import sqlite3
 
-from shapely import wkt 
 # from shapely.ops import unary_union
 import pandas as pd 
 import geopandas as gpd 
@@ -22,6 +21,9 @@ from datetime import datetime
 
 import nvdbapiv3
 from nvdbapiv3 import apiforbindelse
+from nvdbapiv3.geometri import tilgeometri
+from nvdbapiv3.gpkg import skrivgpkg
+from nvdbapiv3 import kolonner
 
 def finnoverlapp( dfA, dfB, prefixA=None, prefixB=None, join='inner' ): 
     """
@@ -296,39 +298,29 @@ def finnDatter( morDf, datterDf, prefixMor=None, prefixDatter=None, ignorerDatte
 
     return returDf 
 
-def records2gpkg( minliste, filnavn, lagnavn ): 
+def records2gpkg( minliste, filnavn, lagnavn, typer=None, transaksjon=10000 ): 
     """
     Tar en liste med records (dictionaries) a la dem vi får fra nvdbapiv3.to_records() og skriver til geopackage
 
-    Forutsetning: Alle records har et "geometri"-element med WKT-streng og inneholder ingen lister. 
-    Vi tester for en del kjente snublefeller mhp disse forutsetningene, men ikke alle. 
-    """
-    if len( minliste ) == 0: 
-        raise ValueError( 'nvdbgeotrics.records2gpkg: Tom liste som inngangsverdi, funker dårlig')
+    Forutsetning: Alle records har et "geometri"-element med WKT-streng (evt WKB, se to_records( geometriformat='wkb' )).
+    Lister og andre nøstede elementer lagres som JSON-tekst, kolonnen "vegsegmenter" utelates. 
 
-    mindf = pd.DataFrame( minliste )
-    # Må trickse litt for å unngå navnekollisjon
-    kolonner = list( mindf.columns )
-    lowerkolonner = [ x.lower() for x in kolonner ]
-    # Duplicate element indices in list 
-    # Using list comprehension + list slicing 
-    # https://www.geeksforgeeks.org/python-duplicate-element-indices-in-list/ 
-    res = [idx for idx, val in enumerate(lowerkolonner) if val in lowerkolonner[:idx]] 
-    for ii, dublett in enumerate( res):
-        mindf.rename(columns={ mindf.columns[dublett] : kolonner[dublett] + '_' + str( ii+1 )  }, inplace=True )
+    Radene skrives fortløpende med nvdbapiv3.gpkg.skrivgpkg, i transaksjoner med inntil transaksjon rader. 
+    Du kan derfor sende inn en iterator, f.eks. sok.iter_records(), i stedet for en liste, slik at vi 
+    aldri har mer enn én transaksjon med data i minnet. Romlig indeks bygges én gang til slutt. 
 
-    if isinstance( mindf.iloc[0].geometri, dict ): 
-        mindf['geometri'] = mindf['geometri'].apply( lambda x : x['wkt'] )
+    KEYWORDS
+        typer=None : dictionary { kolonnenavn : datatype }, se nvdbapiv3.kolonner.kolonnetyper
 
-    mindf['geometry'] = mindf['geometri'].apply( wkt.loads )
-    minGdf = gpd.GeoDataFrame( mindf, geometry='geometry', crs=5973 )       
-    # må droppe kolonne vegsegmenter hvis data er hentet med vegsegmenter=False 
-    if 'vegsegmenter' in minGdf.columns:
-        minGdf.drop( 'vegsegmenter', 1, inplace=True)
+        transaksjon=10000 : Antall rader per transaksjon
 
-    minGdf.drop( 'geometri', 1, inplace=True)
-    minGdf.to_file( filnavn, layer=lagnavn, driver="GPKG")  
+    RETURNS
+        antall rader skrevet til laget
+    """
+    if isinstance( minliste, list ) and len( minliste ) == 0: 
+        raise ValueError( 'nvdbgeotrics.records2gpkg: Tom liste som inngangsverdi, funker dårlig')
 
+    return skrivgpkg( minliste, filnavn, lagnavn, typer=typer, transaksjon=transaksjon, utelat=( 'vegsegmenter', ) )
 
 
 def nvdb2gpkg( objekttyper, filnavn='datadump', mittfilter=None, vegnett=True, vegsegmenter=False, geometri=True):
@@ -378,12 +370,11 @@ def nvdb2gpkg( objekttyper, filnavn='datadump', mittfilter=None, vegnett=True, v
         print( 'Henter', stat['antall'],  'forekomster av objekttype', sok.objektTypeId, objtypenavn )
         lagnavn = 'type' + str(enObjTypeId) + '_' + nvdbapiv3.esriSikkerTekst( objtypenavn.lower() ) 
 
-        rec = sok.to_records( vegsegmenter=vegsegmenter, geometri=geometri )
+        rec = sok.iter_records( vegsegmenter=vegsegmenter, geometri=geometri )
 
-        # Lagringsrutine skilt ut med funksjonen records2gpkg, IKKE TESTET (men bør gå greit) 
-        if len( rec ) > 0: 
-            records2gpkg( rec, filnavn, lagnavn )
-        else: 
+        # Skriver fortløpende mens vi henter data, uten å ha alle forekomstene i minnet
+        antall = records2gpkg( rec, filnavn, lagnavn, typer=kolonner.kolonnetyper( sok.objektTypeDef ) )
+        if antall == 0: 
             print( 'Ingen forekomster av', objtypenavn, 'for filter', mittfilter)        
 
     if vegnett: 
@@ -393,12 +384,7 @@ def nvdb2gpkg( objekttyper, filnavn='datadump', mittfilter=None, vegnett=True, v
             junk = mittfilter.pop( 'overlapp', None)
             veg.filter( mittfilter )
         print( 'Henter vegnett')
-        rec = veg.to_records()
-        mindf = pd.DataFrame( rec)
-        mindf['geometry'] = mindf['geometri'].apply( wkt.loads )
-        mindf.drop( 'geometri', 1, inplace=True)
-        minGdf = gpd.GeoDataFrame( mindf, geometry='geometry', crs=5973 )       
-        minGdf.to_file( filnavn, layer='vegnett', driver="GPKG")  
+        records2gpkg( veg.iter_records(), filnavn, 'vegnett', typer=kolonner.kolonnetyper() )
 
 
 def dumpkontraktsomr( komr = [] ): 
@@ -494,7 +480,7 @@ def firefeltrapport( mittfilter={}):
 
     if len( data ) > 1: 
         mindf = pd.DataFrame( data )
-        mindf['geometry'] = mindf['geometri'].apply( wkt.loads )
+        mindf['geometry'] = tilgeometri( mindf['geometri'] )
         mindf.drop( 'geometri', 1, inplace=True)
         mindf.drop( 'kontraktsområder', 1, inplace=True)
         mindf.drop( 'riksvegruter', 1, inplace=True) 
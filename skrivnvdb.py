@@ -59,7 +59,6 @@ EKSEMPEL, fullstending løype
 
 	
 """
-import requests
 import json
 from datetime import datetime
 import getpass
@@ -331,7 +330,7 @@ def endringssett_mal( datakatalogversjon=None, operasjon='delvisOppdater'):
         dictionary med skjelett for endringssett (tom liste med vegobjekter)
     """
     if not datakatalogversjon: 
-        r = requests.get( 'https://www.vegvesen.no/nvdb/api/v3/status.json')
+        r = apiforbindelse().les( 'https://www.vegvesen.no/nvdb/api/v3/status.json')
         status = r.json()
         datakatalogversjon = status['datagrunnlag']['datakatalog']['versjon'] 
 
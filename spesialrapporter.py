@@ -14,7 +14,6 @@ import pdb
 from copy import deepcopy
 import sqlite3
 
-from shapely import wkt 
 # from shapely.ops import unary_union
 import pandas as pd 
 import geopandas as gpd 
@@ -23,6 +22,7 @@ import numpy as np
 
 import nvdbapiv3
 from nvdbapiv3 import apiforbindelse
+from nvdbapiv3.geometri import tilgeometri
 import nvdbgeotricks
 
 def splitBruksklasse_vekt( bruksklasse ): 
@@ -215,10 +215,10 @@ def brutusBKoverlapp( mittfilter=None, offisiell=False, kunEnTypeBK=None ):
 
 
     # Lager geodataframe 
-    bruer['geometry'] = bruer[ 'bru_geometri'].apply( lambda x : wkt.loads( x ) )
+    bruer['geometry'] = tilgeometri( bruer['bru_geometri'] )
     bruer = gpd.GeoDataFrame( bruer , geometry='geometry', crs=5973 ) 
 
-    sluttresultat['geometry'] =  sluttresultat[ 'bru_geometri'].apply( lambda x : wkt.loads( x ) )
+    sluttresultat['geometry'] =  tilgeometri( sluttresultat['bru_geometri'] )
     minGdf = gpd.GeoDataFrame( sluttresultat , geometry='geometry', crs=5973 ) 
 
     return minGdf